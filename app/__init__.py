@@ -32,12 +32,46 @@ def create_app(config_name: Optional[str] = None) -> Flask:
         config_name = os.environ.get("FLASK_ENV", "development")
     app.config.from_object(config[config_name])
 
-    # JSON レスポンスで日本語を文字化けさせない
+    # JSON のエンコーダーを選び（orjson があれば使う）、日本語を \uXXXX にエスケープさせない
+    from app import json_provider
+    json_provider.init_app(app)
     app.json.ensure_ascii = False
 
     # SQLAlchemy を Flask アプリに紐づけ、CLI コマンドを登録する
     db_init_app(app)
 
+    # リクエストごとのクエリ数・DB 時間などを計測し、Server-Timing ヘッダーと遅いリクエストのログに出す
+    from app import timing
+    timing.init_app(app)
+
+    # エンドポイントごとのリクエスト数・レイテンシを記録する（/metrics で公開）
+    from app import metrics
+    metrics.init_app(app)
+
+    # パスワードハッシュ計算用のプロセスプールを設定する（プロセス自体は初回利用時に起動）
+    from app.services import hash_pool
+    hash_pool.configure(app.config["PASSWORD_HASH_WORKERS"], app.config["PASSWORD_HASH_QUEUE_LIMIT"])
+
+    # 日記の変更イベントの配信（SSE）を設定する
+    from app.services import change_feed
+    change_feed.configure(app.config["CHANGE_FEED_QUEUE_SIZE"], app.config["CHANGE_FEED_SOCKET_DIR"])
+
+    # 新規登録・再ハッシュに使うハッシュ方式と計算コストを設定する
+    from app.services import password_hasher
+    password_hasher.configure(app.config["PASSWORD_HASHER"], app.config["PASSWORD_HASH_WORK_FACTOR"])
+
+    # レート制限の状態を保持するストアを用意する
+    from app import ratelimit
+    ratelimit.init_app(app)
+
+    # static のファイルを flask build-assets で作ったハッシュ入りの名前で配信する
+    from app import assets
+    assets.init_app(app)
+
+    # トップ・ログイン・登録ページの描画結果のキャッシュを用意する
+    from app import page_cache
+    page_cache.init_app(app)
+
     # モデルモジュールを import することで db.create_all() がテーブルを認識できる。
     # ローカル変数 app（Flask インスタンス）と名前が衝突しないよう from 形式で書く。
     # _models に束ねることで「副作用目的の import」であることを明示し、
@@ -45,10 +79,30 @@ def create_app(config_name: Optional[str] = None) -> Flask:
     from app import models as _models
     _ = _models
 
+    # ログイン中ユーザーのキャッシュはアプリごとに空から作る（テストで DB を作り直しても古い情報が残らない）
+    _models.User.configure_identity_cache(app.config["USER_CACHE_MAX_ENTRIES"], app.config["USER_CACHE_TTL_SECONDS"])
+
     from app.routes.auth import auth_bp
     from app.routes.diary import diary_bp
+    from app.routes.metrics import metrics_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(diary_bp)
+    app.register_blueprint(metrics_bp)
+
+    # 大きな JSON 等のレスポンスを Accept-Encoding に応じて圧縮する
+    if app.config["COMPRESSION_ENABLED"]:
+        from app.compression import CompressionMiddleware
+        app.wsgi_app = CompressionMiddleware(
+            app.wsgi_app,
+            min_size=app.config["COMPRESSION_MIN_SIZE"],
+            level=app.config["COMPRESSION_LEVEL"],
+            brotli_quality=app.config["COMPRESSION_BROTLI_QUALITY"],
+            mimetypes=app.config["COMPRESSION_MIMETYPES"],
+        )
+
+    # 運用向けの CLI コマンド（flask export-diaries 等）を登録する
+    from app import cli
+    cli.init_app(app)
 
     return app
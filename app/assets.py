@@ -0,0 +1,128 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import current_app, request, send_from_directory
+
+# ビルド結果を置く static 配下のディレクトリと、元のパス → ビルド後のパスの対応表
+BUILD_DIR = "dist"
+MANIFEST_NAME = "manifest.json"
+
+# ビルド対象から外す static 配下のディレクトリ（Tailwind の入力とビルド結果自身）
+_SKIP_DIRS = {"src", BUILD_DIR}
+# .gz を用意する拡張子（画像やフォントのように既に圧縮された形式は縮まないため対象外）
+_COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".map"}
+_HASH_LENGTH = 12
+
+# ファイル名に内容のハッシュを含むため、同じ URL の中身は変わらない。
+# ブラウザは1年間キャッシュし、immutable によりリロード時の再検証（304 の往復）もしない。
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def build(static_folder: str) -> dict:
+    """static 配下のファイルを、内容のハッシュ入りの名前で static/dist にコピーする。
+
+    ## フィンガープリント
+    css/style.css → dist/css/style.<ハッシュ>.css のように名前に内容のハッシュを入れる。
+    内容が変われば URL も変わるため、URL ごとに無期限でキャッシュさせても古い CSS が残らない。
+
+    ## 事前圧縮
+    テキスト系のファイルは最高圧縮レベルの .gz も並べて置き、配信時は圧縮済みのものを
+    そのまま返す（リクエストごとに圧縮しない）。縮まない場合は .gz を作らない。
+
+    古いビルドは消さない。デプロイの切り替え中に古い HTML を受け取ったブラウザも
+    古い URL のファイルを取得できるようにするため。
+
+    Returns:
+        元のパス → ビルド後のパス（いずれも static からの相対パス、区切りは /）の対応表
+    """
+    manifest = {}
+    out_root = os.path.join(static_folder, BUILD_DIR)
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        if dirpath == static_folder:
+            dirnames[:] = [d for d in dirnames if d not in _SKIP_DIRS]
+        for filename in sorted(filenames):
+            source = os.path.join(dirpath, filename)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, "/")
+            with open(source, "rb") as f:
+                data = f.read()
+            stem, ext = os.path.splitext(logical)
+            digest = hashlib.sha256(data).hexdigest()[:_HASH_LENGTH]
+            built = f"{BUILD_DIR}/{stem}.{digest}{ext}"
+            target = os.path.join(static_folder, *built.split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _write_atomic(target, data)
+            if ext in _COMPRESSIBLE:
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(compressed) < len(data):
+                    _write_atomic(target + ".gz", compressed)
+            manifest[logical] = built
+
+    os.makedirs(out_root, exist_ok=True)
+    _write_atomic(
+        os.path.join(out_root, MANIFEST_NAME),
+        json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"),
+    )
+    return manifest
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """一時ファイルに書いてから置き換え、配信中のワーカーに書きかけのファイルを見せない。"""
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def load_manifest(app) -> None:
+    """static/dist/manifest.json を読み込む。なければ（未ビルドなら）元のファイル名のまま配信する。"""
+    path = os.path.join(app.static_folder, BUILD_DIR, MANIFEST_NAME)
+    try:
+        with open(path, encoding="utf-8") as f:
+            app.extensions["assets"] = json.load(f)
+    except FileNotFoundError:
+        app.extensions["assets"] = {}
+
+
+def init_app(app) -> None:
+    """url_for("static", ...) をビルド後のファイル名に差し替え、static の配信を置き換える。
+
+    ## url_for の差し替え
+    app.url_defaults に登録した関数は、url_for が URL を組み立てる直前に呼ばれ、
+    引数を書き換えられる。テンプレートは url_for('static', filename='css/style.css') のまま、
+    ビルド済みなら /static/dist/css/style.<ハッシュ>.css が出力される。
+    """
+    load_manifest(app)
+
+    @app.url_defaults
+    def _fingerprint_static(endpoint, values):
+        if endpoint == "static" and "filename" in values:
+            built = current_app.extensions["assets"].get(values["filename"])
+            if built is not None:
+                values["filename"] = built
+
+    app.view_functions["static"] = _serve_static
+
+
+def _serve_static(filename: str):
+    """static のファイルを返す。ビルド済みのファイルは .gz と長期キャッシュで返す。
+
+    ビルド済みでないファイルは Flask 既定の static 配信と同じ扱い（ETag による再検証）。
+    """
+    static_folder = current_app.static_folder
+    if not filename.startswith(f"{BUILD_DIR}/"):
+        return current_app.send_static_file(filename)
+
+    gz_path = os.path.join(static_folder, *filename.split("/")) + ".gz"
+    if request.accept_encodings["gzip"] > 0 and os.path.isfile(gz_path):
+        response = send_from_directory(static_folder, filename + ".gz", max_age=31536000)
+        # Content-Type は .gz ではなく元のファイルの種類にする
+        response.mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = send_from_directory(static_folder, filename, max_age=31536000)
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
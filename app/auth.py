@@ -1,5 +1,7 @@
 from functools import wraps
-from flask import session, redirect, jsonify, request
+from flask import g, session, redirect, jsonify, request
+
+from app.models.user import User
 
 
 def login_required(f):
@@ -8,6 +10,11 @@ def login_required(f):
     @login_required を付けたルートは、セッションに user_id が存在しない場合に
     ブラウザリクエストは /signin へリダイレクト、AJAX リクエストは JSON エラーを返す。
 
+    ログイン中なら g.current_user にユーザーの軽量な情報（UserIdentity）を入れる。
+    ルートやテンプレートは g.current_user を使い、同じリクエスト内で users を引き直さない。
+    情報はプロセス内のキャッシュから取るため、通常はリクエストごとの SQL も発行されない。
+    セッションのユーザーが削除済みならセッションを破棄し、未ログインと同じ扱いにする。
+
     使い方:
         @app.route("/dashboard")
         @login_required
@@ -20,10 +27,19 @@ def login_required(f):
     """
     @wraps(f)
     def wrapper(*args, **kwargs):
-        if session.get("user_id") is None:
-            # AJAX リクエスト（JSON を期待している場合）は JSON で返す
-            if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
-                return jsonify({"error": "ログインしていません。"}), 401
-            return redirect("/signin")
+        user_id = session.get("user_id")
+        if user_id is None:
+            return _unauthenticated()
+        g.current_user = User.get_identity(user_id)
+        if g.current_user is None:
+            session.clear()
+            return _unauthenticated()
         return f(*args, **kwargs)
     return wrapper
+
+
+def _unauthenticated():
+    # AJAX リクエスト（JSON を期待している場合）は JSON で返す
+    if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
+        return jsonify({"error": "ログインしていません。"}), 401
+    return redirect("/signin")
@@ -0,0 +1,53 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """件数の上限（LRU）と有効期限（TTL）を持つ、スレッドセーフなプロセス内キャッシュ。
+
+    ## LRU
+    max_entries を超えたら、最も長く参照されていない項目から捨てる。
+    OrderedDict は参照のたびに末尾へ移動させておけば、先頭が常に「最も古い」項目になる。
+
+    ## TTL
+    別プロセスでの変更は invalidate() では伝わらないため、各項目は ttl_seconds で期限切れにする。
+    プロセスをまたぐ変更が見えるまでの遅れは、最大でも TTL に収まる。
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._items: "OrderedDict[Hashable, tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """有効な値を返す。なければ（期限切れを含む）None。"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: V) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,229 @@
+import gzip
+import json
+import logging
+import os
+import sys
+
+import click
+from flask import current_app
+
+from app import assets, loadtest, metrics, server
+from app.models.user import User
+from app.services import account_service, hash_pool, password_hasher
+from app.services.transfer_service import export_user_diaries, import_user_diaries
+
+
+def _find_user_or_fail(email: str) -> User:
+    user = User.find_by_email(email)
+    if user is None:
+        raise click.ClickException(f"ユーザーが見つかりません: {email}")
+    return user
+
+
+@click.command("export-diaries")
+@click.argument("email")
+@click.option(
+    "--output", "-o", type=click.Path(dir_okay=False, writable=True), default="-",
+    help="出力先ファイル（省略時は標準出力）。",
+)
+@click.option("--gzip", "use_gzip", is_flag=True, help="gzip 圧縮して書き出す。")
+def export_diaries_command(email: str, output: str, use_gzip: bool):
+    """CLI コマンド: flask export-diaries EMAIL で日記を NDJSON に書き出す。"""
+    user = _find_user_or_fail(email)
+    # gzip でも平文でもバイナリで開き、1行ずつ UTF-8 で書き込む
+    with click.open_file(output, "wb") as raw:
+        out = gzip.GzipFile(fileobj=raw, mode="wb") if use_gzip else raw
+        try:
+            for line in export_user_diaries(user.id):
+                out.write(line.encode("utf-8"))
+        finally:
+            if use_gzip:
+                # GzipFile を閉じないとトレーラーが書かれず、壊れた gzip になる
+                out.close()
+
+
+@click.command("import-diaries")
+@click.argument("email")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+def import_diaries_command(email: str, source: str):
+    """CLI コマンド: flask import-diaries EMAIL FILE で NDJSON から日記を登録する。
+
+    gzip 圧縮されたファイルは自動で判別して展開する。FILE に - を渡すと標準入力から読む。
+    """
+    user = _find_user_or_fail(email)
+    with click.open_file(source, "rb") as stream:
+        result = import_user_diaries(user.id, stream)
+    for error in result["errors"]:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Imported {result['imported']} entries, {result['error_count']} errors.")
+    if result["error_count"]:
+        sys.exit(1)
+
+
+@click.command("calibrate-hash")
+@click.option("--target-ms", type=click.FloatRange(min=1), default=150.0, show_default=True,
+              help="1回のハッシュ計算にかけたい時間（中央値）。")
+@click.option("--samples", type=click.IntRange(min=1), default=5, show_default=True,
+              help="1つの設定あたりの計測回数。")
+def calibrate_hash_command(target_ms: float, samples: int):
+    """CLI コマンド: flask calibrate-hash でこのマシンに合うハッシュの計算コストを求める。
+
+    本番と同じマシンで実行し、表示された値を PASSWORD_HASH_WORK_FACTOR に設定する。
+    ログインの応答時間はほぼこの計算時間で決まるため、目標は許容できるログイン時間から選ぶ。
+    """
+    name = current_app.config["PASSWORD_HASHER"]
+    work_factor, seconds = password_hasher.calibrate(name, target_ms / 1000, samples)
+    click.echo(f"{name}: work factor {work_factor} takes {seconds * 1000:.1f} ms (p50 of {samples})")
+    click.echo(f"PASSWORD_HASH_WORK_FACTOR={work_factor}")
+
+
+@click.command("build-assets")
+def build_assets_command():
+    """CLI コマンド: flask build-assets で static のファイルをハッシュ入りの名前で書き出す。
+
+    CSS を作り直した後（tailwindcss -i static/src/input.css -o static/css/style.css --minify）
+    とデプロイ前に実行する。結果は static/dist に置かれ、次回の起動から url_for が使う。
+    """
+    manifest = assets.build(current_app.static_folder)
+    assets.load_manifest(current_app)
+    for logical, built in sorted(manifest.items()):
+        click.echo(f"{logical} -> {built}")
+
+
+@click.command("delete-user")
+@click.argument("email")
+@click.option("--chunked", is_flag=True,
+              help="日記を少しずつ消してからアカウントを削除する（日記が非常に多いアカウント向け）。")
+@click.option("--batch-size", type=click.IntRange(min=1), default=account_service.PURGE_BATCH_SIZE,
+              show_default=True, help="--chunked で1回のトランザクションに消す行数。")
+def delete_user_command(email: str, chunked: bool, batch_size: int):
+    """CLI コマンド: flask delete-user EMAIL でアカウントと日記をすべて削除する。
+
+    稼働中のアプリの書き込みを止めたくない場合は --chunked を付ける。
+    途中で止めても、もう一度実行すれば残りから続きを消す。
+    """
+    user = _find_user_or_fail(email)
+    if chunked:
+        purged = account_service.purge_account(user.id, batch_size=batch_size)
+        click.echo(f"Deleted {email} ({purged} rows purged in batches of {batch_size}).")
+    else:
+        account_service.delete_account(user.id)
+        click.echo(f"Deleted {email}.")
+
+
+@click.command("loadtest")
+@click.option("--url", help="負荷をかけるサーバーの URL（省略時はこのプロセス内のアプリを直接呼ぶ）。")
+@click.option("--users", type=click.IntRange(min=1), default=50, show_default=True,
+              help="仮想ユーザー数（アカウントがなければ loadtest-N@example.com を登録する）。")
+@click.option("--concurrency", "-c", type=click.IntRange(min=1), default=8, show_default=True,
+              help="同時にリクエストを送るスレッド数。")
+@click.option("--duration", type=click.FloatRange(min=0, min_open=True), default=30.0, show_default=True,
+              help="負荷をかける秒数。")
+@click.option("--interval", type=click.FloatRange(min=0, min_open=True), default=1.0, show_default=True,
+              help="時系列の集計間隔（秒）。")
+@click.option("--mix", default="signin=1,list=6,create=2,update=1,delete=1", show_default=True,
+              help="操作ごとの重み。")
+@click.option("--replay", type=click.File("r", encoding="utf-8"),
+              help="記録した操作列（1行1つの {\"op\": ...}）。指定すると --mix より優先する。")
+@click.option("--seed", type=int, help="操作の順序を決める乱数の種。")
+@click.option("--json", "json_output", type=click.File("w", encoding="utf-8"),
+              help="集計結果を JSON で書き出すパス。")
+def loadtest_command(url, users, concurrency, duration, interval, mix, replay, seed, json_output):
+    """CLI コマンド: flask loadtest で並行アクセスの負荷をかけ、スループットとレイテンシを表示する。
+
+    --concurrency を 1, 2, 4, 8, ... と上げながら実行し、req/s が伸びなくなって
+    p95 だけが増え始める点が、その SQLite とワーカー構成の上限の目安になる。
+
+    --url を省略するとこのプロセス内のアプリを直接呼ぶ（ネットワークとサーバーを除いた上限）。
+    その場合、測定の邪魔になるレート制限は無効にする。--url で起動中のサーバーを測る場合は、
+    サーバー側で RATELIMIT_ENABLED=false にしておかないと 429 がエラーとして数えられる。
+    """
+    try:
+        operations = dict(script=loadtest.load_script(replay)) if replay else dict(mix=loadtest.parse_mix(mix))
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    if url:
+        transport = loadtest.HttpTransport(url)
+    else:
+        current_app.config["RATELIMIT_ENABLED"] = False
+        transport = loadtest.WsgiTransport(current_app._get_current_object())
+
+    click.echo(f"target={url or 'in-process'} users={users} concurrency={concurrency} duration={duration}s")
+    report = loadtest.run(transport, users, concurrency, duration, interval, seed=seed, **operations)
+
+    bounds = [f"<{b}" for b in loadtest.HISTOGRAM_BOUNDS_MS] + [f">={loadtest.HISTOGRAM_BOUNDS_MS[-1]}"]
+    click.echo(f"{'t(s)':>6}{'req/s':>9}{'err%':>7}{'p50':>8}{'p95':>8}{'p99':>8}  "
+               + " ".join(f"{b:>6}" for b in bounds) + "  (ms)")
+    for row in report.timeline():
+        click.echo(f"{row['start']:>6.1f}{row['rps']:>9.1f}{row['error_rate'] * 100:>7.1f}"
+                   f"{row['p50_ms']:>8.1f}{row['p95_ms']:>8.1f}{row['p99_ms']:>8.1f}  "
+                   + " ".join(f"{count:>6}" for count in row["histogram"]))
+    click.echo("")
+    click.echo(f"{'operation':<10}{'count':>8}{'req/s':>9}{'err%':>7}{'p50':>8}{'p95':>8}{'p99':>8}  statuses")
+    for name, row in [*report.by_operation().items(), ("total", report.total())]:
+        statuses = " ".join(f"{code}:{count}" for code, count in sorted(row["statuses"].items()))
+        click.echo(f"{name:<10}{row['requests']:>8}{row['rps']:>9.1f}{row['error_rate'] * 100:>7.1f}"
+                   f"{row['p50_ms']:>8.1f}{row['p95_ms']:>8.1f}{row['p99_ms']:>8.1f}  {statuses}")
+    if json_output:
+        json.dump(report.to_dict(), json_output, indent=2)
+
+
+def _share_hash_pool(app, workers: int) -> None:
+    """ワーカー全体のハッシュ計算プロセスが CPU コア数を超えないよう、ワーカーごとの数を減らす。
+
+    PASSWORD_HASH_WORKERS はワーカーごとのプロセス数なので、本番の既定（コア数）のまま
+    workers 個のワーカーを起動すると、合計でコア数 × workers 個のプロセスが CPU を奪い合う。
+    環境変数で明示的に指定されている場合は、その値をそのまま使う。
+    """
+    if "PASSWORD_HASH_WORKERS" in os.environ:
+        return
+    per_worker = max(1, (os.cpu_count() or 1) // workers)
+    if app.config["PASSWORD_HASH_WORKERS"] <= per_worker:
+        return
+    app.config["PASSWORD_HASH_WORKERS"] = per_worker
+    hash_pool.configure(per_worker, app.config["PASSWORD_HASH_QUEUE_LIMIT"])
+
+
+@click.command("serve")
+@click.option("--host", default="127.0.0.1", show_default=True,
+              help="待ち受けるアドレス（全インターフェースなら 0.0.0.0）。")
+@click.option("--port", "-p", type=click.IntRange(min=0, max=65535), default=8000, show_default=True)
+@click.option("--workers", "-w", type=click.IntRange(min=1), default=os.cpu_count() or 1, show_default=True,
+              help="ワーカープロセスの数。")
+@click.option("--threads", type=click.IntRange(min=1), default=4, show_default=True,
+              help="1ワーカーあたりの同時処理数（SSE の接続は含まない）。")
+@click.option("--streams", type=click.IntRange(min=1), default=100, show_default=True,
+              help="1ワーカーあたりの SSE 接続の上限。超えた接続には 503 を返す。")
+@click.option("--graceful-timeout", type=click.FloatRange(min=0), default=30.0, show_default=True,
+              help="停止時に処理中のリクエストを待つ秒数。")
+@click.option("--config", "config_name", default="production", show_default=True,
+              help="create_app() に渡す設定名。")
+def serve_command(host, port, workers, threads, streams, graceful_timeout, config_name):
+    """CLI コマンド: flask serve で複数のワーカープロセスによる本番向けサーバーを起動する。
+
+    アプリは fork の前に1回だけ作る。落ちたワーカーは起動し直し、
+    SIGTERM（Ctrl+C）では処理中のリクエストを終えてから止まる。
+    PASSWORD_HASH_WORKERS を指定しなければ、ワーカーごとのハッシュ計算プロセスは
+    コア数 ÷ workers（最低1）になる。指定した場合はワーカーごとにその数が起動する。
+    """
+    from app import create_app
+
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(levelname)s %(message)s")
+    app = create_app(config_name)
+    _share_hash_pool(app, workers)
+    listener = server.listen(host, port)
+    # 前回の起動で終了したワーカーの値を合算しないよう、スナップショットを消しておく
+    metrics.clear_snapshots()
+    server.serve(app, listener, workers, threads, graceful_timeout, streams)
+
+
+def init_app(app):
+    """Flask アプリに CLI コマンドを登録する。"""
+    app.cli.add_command(export_diaries_command)
+    app.cli.add_command(import_diaries_command)
+    app.cli.add_command(calibrate_hash_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(delete_user_command)
+    app.cli.add_command(loadtest_command)
+    app.cli.add_command(serve_command)
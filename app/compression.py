@@ -0,0 +1,204 @@
+import zlib
+from typing import Callable, Iterable, Iterator, Optional
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header, parse_options_header
+
+try:
+    # brotli は任意の依存。インストールされていれば br も選べるようにする。
+    import brotli
+except ImportError:  # pragma: no cover - 環境による
+    brotli = None
+
+
+class _GzipEncoder:
+    def __init__(self, level: int):
+        # wbits=31 は zlib に gzip ヘッダー・トレーラー付きで出力させる指定
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        # Z_SYNC_FLUSH でチャンクごとに出力を区切り、ストリーミング中のデータを溜め込まない
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    """レスポンス本文を Accept-Encoding に応じて gzip（または br）で圧縮する WSGI ミドルウェア。
+
+    ## なぜ WSGI 層で行うか
+    ルートごとに圧縮を書かなくても、jsonify の一括レスポンスも
+    ?stream=1 のようなストリーミングレスポンスも同じ仕組みで圧縮できる。
+    日記の JSON は日本語の本文が大半で、gzip で数分の1の大きさになる。
+
+    ## 圧縮しないもの
+    - min_size バイト未満の本文（圧縮のオーバーヘッドの方が大きい）
+    - mimetypes に含まれない種類（画像や、既に gzip 済みのエクスポートなど）
+    - Content-Encoding が既に付いているもの（描画済みページのキャッシュや static の .gz）
+    - 1xx / 204 / 304、HEAD リクエスト、Cache-Control: no-transform
+
+    ## ストリーミング
+    Content-Length が分からない本文は、min_size に達するまでチャンクを溜めてから判断する。
+    圧縮すると決めた後は、受け取ったチャンクをその都度圧縮して送り出すため、
+    本文全体をメモリに溜めることはない。
+
+    WSGI の start_response が返す write() 呼び出しには対応しない（Flask は使わない）。
+    """
+
+    def __init__(
+        self,
+        app: Callable,
+        min_size: int = 1024,
+        level: int = 6,
+        brotli_quality: int = 4,
+        mimetypes: Iterable[str] = ("application/json",),
+    ):
+        self.app = app
+        self.min_size = min_size
+        self.mimetypes = frozenset(mimetypes)
+        self._encoders = {"gzip": lambda: _GzipEncoder(level)}
+        if brotli is not None:
+            self._encoders["br"] = lambda: _BrotliEncoder(brotli_quality)
+
+    def __call__(self, environ, start_response):
+        if environ.get("REQUEST_METHOD") == "HEAD":
+            return self.app(environ, start_response)
+        encoding = self._negotiate(environ.get("HTTP_ACCEPT_ENCODING"))
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            # 本文の最初のチャンクを見るまで、本物の start_response は呼ばない
+            captured.update(status=status, headers=headers, exc_info=exc_info)
+            return _unsupported_write
+
+        body = self.app(environ, capture_start_response)
+        return _CompressingBody(self, body, captured, start_response, encoding)
+
+    def _negotiate(self, accept_encoding: Optional[str]) -> Optional[str]:
+        """Accept-Encoding の q 値が最も高い方式を選ぶ。同じ q 値なら br を優先する。"""
+        accept = parse_accept_header(accept_encoding)
+        preferred = ["br", "gzip"] if "br" in self._encoders else ["gzip"]
+        return accept.best_match(preferred)
+
+    def _is_candidate(self, status: str, headers: Headers) -> bool:
+        """本文の大きさ以外の条件で、圧縮してよいレスポンスかを判定する。
+
+        200 以外は圧縮しない。206 Partial Content の本文は元の表現の一部で、
+        Content-Range のバイト位置は圧縮前の本文を指すため、圧縮すると食い違う。
+        """
+        if int(status.split(" ", 1)[0]) != 200:
+            return False
+        if "Content-Range" in headers or "Content-Encoding" in headers:
+            return False
+        if "no-transform" in headers.get("Cache-Control", ""):
+            return False
+        mimetype, _ = parse_options_header(headers.get("Content-Type", ""))
+        return mimetype in self.mimetypes
+
+
+class _CompressingBody:
+    """WSGI の本文（イテラブル）を包み、必要なら圧縮しながら返す。
+
+    close() を元の本文に伝える（stream_with_context 等の後始末を走らせる）ため、
+    ジェネレータ関数ではなく close() を持つクラスにしている。
+    """
+
+    def __init__(self, middleware: CompressionMiddleware, body, captured: dict,
+                 start_response: Callable, encoding: Optional[str]):
+        self._mw = middleware
+        self._body = body
+        self._captured = captured
+        self._start_response = start_response
+        self._encoding = encoding
+
+    def __iter__(self) -> Iterator[bytes]:
+        pending, pending_size = [], 0
+        encoder = None
+        decided = False
+        for chunk in self._body:
+            if decided:
+                if encoder is None:
+                    yield chunk
+                else:
+                    data = encoder.compress(chunk)
+                    if data:
+                        yield data
+                continue
+            if not chunk:
+                continue
+            pending.append(chunk)
+            pending_size += len(chunk)
+            verdict = self._verdict(pending_size, finished=False)
+            if verdict is None:
+                continue  # 大きさがまだ分からない。次のチャンクを待つ
+            decided = True
+            encoder = self._start(verdict)
+            yield from self._flush_pending(pending, encoder)
+            pending = []
+
+        if not decided:
+            encoder = self._start(self._verdict(pending_size, finished=True))
+            yield from self._flush_pending(pending, encoder)
+        if encoder is not None:
+            yield encoder.finish()
+
+    def close(self) -> None:
+        if hasattr(self._body, "close"):
+            self._body.close()
+
+    def _verdict(self, size: int, finished: bool) -> Optional[bool]:
+        """圧縮するなら True、しないなら False、本文をもっと読まないと決められなければ None。"""
+        headers = Headers(self._captured["headers"])
+        if self._encoding is None or not self._mw._is_candidate(self._captured["status"], headers):
+            return False
+        if "Content-Length" in headers:
+            return int(headers["Content-Length"]) >= self._mw.min_size
+        if size >= self._mw.min_size:
+            return True
+        return False if finished else None
+
+    def _start(self, compress: bool):
+        """ヘッダーを確定して本物の start_response を呼び、使うエンコーダーを返す。"""
+        status = self._captured["status"]
+        headers = Headers(self._captured["headers"])
+        if self._mw._is_candidate(status, headers):
+            # 圧縮するかどうかが Accept-Encoding で変わるため、キャッシュに区別させる
+            vary = [v.strip() for v in headers.get("Vary", "").split(",") if v.strip()]
+            if "accept-encoding" not in {v.lower() for v in vary}:
+                headers["Vary"] = ", ".join(vary + ["Accept-Encoding"])
+        encoder = None
+        if compress:
+            encoder = self._mw._encoders[self._encoding]()
+            headers["Content-Encoding"] = self._encoding
+            headers.pop("Content-Length", None)
+            # 強い ETag はバイト列の一致を表すため、圧縮後の本文には弱い ETag として付け直す
+            etag = headers.get("ETag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+        self._start_response(status, headers.to_wsgi_list(), self._captured["exc_info"])
+        return encoder
+
+    @staticmethod
+    def _flush_pending(pending: list, encoder) -> Iterator[bytes]:
+        if encoder is None:
+            yield from pending
+            return
+        data = encoder.compress(b"".join(pending))
+        if data:
+            yield data
+
+
+def _unsupported_write(data: bytes) -> None:
+    raise RuntimeError("CompressionMiddleware does not support the WSGI write() callable")
@@ -3,6 +3,42 @@ import os
 _BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 _DB_PATH = os.path.join(_BASE_DIR, "instance", "diary.db")
 
+# 接続ごとに発行する SQLite の PRAGMA のプロファイル。
+# "default" は SQLite の既定値のまま（ロールバックジャーナル）。
+# "tuned" は複数スレッドから同時にアクセスされる本番向けの設定:
+# - journal_mode=WAL: 読み取りが書き込みをブロックせず、書き込みも読み取りを待たない
+# - synchronous=NORMAL: WAL ではコミットごとの fsync を省いても DB は壊れない
+#   （電源断時に直前のコミットが失われうるだけ）
+# - busy_timeout: 書き込みロックが取れないとき即 "database is locked" にせず最大 N ミリ秒待つ
+# - mmap_size: DB ファイルをメモリマップして read() のシステムコールとコピーを減らす
+# - cache_size: 負の値は KiB 単位。接続ごとのページキャッシュを 64 MiB にする
+# - temp_store=MEMORY: ソート等の一時データをファイルではなくメモリに置く
+SQLITE_PRAGMA_PROFILES = {
+    "default": {},
+    "tuned": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def _pool_options(prefix: str) -> dict:
+    """環境変数 <prefix>_POOL_SIZE / <prefix>_POOL_PRE_PING からエンジンのプール設定を作る。
+
+    指定されたものだけを返す。インメモリ SQLite が使う StaticPool は pool_size を
+    受け付けないため、未指定のキーは渡さずに SQLAlchemy の既定値に任せる。
+    """
+    options = {}
+    if os.environ.get(f"{prefix}_POOL_SIZE"):
+        options["pool_size"] = int(os.environ[f"{prefix}_POOL_SIZE"])
+    if os.environ.get(f"{prefix}_POOL_PRE_PING"):
+        options["pool_pre_ping"] = os.environ[f"{prefix}_POOL_PRE_PING"].lower() in ("1", "true", "yes")
+    return options
+
 
 class Config:
     """全環境共通の設定基底クラス。"""
@@ -12,14 +48,122 @@ class Config:
     # SQLite の場合は "sqlite:///絶対パス" の形式になる（スラッシュが3つ）。
     SQLALCHEMY_DATABASE_URI = f"sqlite:///{_DB_PATH}"
 
+    # プライマリ（書き込み先）エンジンのプール設定。DB_POOL_SIZE / DB_POOL_PRE_PING で指定する。
+    SQLALCHEMY_ENGINE_OPTIONS = _pool_options("DB")
+
+    # 読み取り専用レプリカ。REPLICA_DATABASE_URL を指定すると "replica" バインドが作られ、
+    # 一覧・検索・ログイン時のユーザー検索がレプリカに振り分けられる。
+    # プール設定は REPLICA_POOL_SIZE / REPLICA_POOL_PRE_PING でプライマリとは別に指定できる。
+    SQLALCHEMY_BINDS = (
+        {"replica": {"url": os.environ["REPLICA_DATABASE_URL"], **_pool_options("REPLICA")}}
+        if os.environ.get("REPLICA_DATABASE_URL")
+        else {}
+    )
+
+    # 書き込みを行ったユーザーの読み取りを、その後この秒数だけプライマリに固定する。
+    # レプリカへの反映が遅れても、自分が書いた内容が次の画面で消えて見えないようにするため。
+    # レプリカの同期間隔より長くしておく。
+    REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", "10"))
+
+    # パスワードハッシュ計算に使うプロセス数。0 ならリクエストのスレッドでそのまま計算する。
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "0"))
+    # 全プロセスが計算中のときに待たせてよい件数。超えた分は即座に 503 を返す。
+    PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get("PASSWORD_HASH_QUEUE_LIMIT", "16"))
+
+    # パスワードのハッシュ方式（app.services.password_hasher.HASHERS のキー）と計算コスト。
+    # pbkdf2 の work factor はイテレーション回数で、省略時は Werkzeug の既定値。
+    # 値は flask calibrate-hash で、このマシンのログイン所要時間から決められる。
+    # 変更しても既存のハッシュはそのまま照合でき、各ユーザーの次回ログイン時に新しい設定で作り直される。
+    PASSWORD_HASHER = os.environ.get("PASSWORD_HASHER", "pbkdf2")
+    PASSWORD_HASH_WORK_FACTOR = (
+        int(os.environ["PASSWORD_HASH_WORK_FACTOR"])
+        if os.environ.get("PASSWORD_HASH_WORK_FACTOR")
+        else None
+    )
+
+    # レート制限（app.ratelimit）。スコープごとに {"ip" / "account": (回数, 秒)} を指定する。
+    # 「秒 をかけて 回数 ぶん回復し、最大 回数 まで連続で許可」するトークンバケット。
+    # auth の account はフォームのメールアドレス、write の account はログイン中のユーザー。
+    RATELIMIT_ENABLED = os.environ.get("RATELIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+    RATE_LIMITS = {
+        "auth": {"ip": (20, 60), "account": (5, 60)},
+        "register": {"ip": (5, 600)},
+        "write": {"ip": (120, 60), "account": (60, 60)},
+    }
+    # 同じホストの複数ワーカーで上限を共有する場合の SQLite ファイル。未指定ならプロセスごとのメモリ。
+    RATELIMIT_STORAGE_PATH = os.environ.get("RATELIMIT_STORAGE_PATH")
+    # 状態を保持するキー（IP・アカウント）の最大数。超えたら最も古いものから捨てる。
+    RATELIMIT_MAX_KEYS = int(os.environ.get("RATELIMIT_MAX_KEYS", "10000"))
+
+    # ログイン中ユーザーの情報（User.get_identity）をプロセス内にキャッシュする件数と秒数。
+    # 別ワーカーでのユーザー名変更・削除は、最大でこの秒数だけ遅れて反映される。
+    USER_CACHE_MAX_ENTRIES = int(os.environ.get("USER_CACHE_MAX_ENTRIES", "10000"))
+    USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "60"))
+
+    # トップ・ログイン・登録ページの描画結果（と圧縮版）のキャッシュ（app.page_cache）。
+    # テンプレートはデプロイ時にしか変わらないため、有効期限は長めでよい。
+    PAGE_CACHE_ENABLED = True
+    PAGE_CACHE_MAX_ENTRIES = 64
+    PAGE_CACHE_TTL_SECONDS = 3600
+
+    # レスポンス圧縮（app.compression.CompressionMiddleware）。
+    # COMPRESSION_MIN_SIZE バイト以上の、COMPRESSION_MIMETYPES の本文だけを圧縮する。
+    # COMPRESSION_LEVEL は gzip の圧縮レベル（1〜9。大きいほど小さくなるが CPU を使う）、
+    # COMPRESSION_BROTLI_QUALITY は brotli がインストールされている場合の br の品質（0〜11）。
+    COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+    COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+    COMPRESSION_LEVEL = int(os.environ.get("COMPRESSION_LEVEL", "6"))
+    COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", "4"))
+    COMPRESSION_MIMETYPES = (
+        "application/json",
+        "application/x-ndjson",
+        "text/html",
+        "text/plain",
+        "text/css",
+        "text/javascript",
+    )
+
+    # 日記の変更イベント（/diary/events の SSE）。
+    # CHANGE_FEED_QUEUE_SIZE は1接続に溜めておけるイベント数で、溢れたら一覧の取得し直し（resync）を送る。
+    # 複数のワーカープロセスで動かす場合は CHANGE_FEED_SOCKET_DIR を指定すると、
+    # 各プロセスがそこに Unix ソケットを作り、どのプロセスで起きた変更も全接続に届く。
+    CHANGE_FEED_QUEUE_SIZE = int(os.environ.get("CHANGE_FEED_QUEUE_SIZE", "100"))
+    CHANGE_FEED_SOCKET_DIR = os.environ.get("CHANGE_FEED_SOCKET_DIR")
+    SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15"))
+
+    # app.json のエンコーダー（auto / orjson / stdlib）。auto は orjson がインストールされていれば使う。
+    JSON_PROVIDER = os.environ.get("JSON_PROVIDER", "auto")
+
+    # リクエストごとの計測（app.timing）。
+    # SERVER_TIMING_ENABLED なら、クエリ数・DB 時間・テンプレート描画時間・処理時間を
+    # Server-Timing ヘッダーで返す（内部の情報なので本番では既定で返さない）。
+    # SLOW_QUERY_MS / SLOW_REQUEST_MS 以上かかったクエリ・リクエストは app.timing のロガーに記録する。
+    SERVER_TIMING_ENABLED = os.environ.get("SERVER_TIMING_ENABLED", "false").lower() in ("1", "true", "yes")
+    SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+    SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "500"))
+
+    # /metrics（Prometheus のテキスト形式）。METRICS_TOKEN が未設定なら 404 を返す。
+    # 複数のワーカープロセスで動かす場合は METRICS_DIR を指定すると、各プロセスが
+    # METRICS_FLUSH_SECONDS ごとにそこへ値を書き出し、/metrics が全プロセス分を合算する。
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+    METRICS_DIR = os.environ.get("METRICS_DIR")
+    METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "1"))
+
     # SQLAlchemy がモデルの変更を追跡する機能（不要なためオフ）。
     # True にするとメモリを余分に使うので、明示的に False を設定しておく。
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # 新しい DB 接続ごとに適用する SQLite の PRAGMA（SQLITE_PRAGMA_PROFILES のキー）
+    SQLITE_PRAGMA_PROFILE = os.environ.get("SQLITE_PRAGMA_PROFILE", "default")
+
 
 class DevelopmentConfig(Config):
     """開発環境の設定。デバッグモードを有効にする。"""
     DEBUG = True
+    # テンプレートを編集したらすぐ反映されるよう、描画結果をキャッシュしない
+    PAGE_CACHE_ENABLED = False
+    # ブラウザの開発者ツールでリクエストごとの DB 時間を確認できるようにする
+    SERVER_TIMING_ENABLED = True
 
 
 class TestingConfig(Config):
@@ -28,11 +172,27 @@ class TestingConfig(Config):
     # テスト用インメモリ DB の URI。
     # "sqlite:///:memory:" は接続を閉じると DB が消える揮発的な SQLite DB。
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    # 環境変数のプール設定・レプリカ設定がテストに影響しないようにする
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    SQLALCHEMY_BINDS = {}
+    PASSWORD_HASH_WORKERS = 0
+    CHANGE_FEED_SOCKET_DIR = None
+    # 同じクライアントから連続で操作するテストが 429 にならないようにする
+    RATELIMIT_ENABLED = False
+    RATELIMIT_STORAGE_PATH = None
+    # テストではハッシュ計算を最小限にして実行時間を短くする（安全性は問わない）
+    PASSWORD_HASH_WORK_FACTOR = 1_000
+    SERVER_TIMING_ENABLED = True
+    METRICS_DIR = None
 
 
 class ProductionConfig(Config):
     """本番環境の設定。デバッグ無効・SECRET_KEY 必須。"""
     DEBUG = False
+    SQLITE_PRAGMA_PROFILE = os.environ.get("SQLITE_PRAGMA_PROFILE", "tuned")
+    # 本番では既定で CPU コア数ぶんのプロセスでハッシュを計算する
+    # （flask serve は指定がなければ、これをワーカー数で割った数にする）
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
 
     @classmethod
     def init_app(cls, app):
@@ -1,19 +1,178 @@
+import sqlite3
+import time
+from contextlib import closing
+from typing import Callable, List
+
 import click
+from flask import current_app, has_request_context, session
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Connection, Engine, make_url
+from sqlalchemy.schema import CreateColumn
+
+from app.config import SQLITE_PRAGMA_PROFILES
 
 # SQLAlchemy のシングルトンインスタンス。
 # このオブジェクトを models/ でインポートして db.Model を継承する。
 # create_app() で db.init_app(app) を呼ぶことで Flask アプリに紐づく。
 db = SQLAlchemy()
 
+# 読み取り専用レプリカのバインド名（Config.SQLALCHEMY_BINDS のキー）
+REPLICA_BIND_KEY = "replica"
+
+# 書き込み後に読み取りをプライマリへ固定する期限を保存する Flask セッションのキー
+_STICKY_SESSION_KEY = "_primary_until"
+
+# SQLITE_PRAGMA_PROFILE に関係なく、すべての SQLite 接続で発行する PRAGMA。
+# SQLite は互換性のため外部キー制約を既定で無視する。接続ごとに有効にしないと、
+# ForeignKey(..., ondelete="CASCADE") を宣言していても DB は何もしない。
+_REQUIRED_SQLITE_PRAGMAS = {"foreign_keys": "ON"}
+
+# init_db() がカラム追加の後に実行するデータ移行。models/ のモジュールが @data_migration で登録する。
+_data_migrations: List[Callable[[Connection], None]] = []
+
+
+def data_migration(func: Callable[[Connection], None]) -> Callable[[Connection], None]:
+    """既存 DB のデータを新しいスキーマに合わせる関数を init_db() に登録するデコレータ。
+
+    関数はカラムの追加が済んだ後、インデックスを作る前に、1つのトランザクションの中で
+    接続を受け取って呼ばれる。init_db() のたびに呼ばれるため、何度実行しても
+    同じ結果になる（移行済みの行には何もしない）ように書くこと。
+    """
+    _data_migrations.append(func)
+    return func
+
+
+def read_bind_arguments() -> dict:
+    """読み取り専用クエリに渡す bind_arguments を返す。
+
+    ## 読み書き分離
+    レプリカが設定されていれば {"bind": レプリカのエンジン} を返し、
+    `db.session.scalars(stmt, bind_arguments=read_bind_arguments())` のように渡すと
+    そのクエリだけがレプリカで実行される。書き込み（flush / commit）は常にプライマリに行く。
+
+    ## read-your-writes
+    レプリカへの反映には遅れがあるため、次の場合は空の辞書（= プライマリ）を返す:
+    - 同じリクエスト内で既に書き込みを行った
+    - このユーザーが直近 REPLICA_STICKY_SECONDS 秒以内に書き込みを行った
+    """
+    engines = db.engines
+    if REPLICA_BIND_KEY not in engines or db.session.info.get("wrote"):
+        return {}
+    if has_request_context() and session.get(_STICKY_SESSION_KEY, 0) > time.time():
+        return {}
+    return {"bind": engines[REPLICA_BIND_KEY]}
+
+
+@event.listens_for(db.session, "after_flush")
+def _mark_wrote_on_flush(sess, flush_context):
+    """ORM オブジェクトの INSERT / UPDATE / DELETE を flush したら書き込み済みとして記録する。"""
+    sess.info["wrote"] = True
+
+
+@event.listens_for(db.session, "do_orm_execute")
+def _mark_wrote_on_dml(orm_execute_state):
+    """session.execute() による一括 INSERT / UPDATE / DELETE も書き込み済みとして記録する。
+
+    session.info はリクエスト終了時にセッションごと破棄されるため、
+    記録はそのリクエストの間だけ有効になる。
+    """
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+def _stick_to_primary_after_write(response):
+    """書き込みのあったリクエストの後、しばらくそのユーザーの読み取りをプライマリに固定する。"""
+    seconds = current_app.config["REPLICA_STICKY_SECONDS"]
+    if REPLICA_BIND_KEY in db.engines and db.session.info.get("wrote") and seconds > 0:
+        session[_STICKY_SESSION_KEY] = time.time() + seconds
+    return response
+
 
 def init_db():
     """テーブルが存在しない場合のみ全テーブルを作成する。
 
     SQLAlchemy は db.Model を継承したクラスの Column 定義から
     CREATE TABLE 文を自動生成する（スキーマを Python コードで宣言的に管理できる）。
+
+    ## 既存テーブルへのカラム・インデックス追加
+    create_all() はテーブルが既に存在すると、そのテーブルには何もしない。
+    後からモデルに追加したカラムとインデックスを既存 DB にも反映するため、
+    不足しているカラムは ALTER TABLE ADD COLUMN で、インデックスは
+    checkfirst=True（存在しなければ作成）で個別に発行する。
+    追加したカラムに既存行の値を入れる処理は @data_migration で登録しておく。
+
+    スキーマを作るのはプライマリだけ。レプリカはプライマリの複製として作られる。
+    """
+    db.create_all(bind_key=None)
+    _add_missing_columns()
+    # 新しいインデックスは移行後の値で一度に作るほうが、行ごとに更新するより速い
+    with db.engine.begin() as conn:
+        for migrate in _data_migrations:
+            migrate(conn)
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def _add_missing_columns():
+    """モデルに宣言されているが DB に存在しないカラムを追加する。
+
+    追加するカラムは NULL 許容か server_default を持つ必要がある
+    （既存行に入れる値がないと ALTER TABLE が失敗するため）。
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+
+def apply_sqlite_pragmas(engine: Engine, pragmas: dict) -> None:
+    """engine が新しく開く SQLite 接続すべてに PRAGMA を発行するよう登録する。
+
+    ## なぜ接続ごとに発行するのか
+    journal_mode=WAL は DB ファイルに記録され永続するが、synchronous・busy_timeout・
+    cache_size などは接続単位の設定で、接続を開き直すと既定値に戻る。
+    接続プールが新しい接続を作るたびに呼ばれる "connect" イベントで発行すれば、
+    どの接続も必ず同じ設定になる。
     """
-    db.create_all()
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def instrument_queries(engine: Engine, slow_query_seconds: float) -> None:
+    """engine で実行されるクエリの所要時間を app.timing に渡すよう登録する。
+
+    ## 計測の仕組み
+    before_cursor_execute / after_cursor_execute は DBAPI の cursor.execute() の直前・直後に
+    呼ばれる。開始時刻を接続の info に積んでおき、終了時に取り出して差を求める。
+    ORM・Core・生の SQL のどれで発行しても同じく数えられ、
+    リクエストごとのクエリ数（N+1 の検出）と遅いクエリのログに使われる。
+    """
+    from app import timing
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _finish_query(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_started"].pop()
+        timing.record_query(statement, parameters, executemany, seconds, slow_query_seconds)
 
 
 @click.command("init-db")
@@ -23,6 +182,34 @@ def init_db_command():
     click.echo("Database initialized.")
 
 
+@click.command("sync-replica")
+@click.option(
+    "--interval", type=float, default=0,
+    help="指定すると、その秒数ごとに同期を繰り返す（Ctrl+C で終了）。",
+)
+def sync_replica_command(interval: float):
+    """CLI コマンド: flask sync-replica でプライマリの SQLite ファイルをレプリカへ複製する。
+
+    ローカルで読み書き分離を試すための簡易レプリケーション。
+    SQLite のオンラインバックアップ API を使うため、アプリの稼働中でも一貫した複製が取れる。
+    """
+    engines = db.engines
+    if REPLICA_BIND_KEY not in engines:
+        raise click.ClickException("REPLICA_DATABASE_URL が設定されていません。")
+    primary, replica = make_url(str(engines[None].url)), make_url(str(engines[REPLICA_BIND_KEY].url))
+    if primary.get_backend_name() != "sqlite" or replica.get_backend_name() != "sqlite":
+        raise click.ClickException("sync-replica は SQLite ファイル同士でのみ使えます。")
+
+    while True:
+        with closing(sqlite3.connect(primary.database)) as src, \
+                closing(sqlite3.connect(replica.database)) as dst:
+            src.backup(dst)
+        click.echo(f"Replicated {primary.database} -> {replica.database}")
+        if interval <= 0:
+            break
+        time.sleep(interval)
+
+
 def init_app(app):
     """Flask アプリに SQLAlchemy を紐づけ、CLI コマンドを登録する。
 
@@ -30,6 +217,20 @@ def init_app(app):
     SQLALCHEMY_DATABASE_URI に接続せよ」と SQLAlchemy に伝える処理。
     接続のライフサイクル管理（リクエスト終了時のクローズ等）は
     Flask-SQLAlchemy が自動で行うため、teardown_appcontext の手動登録は不要になる。
+
+    エンジンは db.init_app(app) の時点で作られるため、その直後に
+    外部キー制約の有効化・SQLITE_PRAGMA_PROFILE の PRAGMA・クエリの計測を
+    各エンジンへ登録する（最初の接続より前に間に合う）。
     """
     db.init_app(app)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(sync_replica_command)
+    app.after_request(_stick_to_primary_after_write)
+
+    profile = app.config["SQLITE_PRAGMA_PROFILE"]
+    if profile not in SQLITE_PRAGMA_PROFILES:
+        raise RuntimeError(f"Unknown SQLITE_PRAGMA_PROFILE: {profile}")
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine, {**_REQUIRED_SQLITE_PRAGMAS, **SQLITE_PRAGMA_PROFILES[profile]})
+            instrument_queries(engine, app.config["SLOW_QUERY_MS"] / 1000)
@@ -0,0 +1,79 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    # orjson は任意の依存。インストールされていれば JSON のエンコードに使う。
+    import orjson
+except ImportError:  # pragma: no cover - 環境による
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """app.json のエンコードを orjson で行う JSON プロバイダ。
+
+    ## なぜ差し替えるか
+    日記一覧の JSON はほぼ日本語の本文で、件数が多いと標準の json モジュールでの
+    エンコードがレスポンス時間の大半を占める。orjson は C 拡張（Rust）で同じ JSON を
+    数倍速く作り、UTF-8 の bytes を直接返すため str からのエンコードも省ける。
+
+    ## 標準の DefaultJSONProvider との違い
+    出力する値は同じ（sort_keys に従ってキーを並べ、datetime などは default に任せる）。
+    空白を入れない compact な形式になる点が異なる。str 以外のキーは文字列に変換してから
+    並べるため、{10: ..., 2: ...} のような数値のキーの並び順だけは標準と異なりうる。
+    orjson が対応しない指定（ensure_ascii=True や indent=4 など）の場合は標準の実装に任せる。
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        option = self._option(kwargs)
+        if option is None:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """jsonify() の実体。orjson の bytes をそのまま本文にする（str を経由しない）。"""
+        obj = self._prepare_response_obj(args, kwargs)
+        dump_args = {}
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            dump_args["indent"] = 2
+        option = self._option(dump_args)
+        if option is None:
+            return super().response(*args, **kwargs)
+        body = orjson.dumps(obj, default=self.default, option=option | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+    def _option(self, kwargs: dict):
+        """dumps() の引数を orjson のオプションに変換する。対応できなければ None。"""
+        kwargs = dict(kwargs)
+        indent = kwargs.pop("indent", None)
+        separators = kwargs.pop("separators", None)
+        if kwargs or self.ensure_ascii or indent not in (None, 2) or separators not in (None, (",", ":")):
+            return None
+        # datetime は orjson の ISO 形式ではなく、標準と同じく default（RFC 822 形式）で変換させる。
+        # OPT_NON_STR_KEYS は {1: "a"} のような str 以外のキーを、標準の json と同じく文字列にする
+        # （指定しないと orjson は TypeError を送出し、jsonify が 500 になる）
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+
+def init_app(app) -> None:
+    """設定 JSON_PROVIDER に従って app.json を差し替える。
+
+    - "auto": orjson がインストールされていれば使い、なければ標準のまま
+    - "orjson": orjson を使う（インストールされていなければ起動時にエラー）
+    - "stdlib": 標準の json モジュールのまま
+    """
+    name = app.config["JSON_PROVIDER"]
+    if name not in ("auto", "orjson", "stdlib"):
+        raise RuntimeError(f"Unknown JSON_PROVIDER: {name!r}")
+    if name == "orjson" and orjson is None:
+        raise RuntimeError("JSON_PROVIDER=orjson requires the orjson package")
+    if name != "stdlib" and orjson is not None:
+        app.json = OrjsonProvider(app)
@@ -0,0 +1,356 @@
+"""多数の利用者を模した並行アクセスで、ワーカー・ホストが捌ける req/s を調べる負荷試験。
+
+`flask loadtest` から使う。対象は起動中のサーバー（HttpTransport）か、
+同じプロセス内の Flask アプリ（WsgiTransport）のどちらか。
+
+## 仕組み
+- 仮想ユーザー（VirtualUser）ごとにセッション Cookie を持ち、最初にログイン
+  （アカウントがなければ登録）してから、操作の組み合わせ（mix）に従って
+  signin / list / create / update / delete を繰り返す。
+- concurrency 本のスレッドが仮想ユーザーを1人ずつ取り出して1操作ずつ実行する。
+  1人の仮想ユーザーを同時に2つのスレッドが使うことはない（Cookie が混ざらない）。
+- 操作ごとの所要時間を記録し、interval 秒ごとのスループット・エラー率・
+  レイテンシの分布（ヒストグラム）を時系列で集計する。concurrency を段階的に上げて
+  スループットが伸びなくなり、レイテンシだけが増え始める点（knee）を探すのに使う。
+"""
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+OPERATIONS = ("signin", "list", "create", "update", "delete")
+DEFAULT_MIX = {"signin": 1, "list": 6, "create": 2, "update": 1, "delete": 1}
+
+# ヒストグラムの区切り（ミリ秒）。最後の区間は 1000 ms 以上。
+HISTOGRAM_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000)
+
+PASSWORD = "loadtest-password"
+
+# list 操作で取得する件数。update / delete の対象はこの中から選ぶ。
+_LIST_LIMIT = 20
+
+
+class Response(NamedTuple):
+    status: int
+    location: str
+    body: bytes
+
+
+class WsgiTransport:
+    """同じプロセス内の Flask アプリを、仮想ユーザーごとのテストクライアントで呼ぶ。
+
+    ネットワークとサーバーのワーカー数の影響を除いた、アプリと DB だけの上限を測れる。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def session(self) -> "_WsgiSession":
+        return _WsgiSession(self.app.test_client())
+
+
+class _WsgiSession:
+    def __init__(self, client):
+        self._client = client
+
+    def request(self, method: str, path: str, data: Optional[dict] = None) -> Response:
+        response = self._client.open(path, method=method, data=data)
+        return Response(response.status_code, response.headers.get("Location", ""), response.get_data())
+
+
+class HttpTransport:
+    """起動中のサーバー（base_url）に HTTP でリクエストを送る。"""
+
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def session(self) -> "_HttpSession":
+        return _HttpSession(self)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # ログインの成否はリダイレクト先で判定するため、リダイレクトを追わない
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class _HttpSession:
+    def __init__(self, transport: HttpTransport):
+        self._transport = transport
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect
+        )
+
+    def request(self, method: str, path: str, data: Optional[dict] = None) -> Response:
+        body = urllib.parse.urlencode(data).encode("ascii") if data is not None else None
+        req = urllib.request.Request(self._transport.base_url + path, data=body, method=method)
+        try:
+            with self._opener.open(req, timeout=self._transport.timeout) as response:
+                return Response(response.status, response.headers.get("Location", ""), response.read())
+        except urllib.error.HTTPError as e:
+            # 3xx（リダイレクトを追わなかった場合）と 4xx / 5xx はここに来る
+            return Response(e.code, e.headers.get("Location", ""), e.read())
+
+
+class VirtualUser:
+    """1人の利用者を模す。Cookie と、自分の日記の ID（直近の list の結果）を持つ。"""
+
+    def __init__(self, index: int, session):
+        self.index = index
+        self.email = f"loadtest-{index}@example.com"
+        self._session = session
+        self._diary_ids: List[int] = []
+        self.signed_in = False
+
+    def run(self, op: str, rng: random.Random) -> tuple:
+        """op を1回実行し、(実際に行った操作, 成功したか, ステータスコード) を返す。
+
+        まだログインしていなければ op の代わりにログインを行う。
+        update / delete の対象がなければ代わりに list で ID を取得する。
+        """
+        if not self.signed_in:
+            op = "signin"
+        if op in ("update", "delete") and not self._diary_ids:
+            op = "list"
+        response = getattr(self, f"_{op}")(rng)
+        ok = response.status < 400 and not (op == "signin" and not self.signed_in)
+        return op, ok, response.status
+
+    def _signin(self, rng: random.Random) -> Response:
+        response = self._session.request("POST", "/auth", {"email": self.email, "password": PASSWORD})
+        if response.status in (301, 302, 303) and response.location.endswith("/signin"):
+            # アカウントがまだない。登録するとそのままログイン状態になる
+            response = self._session.request("POST", "/register", {
+                "email": self.email, "password": PASSWORD, "username": f"loadtest{self.index}",
+            })
+        self.signed_in = response.status in (301, 302, 303) and response.location.endswith("/dashboard")
+        return response
+
+    def _list(self, rng: random.Random) -> Response:
+        response = self._session.request("GET", f"/get_json?limit={_LIST_LIMIT}")
+        if response.status == 200:
+            self._diary_ids = [diary["id"] for diary in json.loads(response.body)["diaries"]]
+        elif response.status == 401:
+            self.signed_in = False
+        return response
+
+    def _create(self, rng: random.Random) -> Response:
+        return self._session.request("POST", "/create_diary", {
+            "title": f"負荷試験 {rng.randrange(1_000_000)}",
+            "comment": "今日は負荷試験の日記を書いた。" * rng.randint(1, 8),
+        })
+
+    def _update(self, rng: random.Random) -> Response:
+        diary_id = rng.choice(self._diary_ids)
+        return self._session.request("POST", f"/diary/{diary_id}/update", {
+            "title": f"更新 {rng.randrange(1_000_000)}", "comment": "内容を書き直した。",
+        })
+
+    def _delete(self, rng: random.Random) -> Response:
+        diary_id = self._diary_ids.pop(rng.randrange(len(self._diary_ids)))
+        return self._session.request("POST", f"/diary/{diary_id}/delete")
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    """"list=6,create=2" のような指定を {操作: 重み} にする。"""
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"unknown operation: {name!r}")
+        try:
+            mix[name] = int(weight)
+        except ValueError:
+            raise ValueError(f"weight must be an integer: {part!r}") from None
+        if mix[name] < 0:
+            raise ValueError(f"weight must not be negative: {part!r}")
+    if not any(mix.values()):
+        raise ValueError("at least one operation needs a positive weight")
+    return mix
+
+
+def load_script(lines: Iterable[str]) -> List[str]:
+    """記録した操作列（1行1つの {"op": "..."} の NDJSON）を読み込む。空行は無視する。"""
+    script = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            op = json.loads(line)["op"]
+        except (ValueError, KeyError, TypeError):
+            raise ValueError(f"line {number}: expected {{\"op\": ...}}") from None
+        if op not in OPERATIONS:
+            raise ValueError(f"line {number}: unknown operation {op!r}")
+        script.append(op)
+    if not script:
+        raise ValueError("script is empty")
+    return script
+
+
+@dataclass
+class Sample:
+    at: float        # 試験開始からの経過秒（リクエストの完了時刻）
+    op: str
+    seconds: float
+    ok: bool
+    status: int      # 応答がなかった場合は 0
+    error: str = ""  # 応答がなかった場合の例外名（ConnectionRefusedError など）
+
+
+@dataclass
+class LoadReport:
+    duration: float
+    interval: float
+    samples: List[Sample] = field(default_factory=list)
+
+    def timeline(self) -> List[dict]:
+        """interval 秒ごとのスループット・エラー率・分位点・ヒストグラム。"""
+        buckets: Dict[int, List[Sample]] = {}
+        for sample in self.samples:
+            buckets.setdefault(int(sample.at // self.interval), []).append(sample)
+        rows = []
+        for index in range(max(buckets, default=-1) + 1):
+            samples = buckets.get(index, [])
+            rows.append({"start": index * self.interval, **_summarize(samples, self.interval)})
+        return rows
+
+    def by_operation(self) -> Dict[str, dict]:
+        ops: Dict[str, List[Sample]] = {}
+        for sample in self.samples:
+            ops.setdefault(sample.op, []).append(sample)
+        return {op: _summarize(samples, self.duration) for op, samples in sorted(ops.items())}
+
+    def total(self) -> dict:
+        return _summarize(self.samples, self.duration)
+
+    def to_dict(self) -> dict:
+        return {
+            "duration": self.duration,
+            "histogram_bounds_ms": list(HISTOGRAM_BOUNDS_MS),
+            "total": self.total(),
+            "operations": self.by_operation(),
+            "timeline": self.timeline(),
+        }
+
+
+def _summarize(samples: Sequence[Sample], seconds: float) -> dict:
+    latencies = sorted(sample.seconds * 1000 for sample in samples)
+    errors = sum(not sample.ok for sample in samples)
+    statuses: Dict[str, int] = {}
+    for sample in samples:
+        key = sample.error or str(sample.status)
+        statuses[key] = statuses.get(key, 0) + 1
+    return {
+        "requests": len(samples),
+        "rps": len(samples) / seconds if seconds > 0 else 0.0,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "histogram": _histogram(latencies),
+        "statuses": statuses,
+    }
+
+
+def _percentile(sorted_values: Sequence[float], percent: int) -> float:
+    """最近傍順位法による分位点。値がなければ 0。"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-percent * len(sorted_values) // 100))  # ceil(percent * n / 100)
+    return sorted_values[rank - 1]
+
+
+def _histogram(latencies_ms: Iterable[float]) -> List[int]:
+    counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for value in latencies_ms:
+        for index, bound in enumerate(HISTOGRAM_BOUNDS_MS):
+            if value < bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+    return counts
+
+
+def run(
+    transport,
+    users: int,
+    concurrency: int,
+    duration: float,
+    interval: float = 1.0,
+    mix: Optional[Dict[str, int]] = None,
+    script: Optional[Sequence[str]] = None,
+    seed: Optional[int] = None,
+) -> LoadReport:
+    """duration 秒のあいだ負荷をかけ、結果を LoadReport で返す。
+
+    Args:
+        transport: WsgiTransport または HttpTransport。
+        users: 仮想ユーザー数。concurrency より多くすると、同時に動くのは concurrency 人で
+               残りは順番待ちになる（ログイン済みセッションが多数ある状態を模せる）。
+        concurrency: 同時にリクエストを送るスレッド数。
+        mix: 操作ごとの重み（script を指定しない場合。省略時は DEFAULT_MIX）。
+        script: 記録した操作列。各仮想ユーザーがずらした位置から順に繰り返す。
+        seed: 乱数の種。同じ値なら同じ操作の順序になる（スレッドの実行順は除く）。
+    """
+    if users < 1 or concurrency < 1:
+        raise ValueError("users and concurrency must be at least 1")
+    mix = mix or DEFAULT_MIX
+    names = [op for op in OPERATIONS if mix.get(op)]
+    weights = [mix[op] for op in names]
+
+    idle = list(VirtualUser(index, transport.session()) for index in range(users))
+    positions = {user.index: user.index for user in idle}
+    idle_lock = threading.Condition()
+    report = LoadReport(duration=duration, interval=interval)
+    samples_lock = threading.Lock()
+    started = time.perf_counter()
+    deadline = started + duration
+
+    def worker(worker_index: int) -> None:
+        rng = random.Random(None if seed is None else seed * 1_000_003 + worker_index)
+        while time.perf_counter() < deadline:
+            with idle_lock:
+                while not idle:
+                    idle_lock.wait()
+                user = idle.pop(0)
+            try:
+                if script is not None:
+                    op = script[positions[user.index] % len(script)]
+                    positions[user.index] += 1
+                else:
+                    op = rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                error = ""
+                try:
+                    op, ok, status = user.run(op, rng)
+                except Exception as e:
+                    # 接続エラーやタイムアウトもエラーとして数え、負荷は止めない
+                    ok, status = False, 0
+                    error = type(getattr(e, "reason", None) or e).__name__
+                end = time.perf_counter()
+                with samples_lock:
+                    report.samples.append(Sample(end - started, op, end - start, ok, status, error))
+            finally:
+                with idle_lock:
+                    idle.append(user)
+                    idle_lock.notify()
+
+    threads = [
+        threading.Thread(target=worker, args=(i,), name=f"loadtest-{i}", daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report.duration = time.perf_counter() - started
+    return report
@@ -0,0 +1,310 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from flask import request
+
+from app import timing
+
+logger = logging.getLogger(__name__)
+
+# レイテンシのヒストグラムの区切り（秒）。Prometheus の既定値に近い値にする。
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (endpoint, method, status) / (endpoint, method)
+_RequestKey = Tuple[str, str, str]
+_RouteKey = Tuple[str, str]
+
+
+class _Registry:
+    """1プロセス分のカウンターとヒストグラム。
+
+    カウンターは増えるだけで、プロセスの起動時から数え直す。
+    Prometheus は rate() / increase() でプロセスの再起動による巻き戻りを扱える。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests: Dict[_RequestKey, int] = {}
+        self.errors: Dict[_RouteKey, int] = {}
+        # 区切りごとの件数（累積ではない）、+Inf の件数、合計秒数
+        self.latency: Dict[_RouteKey, list] = {}
+        self.gauges: Dict[str, Dict[str, float]] = {}
+        self.last_flush = 0.0
+
+    def observe(self, endpoint: str, method: str, status: int, seconds: float) -> None:
+        with self.lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if status >= 500:
+                self.errors[(endpoint, method)] = self.errors.get((endpoint, method), 0) + 1
+            buckets = self.latency.setdefault((endpoint, method), [[0] * (len(LATENCY_BUCKETS) + 1), 0.0])
+            buckets[0][_bucket_index(seconds)] += 1
+            buckets[1] += seconds
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "pid": os.getpid(),
+                "started": self.started,
+                "requests": [[*key, count] for key, count in self.requests.items()],
+                "errors": [[*key, count] for key, count in self.errors.items()],
+                "latency": [[*key, list(counts), total] for key, (counts, total) in self.latency.items()],
+                "gauges": {name: dict(values) for name, values in self.gauges.items()},
+            }
+
+
+def _bucket_index(seconds: float) -> int:
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            return index
+    return len(LATENCY_BUCKETS)
+
+
+# プロセスごとの状態。fork した子プロセスは空から数え直す。
+_registry = _Registry()
+_directory: Optional[str] = None
+_flush_seconds = 1.0
+# 同じプロセスの複数のスレッドが同時に書き出さないためのロック。
+# 一時ファイルは1つなので、並行すると片方の os.replace が FileNotFoundError になり、
+# 2つの書き込みが1つのファイルに混ざることもある。
+_flush_lock = threading.Lock()
+
+
+def configure(directory: Optional[str], flush_seconds: float) -> None:
+    """スナップショットの置き場所と書き出し間隔を設定し、このプロセスの値を空にする。
+
+    Args:
+        directory: 複数のワーカープロセスで集計する場合に、各プロセスが
+                   <pid>-<起動時刻>.json を書き出すディレクトリ。None ならプロセス内だけで集計する。
+        flush_seconds: リクエストの後にスナップショットを書き出す最短の間隔。
+    """
+    global _registry, _directory, _flush_seconds
+    _registry = _Registry()
+    _directory = directory
+    _flush_seconds = flush_seconds
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def _snapshot_path() -> str:
+    # 起動時刻を含めるのは、PID が再利用されたときに前のプロセスの値を上書きしないため
+    return os.path.join(_directory, f"{os.getpid()}-{int(_registry.started * 1000)}.json")
+
+
+def flush() -> None:
+    """このプロセスのスナップショットをファイルに書き出す。
+
+    一時ファイルに書いてから os.replace で置き換えるため、読み手が書きかけの
+    ファイルを読むことはない（同じファイルシステム内の rename は原子的）。
+    書き出しは _flush_lock で1スレッドずつ行う。
+
+    Raises:
+        OSError: ファイルを書き出せなかった場合
+    """
+    if _directory is None:
+        return
+    with _flush_lock:
+        path = _snapshot_path()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_registry.snapshot(), f)
+        os.replace(tmp, path)
+        _registry.last_flush = time.monotonic()
+
+
+def clear_snapshots() -> None:
+    """METRICS_DIR に残っている、以前に起動したプロセスのスナップショットを消す。
+
+    カウンターは終了したプロセスの分も合算し続けるため、サーバーを起動し直すときに呼ぶ
+    （flask serve はワーカーを起動する前に呼ぶ）。
+    """
+    if _directory is None:
+        return
+    for name in os.listdir(_directory):
+        if name.endswith((".json", ".tmp")):
+            try:
+                os.remove(os.path.join(_directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def _collect_gauges() -> None:
+    """DB の接続プールとパスワードハッシュのプロセスプールの使用状況を記録する。"""
+    from app.db import db
+    from app.services import hash_pool
+
+    gauges = {}
+    for bind, engine in db.engines.items():
+        pool = engine.pool
+        label = bind or "default"
+        # StaticPool（インメモリ SQLite）などは size / checkedout を持たない
+        if hasattr(pool, "size"):
+            gauges.setdefault("nota_db_pool_size", {})[label] = pool.size()
+        if hasattr(pool, "checkedout"):
+            gauges.setdefault("nota_db_pool_checked_out", {})[label] = pool.checkedout()
+    stats = hash_pool.stats()
+    gauges["nota_hash_pool_workers"] = {"": stats["workers"]}
+    gauges["nota_hash_pool_capacity"] = {"": stats["capacity"]}
+    gauges["nota_hash_pool_in_flight"] = {"": stats["in_flight"]}
+    with _registry.lock:
+        _registry.gauges = gauges
+
+
+def _record_request(response):
+    request_timing = timing.current()
+    if request_timing is None:
+        return response
+    seconds = time.perf_counter() - request_timing.started
+    # ルートに一致しなかった 404 などは endpoint が None。URL ごとに系列が増えないよう1つにまとめる
+    _registry.observe(request.endpoint or "<unmatched>", request.method, response.status_code, seconds)
+    if _directory is not None and time.monotonic() - _registry.last_flush >= _flush_seconds:
+        # 書き出しに失敗しても（ディスクがいっぱい等）リクエストは失敗させない。次の機会に再試行する
+        try:
+            _collect_gauges()
+            flush()
+        except OSError:
+            logger.warning("failed to write metrics snapshot to %s", _directory, exc_info=True)
+    return response
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _load_snapshots() -> List[dict]:
+    """全プロセスのスナップショット。このプロセスの分はファイルではなく最新の値を使う。"""
+    _collect_gauges()
+    own = _registry.snapshot()
+    if _directory is None:
+        return [own]
+    try:
+        flush()
+    except OSError:
+        logger.warning("failed to write metrics snapshot to %s", _directory, exc_info=True)
+    own_path = os.path.basename(_snapshot_path())
+    snapshots = [own]
+    for name in os.listdir(_directory):
+        if not name.endswith(".json") or name == own_path:
+            continue
+        try:
+            with open(os.path.join(_directory, name), encoding="utf-8") as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # 読んでいる間に消えた・壊れたファイルは飛ばす
+    return snapshots
+
+
+def render() -> str:
+    """全ワーカープロセスの値を合算し、Prometheus のテキスト形式で返す。
+
+    ## 合算のしかた
+    カウンターとヒストグラムは全スナップショットを足し合わせる。終了したプロセスの分も含めるため、
+    ワーカーが入れ替わっても合計は減らない（METRICS_DIR は flask serve の起動時に clear_snapshots() で空にする）。
+    ゲージ（プールの使用状況）は今生きているプロセスの分だけを pid ラベル付きで出す。
+    """
+    snapshots = _load_snapshots()
+    requests: Dict[tuple, int] = {}
+    errors: Dict[tuple, int] = {}
+    latency: Dict[tuple, list] = {}
+    live = [s for s in snapshots if _alive(s["pid"])]
+    for snapshot in snapshots:
+        for endpoint, method, status, count in snapshot["requests"]:
+            requests[(endpoint, method, status)] = requests.get((endpoint, method, status), 0) + count
+        for endpoint, method, count in snapshot["errors"]:
+            errors[(endpoint, method)] = errors.get((endpoint, method), 0) + count
+        for endpoint, method, counts, total in snapshot["latency"]:
+            merged = latency.setdefault((endpoint, method), [[0] * len(counts), 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+
+    lines = []
+    _family(lines, "nota_http_requests_total", "counter", "HTTP requests by endpoint, method and status.")
+    for (endpoint, method, status), count in sorted(requests.items()):
+        lines.append(_sample("nota_http_requests_total", {"endpoint": endpoint, "method": method, "status": status}, count))
+    _family(lines, "nota_http_request_errors_total", "counter", "HTTP responses with a 5xx status.")
+    for (endpoint, method), count in sorted(errors.items()):
+        lines.append(_sample("nota_http_request_errors_total", {"endpoint": endpoint, "method": method}, count))
+    _family(lines, "nota_http_request_duration_seconds", "histogram", "Time from before_request to after_request.")
+    for (endpoint, method), (counts, total) in sorted(latency.items()):
+        labels = {"endpoint": endpoint, "method": method}
+        cumulative = 0
+        for bound, count in zip([*map(str, LATENCY_BUCKETS), "+Inf"], counts):
+            cumulative += count
+            lines.append(_sample("nota_http_request_duration_seconds_bucket", {**labels, "le": bound}, cumulative))
+        lines.append(_sample("nota_http_request_duration_seconds_sum", labels, total))
+        lines.append(_sample("nota_http_request_duration_seconds_count", labels, cumulative))
+
+    _family(lines, "nota_worker_processes", "gauge", "Worker processes with a live metrics snapshot.")
+    lines.append(_sample("nota_worker_processes", {}, len(live)))
+    gauge_names = sorted({name for snapshot in live for name in snapshot["gauges"]})
+    for name in gauge_names:
+        _family(lines, name, "gauge", _GAUGE_HELP.get(name, name))
+        for snapshot in live:
+            for label, value in sorted(snapshot["gauges"].get(name, {}).items()):
+                labels = {"pid": str(snapshot["pid"])}
+                if label:
+                    labels["bind"] = label
+                lines.append(_sample(name, labels, value))
+    return "\n".join(lines) + "\n"
+
+
+_GAUGE_HELP = {
+    "nota_db_pool_size": "Configured size of the SQLAlchemy connection pool.",
+    "nota_db_pool_checked_out": "Connections currently checked out of the pool.",
+    "nota_hash_pool_workers": "Password hashing worker processes.",
+    "nota_hash_pool_capacity": "Concurrent password hashing requests accepted before 503.",
+    "nota_hash_pool_in_flight": "Password hashing requests running or queued.",
+}
+
+
+def _family(lines: list, name: str, kind: str, help_text: str) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _sample(name: str, labels: dict, value) -> str:
+    if not labels:
+        return f"{name} {_number(value)}"
+    body = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+    return f"{name}{{{body}}} {_number(value)}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _reset_after_fork() -> None:
+    """fork 直後の子プロセスで、親の値を引き継がずに数え直す（合算時に二重に数えないため）。
+
+    ロックは fork の瞬間に他のスレッドが握っていた状態のまま複製されうるため、作り直す。
+    """
+    global _registry, _flush_lock
+    _registry = _Registry()
+    _flush_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def init_app(app) -> None:
+    """リクエストごとの記録と、METRICS_DIR へのスナップショットの書き出しを設定する。"""
+    configure(app.config["METRICS_DIR"], app.config["METRICS_FLUSH_SECONDS"])
+    app.after_request(_record_request)
+
@@ -1,6 +1,6 @@
 # このファイルを import するだけで User・DiaryEntry が SQLAlchemy に登録される。
 # db.create_all() はここで import されたモデルクラスを元にテーブルを生成する。
-from app.models.user import User
-from app.models.diary import DiaryEntry
+from app.models.user import User, UserIdentity
+from app.models.diary import DiaryEntry, DiaryTombstone
 
-__all__ = ["User", "DiaryEntry"]
+__all__ = ["User", "UserIdentity", "DiaryEntry", "DiaryTombstone"]
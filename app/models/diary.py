@@ -1,11 +1,14 @@
-from typing import List, Optional, TYPE_CHECKING
-from sqlalchemy import Integer, String, Text, ForeignKey
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from sqlalchemy import Index, Integer, String, Text, ForeignKey, event, text, tuple_
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
-from app.db import db
+from app.db import data_migration, db, read_bind_arguments
+from app.models.user import User
 
-if TYPE_CHECKING:
-    from app.models.user import User
+# created_at の書式（datetime('now', 'localtime') が返す形式）
+CREATED_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 
 class DiaryEntry(db.Model):
@@ -24,11 +27,23 @@ class DiaryEntry(db.Model):
 
     __tablename__ = "diaries"
 
+    # 一覧取得（WHERE user_id = ? ORDER BY created_ts DESC, id DESC）専用の複合インデックス。
+    # 並び順とインデックスの順序を一致させることで、SQLite はソートせずに
+    # インデックスを先頭から辿るだけで1ページ分を返せる（キーセットページネーションの前提）。
+    # SQLite は B-tree を逆方向にも走査できるため、DESC 指定のない昇順インデックスで
+    # ORDER BY created_ts DESC, id DESC をそのまま満たせる。
+    # 期間の絞り込み（created_ts BETWEEN ? AND ?）と日・月ごとの集計も同じインデックスの範囲走査で済む。
+    __table_args__ = (
+        Index("ix_diaries_user_created_ts_id", "user_id", "created_ts", "id"),
+        Index("ix_diaries_user_change_seq", "user_id", "change_seq"),
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
 
     # ForeignKey でリレーションの「所有権」を宣言する。
     # ondelete="CASCADE" は DB レベルで User 削除時に DiaryEntry も削除する指示。
-    # SQLAlchemy の cascade と組み合わせることで二重に安全になる。
+    # User は主キーの DELETE 1文で消し、関連は passive_deletes で読み込まないため、
+    # 日記を消すのはこの ON DELETE CASCADE だけ（PRAGMA foreign_keys=ON が前提。app.db で全接続に設定）。
     user_id: Mapped[int] = mapped_column(
         Integer,
         ForeignKey("users.id", ondelete="CASCADE"),
@@ -39,7 +54,28 @@ class DiaryEntry(db.Model):
     created_at: Mapped[str] = mapped_column(
         String(30),
         nullable=False,
-        server_default="(datetime('now', 'localtime'))",
+        server_default=text("(datetime('now', 'localtime'))"),
+    )
+
+    # 作成日時の UNIX 時刻（UTC の秒）。並び順・期間検索・集計にはこちらを使う。
+    # created_at はサーバーのタイムゾーンで書かれた表示用の文字列で、
+    # 文字列比較の結果がタイムゾーンの設定や書式に左右されるため、検索には使わない。
+    # server_default の 0 は既存の DB に ALTER TABLE で追加するためのもので、
+    # 既存行の値は init_db() のデータ移行（_backfill_created_ts）が created_at から埋める。
+    created_ts: Mapped[int] = mapped_column(
+        Integer,
+        nullable=False,
+        default=lambda: int(time.time()),
+        server_default="0",
+    )
+
+    # 最後に作成・更新されたときの User.diary_version の値。
+    # 差分同期で「トークン発行後に変わった行」を (user_id, change_seq) のインデックスで引くために使う。
+    change_seq: Mapped[int] = mapped_column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
     )
 
     # User → DiaryEntry の逆方向リレーション
@@ -47,26 +83,194 @@ class DiaryEntry(db.Model):
 
     # ---- クラスメソッド（ファクトリ） ----------------------------------------
 
+    # 一覧の JSON に含めるカラム（to_dict() と同じキー）
+    LIST_COLUMNS = ("id", "user_id", "title", "comment", "created_at", "created_ts")
+
+    @classmethod
+    def list_dicts_by_user(cls, user_id: int) -> List[dict]:
+        """指定ユーザーの日記を新しい順に、ORM オブジェクトを作らず辞書のリストで返す。
+
+        ## ORM を経由しない読み取り
+        `db.select(cls)` で ORM オブジェクトとして読むと、1行ごとに DiaryEntry を生成し、
+        identity map への登録や属性の変更追跡の準備をしてから、to_dict() でそれを捨てることになる。
+        一覧の JSON には読み取った値しか要らないため、テーブルのカラムを直接 SELECT する
+        Core のクエリにして、返ってきたタプルをそのまま辞書に詰め替える。
+        行数が多いユーザーほど CPU 時間とピークメモリの差が大きくなる
+        （python -m benchmarks.list_serialization で比較できる）。
+        """
+        result = db.session.execute(
+            cls._list_columns_stmt(user_id), bind_arguments=read_bind_arguments()
+        )
+        keys = cls.LIST_COLUMNS
+        return [dict(zip(keys, row)) for row in result]
+
     @classmethod
-    def list_by_user(cls, user_id: int) -> List["DiaryEntry"]:
-        """指定ユーザーの日記を新しい順で返す。
+    def iter_dicts_by_user(cls, user_id: int, batch_size: int = 500) -> Iterator[dict]:
+        """list_dicts_by_user() のストリーミング版。DB から batch_size 行ずつ読む。"""
+        result = db.session.execute(
+            cls._list_columns_stmt(user_id).execution_options(yield_per=batch_size),
+            bind_arguments=read_bind_arguments(),
+        )
+        keys = cls.LIST_COLUMNS
+        return (dict(zip(keys, row)) for row in result)
 
-        ## db.select() + where() + order_by()
-        SQLAlchemy の Select 構文。SQL の `SELECT * FROM diaries WHERE user_id=? ORDER BY ...`
-        に相当する。文字列ではなく Python の式で書くため IDE の補完・型チェックが効く。
+    @classmethod
+    def _list_columns_stmt(cls, user_id: int):
+        # モデルの属性ではなく Table のカラムを使うと ORM 向けのコンパイル処理を通らない
+        table = cls.__table__
+        return (
+            db.select(*(table.c[name] for name in cls.LIST_COLUMNS))
+            .where(table.c.user_id == user_id)
+            .order_by(table.c.created_ts.desc(), table.c.id.desc())
+        )
+
+    @classmethod
+    def list_page_by_user(
+        cls,
+        user_id: int,
+        limit: int,
+        after: Optional[Tuple[int, int]] = None,
+        between: Optional[Tuple[int, int]] = None,
+    ) -> List["DiaryEntry"]:
+        """指定ユーザーの日記を新しい順に最大 limit 件返す（キーセットページネーション）。
+
+        ## OFFSET ではなくカーソルを使う理由
+        `OFFSET n` は読み飛ばす n 行を毎回スキャンするため、深いページほど遅くなる。
+        前ページ最後の行の (created_ts, id) を「カーソル」として受け取り、
+        それより古い行だけを WHERE で絞り込めば、インデックス上の位置へ直接シークできる。
+        どれだけ深くスクロールしても1ページの取得コストは一定になる。
+
+        Args:
+            user_id: 所有者のユーザーID
+            limit: 取得件数の上限
+            after: 前ページ最後の行の (created_ts, id)。None なら先頭ページ。
+            between: (開始, 終了) の UNIX 時刻。指定すると created_ts が開始以上・終了未満の行に絞る。
+                     (user_id, created_ts, id) のインデックスの範囲走査になる。
+        """
+        stmt = db.select(cls).where(cls.user_id == user_id)
+        if between is not None:
+            stmt = stmt.where(cls.created_ts >= between[0], cls.created_ts < between[1])
+        if after is not None:
+            created_ts, diary_id = after
+            # 行値比較 (created_ts, id) < (?, ?)。OR で展開すると SQLite は
+            # user_id だけでシークして残りを1行ずつ捨てる（深いページほど遅い）が、
+            # 行値のままならインデックス上のカーソル位置へ直接シークできる。
+            stmt = stmt.where(tuple_(cls.created_ts, cls.id) < (created_ts, diary_id))
+        return db.session.scalars(
+            stmt.order_by(cls.created_ts.desc(), cls.id.desc()).limit(limit),
+            bind_arguments=read_bind_arguments(),
+        ).all()
+
+    @classmethod
+    def count_by_period(
+        cls, user_id: int, between: Tuple[int, int], period_format: str, offset_seconds: int
+    ) -> List[Row]:
+        """期間内の日記の件数を、日や月などの区切りごとに数えて古い順に返す。
+
+        ## GROUP BY をインデックスの上で行う
+        区切りは created_ts に時差を足してから strftime() で 'YYYY-MM-DD' などの文字列にしたもの。
+        WHERE も区切りの計算も (user_id, created_ts, id) のインデックスにある値だけで済むため、
+        SQLite はテーブル本体を読まずにインデックスの範囲を1回走査して集計する
+        （1年分のカレンダーでも日記の本文は1行も読まない）。
+        Python に全件を読み込んで数える場合と違い、返ってくるのは区切りの数の行だけ。
+
+        Args:
+            user_id: 所有者のユーザーID
+            between: (開始, 終了) の UNIX 時刻。created_ts が開始以上・終了未満の行を数える。
+            period_format: strftime() の書式（'%Y-%m-%d' なら日ごと、'%Y-%m' なら月ごと）
+            offset_seconds: 区切りを決めるタイムゾーンの UTC からの時差（秒）
+
+        Returns:
+            period（区切りの文字列）と count を持つ行のリスト
+        """
+        period = db.func.strftime(period_format, cls.created_ts + offset_seconds, "unixepoch")
+        # GROUP BY / ORDER BY には別名で参照する。式をもう一度書くとバインド変数が
+        # 別の番号になり、SQLite が SELECT 句の式と同じものだと判定できなくなる
+        label = db.literal_column("period")
+        return db.session.execute(
+            db.select(period.label("period"), db.func.count().label("count"))
+            .where(
+                cls.user_id == user_id,
+                cls.created_ts >= between[0],
+                cls.created_ts < between[1],
+            )
+            .group_by(label)
+            .order_by(label),
+            bind_arguments=read_bind_arguments(),
+        ).all()
 
-        ## .desc()
-        カラムオブジェクトに `.desc()` を呼ぶと降順（DESC）になる。
-        `cls.created_at.desc()` = `ORDER BY created_at DESC`
+    @classmethod
+    def list_changed_since(cls, user_id: int, change_seq: int) -> List["DiaryEntry"]:
+        """change_seq より後に作成・更新された日記を新しい順で返す。
 
-        ## db.session.scalars().all()
-        `scalars()` は結果セットをモデルオブジェクトのイテレータに変換する。
-        `all()` でリストとして取得する。
+        (user_id, change_seq) のインデックスで範囲検索するため、
+        コストは履歴全体ではなく変更件数に比例する。
         """
         return db.session.scalars(
             db.select(cls)
-            .where(cls.user_id == user_id)
-            .order_by(cls.created_at.desc(), cls.id.desc())
+            .where(cls.user_id == user_id, cls.change_seq > change_seq)
+            .order_by(cls.created_ts.desc(), cls.id.desc()),
+            bind_arguments=read_bind_arguments(),
+        ).all()
+
+    @classmethod
+    def list_by_ids(cls, user_id: int, diary_ids: Set[int]) -> List["DiaryEntry"]:
+        """指定した ID のうち user_id が所有する日記を返す（順序は不定）。
+
+        書き込み直後の値を読むため、レプリカではなくプライマリから読む。
+        """
+        if not diary_ids:
+            return []
+        return db.session.scalars(
+            db.select(cls).where(cls.user_id == user_id, cls.id.in_(diary_ids))
+        ).all()
+
+    @classmethod
+    def search(cls, user_id: int, match_query: str, limit: int) -> List[Row]:
+        """全文検索インデックス（diaries_fts）で日記を検索し、関連度順に返す。
+
+        ## FTS5 の MATCH と rank
+        `diaries_fts MATCH ?` は転置インデックスを引くため、本文の長さや件数に比例した
+        スキャンは発生しない。`rank` は既定で bm25() のスコアで、小さいほど関連度が高い。
+
+        ## snippet()
+        一致箇所の前後を切り出し、一致部分を制御文字 \x02 / \x03 で挟んで返す。
+        HTML タグで挟まないのは、本文をエスケープする前にタグを混ぜると
+        XSS の原因になるため（タグへの置換はエスケープ後にサービス層で行う）。
+
+        Returns:
+            id, user_id, title, comment, created_at, created_ts, snippet を持つ行のリスト
+        """
+        return db.session.execute(
+            text(
+                "SELECT d.id, d.user_id, d.title, d.comment, d.created_at, d.created_ts,"
+                " snippet(diaries_fts, -1, char(2), char(3), '…', 32) AS snippet"
+                " FROM diaries_fts JOIN diaries AS d ON d.id = diaries_fts.rowid"
+                " WHERE diaries_fts MATCH :query AND d.user_id = :user_id"
+                " ORDER BY diaries_fts.rank LIMIT :limit"
+            ),
+            {"query": match_query, "user_id": user_id, "limit": limit},
+            bind_arguments=read_bind_arguments(),
+        ).all()
+
+    @classmethod
+    def search_by_substring(cls, user_id: int, terms: List[str], limit: int) -> List["DiaryEntry"]:
+        """全ての語を部分一致で含む日記を新しい順で返す（LIKE による検索）。
+
+        trigram インデックスは3文字未満の語を引けないため、その場合だけ使う。
+        user_id のインデックスで対象ユーザーの行に絞ってから照合するので、
+        走査はテーブル全体ではなくそのユーザーの日記の範囲で済む。
+        """
+        stmt = db.select(cls).where(cls.user_id == user_id)
+        for term in terms:
+            # autoescape=True で語に含まれる % や _ をワイルドカードではなく文字として扱う
+            stmt = stmt.where(
+                cls.title.contains(term, autoescape=True)
+                | cls.comment.contains(term, autoescape=True)
+            )
+        return db.session.scalars(
+            stmt.order_by(cls.created_ts.desc(), cls.id.desc()).limit(limit),
+            bind_arguments=read_bind_arguments(),
         ).all()
 
     @classmethod
@@ -74,12 +278,42 @@ class DiaryEntry(db.Model):
         """新しい日記エントリを保存して返す。
 
         commit 後、SQLAlchemy は DB が生成した id・created_at を自動でオブジェクトに反映する。
+        一覧のバージョン番号も同じトランザクションで更新する。
         """
         entry = cls(user_id=user_id, title=title, comment=comment)
+        entry.change_seq = User.bump_diary_version(user_id)
         db.session.add(entry)
         db.session.commit()
         return entry
 
+    @classmethod
+    def bulk_create(cls, user_id: int, rows: List[dict]) -> int:
+        """複数の日記を1トランザクションでまとめて保存し、保存件数を返す。
+
+        ## executemany による一括 INSERT
+        `db.session.execute(db.insert(cls), rows)` に辞書のリストを渡すと、
+        ORM オブジェクトを1件ずつ作らずに1つの INSERT 文をパラメータだけ変えて
+        実行する（executemany）。create() を件数分呼ぶと件数分のトランザクションになるが、
+        こちらは rows 全体で commit 1回、バージョン更新も1回で済む。
+
+        Args:
+            user_id: 所有者のユーザーID
+            rows: title・comment・created_at を持つ辞書のリスト（検証済みであること）。
+                  created_ts を省略した行は created_at（サーバーのローカル時刻）から求める。
+        """
+        if not rows:
+            return 0
+        change_seq = User.bump_diary_version(user_id)
+        db.session.execute(
+            db.insert(cls),
+            [
+                {**_with_created_ts(row), "user_id": user_id, "change_seq": change_seq}
+                for row in rows
+            ],
+        )
+        db.session.commit()
+        return len(rows)
+
     @classmethod
     def delete_by_id_and_user(cls, diary_id: int, user_id: int) -> bool:
         """日記を削除する。user_id が一致しない場合は削除しない。
@@ -97,9 +331,26 @@ class DiaryEntry(db.Model):
         if entry is None or entry.user_id != user_id:
             return False
         db.session.delete(entry)
+        # 差分同期のクライアントに削除を伝えるための墓標を同じトランザクションで残す
+        db.session.add(DiaryTombstone(
+            user_id=user_id,
+            diary_id=diary_id,
+            change_seq=User.bump_diary_version(user_id),
+        ))
         db.session.commit()
         return True
 
+    @classmethod
+    def delete_batch_by_user(cls, user_id: int, batch_size: int) -> int:
+        """ユーザーの日記を最大 batch_size 件削除して commit し、削除した件数を返す。
+
+        アカウントの段階的な削除（account_service.purge_account）用。
+        1回のトランザクションで消す件数を抑え、書き込みロックを短い時間で手放す。
+        user_id 順のインデックス（ix_diaries_user_created_ts_id）で対象を引くため、
+        残りの件数に関係なく1回あたりの時間はほぼ一定になる。
+        """
+        return _delete_batch(cls, user_id, batch_size)
+
     @classmethod
     def update_by_id_and_user(
         cls, diary_id: int, user_id: int, title: str, comment: str
@@ -115,9 +366,87 @@ class DiaryEntry(db.Model):
             return None
         entry.title = title
         entry.comment = comment
+        entry.change_seq = User.bump_diary_version(user_id)
         db.session.commit()
         return entry
 
+    @classmethod
+    def apply_batch(
+        cls,
+        user_id: int,
+        delete_ids: List[int],
+        updates: Dict[int, Tuple[str, str]],
+    ) -> Tuple[Set[int], Set[int]]:
+        """複数の削除・更新を集合演算の SQL で1トランザクションにまとめて適用する。
+
+        ## 1件ずつ処理しない理由
+        delete_by_id_and_user / update_by_id_and_user を件数分呼ぶと、1件ごとに
+        SELECT・DELETE（UPDATE）・COMMIT の3往復が発生する。ここでは
+        1. 一覧のバージョンを上げる（この UPDATE で SQLite の書き込みロックを取る）
+        2. 所有者が一致する ID を `SELECT id ... WHERE id IN (...) AND user_id = ?` で一度に絞り込み
+        3. `DELETE ... WHERE id IN (...) AND user_id = ?` で一括削除
+        4. 更新は1つの UPDATE 文をパラメータだけ変えて実行（executemany）
+        5. 最後に1回だけ commit
+        とすることで、件数によらず往復回数が一定になる。
+
+        ## ロックを先に取る理由
+        SELECT だけでは書き込みロックを取らないため、絞り込みの後・DELETE の前に
+        並行する削除が割り込むと、消えた ID に "ok" を返したり墓標を二重に残したりする。
+        先にバージョンを上げてロックを取れば、commit まで他の書き込みは入らない。
+        対象が1件もなければ、バージョンは上げずに rollback する。
+
+        Args:
+            user_id: 操作するユーザーID（他人の日記は対象外になる）
+            delete_ids: 削除する日記 ID
+            updates: 日記 ID → (title, comment)（検証済みであること）
+
+        Returns:
+            (削除した ID の集合, 更新した ID の集合)。存在しない・他人の ID は含まれない。
+        """
+        requested = set(delete_ids) | set(updates)
+        if not requested:
+            return set(), set()
+        change_seq = User.bump_diary_version(user_id)
+        owned = set(db.session.scalars(
+            db.select(cls.id).where(cls.id.in_(requested), cls.user_id == user_id)
+        ))
+        deleted = {diary_id for diary_id in delete_ids if diary_id in owned}
+        updated = {diary_id for diary_id in updates if diary_id in owned}
+        if not deleted and not updated:
+            db.session.rollback()
+            return set(), set()
+
+        if deleted:
+            db.session.execute(
+                db.delete(cls).where(cls.id.in_(deleted), cls.user_id == user_id)
+            )
+            db.session.execute(
+                db.insert(DiaryTombstone),
+                [
+                    {"user_id": user_id, "diary_id": diary_id, "change_seq": change_seq}
+                    for diary_id in deleted
+                ],
+            )
+        if updated:
+            # 主キーを含む辞書のリストを渡すと、ORM が主キーごとの UPDATE を executemany で発行する。
+            # セッション内のオブジェクトは直後の commit で失効（再読込対象）になるため、
+            # 追加の WHERE と両立しない同期処理は省く。
+            db.session.execute(
+                db.update(cls).where(cls.user_id == user_id),
+                [
+                    {
+                        "id": diary_id,
+                        "title": updates[diary_id][0],
+                        "comment": updates[diary_id][1],
+                        "change_seq": change_seq,
+                    }
+                    for diary_id in updated
+                ],
+                execution_options={"synchronize_session": None},
+            )
+        db.session.commit()
+        return deleted, updated
+
     def to_dict(self) -> dict:
         """JSON シリアライズのために辞書に変換する。
 
@@ -130,4 +459,147 @@ class DiaryEntry(db.Model):
             "title": self.title,
             "comment": self.comment,
             "created_at": self.created_at,
+            "created_ts": self.created_ts,
         }
+
+
+class DiaryTombstone(db.Model):
+    """diary_tombstones テーブルの ORM モデル（削除ログ）。
+
+    ## 墓標（tombstone）とは
+    削除された行はテーブルから消えるため、「前回の同期以降に何が消えたか」を
+    diaries テーブルから知ることはできない。削除のたびに「どの ID が、どのバージョンで
+    消えたか」だけを記録しておき、差分同期でクライアントに伝える。
+    """
+
+    __tablename__ = "diary_tombstones"
+    __table_args__ = (
+        Index("ix_diary_tombstones_user_change_seq", "user_id", "change_seq"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    # 削除済みの日記 ID。参照先はもう存在しないため外部キーにはしない。
+    diary_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    change_seq: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    @classmethod
+    def delete_batch_by_user(cls, user_id: int, batch_size: int) -> int:
+        """ユーザーの削除ログを最大 batch_size 件削除して commit し、削除した件数を返す。"""
+        return _delete_batch(cls, user_id, batch_size)
+
+    @classmethod
+    def list_diary_ids_since(cls, user_id: int, change_seq: int) -> List[int]:
+        """change_seq より後に削除された日記 ID を返す。"""
+        return db.session.scalars(
+            db.select(cls.diary_id)
+            .where(cls.user_id == user_id, cls.change_seq > change_seq)
+            .order_by(cls.change_seq),
+            bind_arguments=read_bind_arguments(),
+        ).all()
+
+
+def _with_created_ts(row: dict) -> dict:
+    """created_at だけを持つ行に、同じ時刻の created_ts を補う。
+
+    created_at は datetime('now', 'localtime') と同じくサーバーのローカル時刻として解釈する
+    （既存行のデータ移行 _backfill_created_ts と同じ解釈）。
+    """
+    if "created_ts" in row or "created_at" not in row:
+        return row
+    local = time.strptime(row["created_at"], CREATED_AT_FORMAT)
+    return {**row, "created_ts": int(time.mktime(local))}
+
+
+def _delete_batch(model, user_id: int, batch_size: int) -> int:
+    """model のテーブルから user_id の行を最大 batch_size 件削除して commit する。
+
+    SQLite の DELETE は（コンパイル時オプションなしでは）LIMIT を取れないため、
+    消す行の id をサブクエリで選ぶ。
+    """
+    ids = db.select(model.id).where(model.user_id == user_id).limit(batch_size).scalar_subquery()
+    # 削除した行の id をセッションへ反映するための追加の取得は省く（直後の commit で全体が失効する）
+    result = db.session.execute(
+        db.delete(model).where(model.id.in_(ids)),
+        execution_options={"synchronize_session": False},
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+# ---- 全文検索インデックス -----------------------------------------------------
+#
+# diaries_fts は diaries の title・comment を索引する FTS5 仮想テーブル。
+# content='diaries' の「外部コンテンツ」形式にして本文を二重に持たず、
+# トリガーで diaries の INSERT / UPDATE / DELETE に追従させる。
+# トリガーにしておけば、DiaryEntry.create などの ORM 経由以外の書き込み
+# （一括 UPDATE・DELETE 等）でもインデックスがずれない。
+#
+# tokenize='trigram' は文字列を3文字ずつに区切って索引する。
+# 分かち書きが不要なため、形態素解析器なしで日本語の部分一致検索ができる。
+
+_SEARCH_INDEX_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS diaries_fts USING fts5("
+    " title, comment, content='diaries', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS diaries_fts_ai AFTER INSERT ON diaries BEGIN"
+    " INSERT INTO diaries_fts(rowid, title, comment) VALUES (new.id, new.title, new.comment);"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS diaries_fts_ad AFTER DELETE ON diaries BEGIN"
+    " INSERT INTO diaries_fts(diaries_fts, rowid, title, comment)"
+    " VALUES ('delete', old.id, old.title, old.comment);"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS diaries_fts_au AFTER UPDATE OF title, comment ON diaries BEGIN"
+    " INSERT INTO diaries_fts(diaries_fts, rowid, title, comment)"
+    " VALUES ('delete', old.id, old.title, old.comment);"
+    " INSERT INTO diaries_fts(rowid, title, comment) VALUES (new.id, new.title, new.comment);"
+    " END",
+]
+
+
+@event.listens_for(db.metadata, "after_create")
+def _create_search_index(target, connection, **kw):
+    """create_all() の後に全文検索インデックスとトリガーを作成する。
+
+    MetaData の after_create は既存テーブルしかない場合でも create_all() のたびに呼ばれる。
+    DDL はすべて IF NOT EXISTS なので、既存 DB に対して init-db を実行すると
+    インデックスだけが追加され、既存の日記は 'rebuild' で一括索引される。
+    """
+    if connection.dialect.name != "sqlite":
+        return
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = 'diaries_fts'"
+    ).scalar()
+    for ddl in _SEARCH_INDEX_DDL:
+        connection.exec_driver_sql(ddl)
+    if not exists:
+        connection.exec_driver_sql("INSERT INTO diaries_fts(diaries_fts) VALUES ('rebuild')")
+
+
+@data_migration
+def _backfill_created_ts(connection) -> None:
+    """created_ts カラムを追加した既存 DB で、既存行の値を created_at から埋める。
+
+    created_at はサーバーのローカル時刻なので、'utc' 修飾子で UTC に直してから
+    UNIX 時刻にする。まだ埋まっていない行（created_ts = 0）だけが対象なので、
+    何度実行しても結果は変わらない。置き換え前の文字列カラムのインデックスもここで消す。
+    """
+    connection.exec_driver_sql(
+        "UPDATE diaries SET created_ts = CAST(strftime('%s', created_at, 'utc') AS INTEGER)"
+        " WHERE created_ts = 0"
+    )
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_diaries_user_created_id")
+
+
+@event.listens_for(db.metadata, "before_drop")
+def _drop_search_index(target, connection, **kw):
+    """drop_all() で diaries と一緒に全文検索インデックスも削除する。
+
+    残しておくと、作り直した diaries に存在しない行を指す索引が残ってしまう。
+    トリガーは diaries の DROP で自動的に消える。
+    """
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS diaries_fts")
@@ -1,8 +1,25 @@
-from typing import Optional, List
-from sqlalchemy import String, Text
+from typing import NamedTuple, Optional, List
+from sqlalchemy import Integer, String, Text, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
-from app.db import db
+from app.cache import TTLCache
+from app.db import db, read_bind_arguments
+
+
+class UserIdentity(NamedTuple):
+    """画面表示や認可に使う、ログイン中ユーザーの軽量な情報。
+
+    ORM オブジェクトはセッションに結び付いていて、リクエストをまたいで使い回せない。
+    必要なカラムだけを不変のタプルに写してキャッシュする。
+    """
+
+    id: int
+    username: str
+    email: str
+
+
+# プロセス内で共有するユーザー情報のキャッシュ。create_app() から configure_identity_cache() で作り直す。
+_identity_cache: TTLCache[UserIdentity] = TTLCache(max_entries=10_000, ttl_seconds=60)
 
 
 class User(db.Model):
@@ -32,36 +49,58 @@ class User(db.Model):
 
     # server_default: INSERT 時に DB 側でデフォルト値を設定する。
     # Python 側での指定は不要で、commit 後に DB から値が反映される。
+    # 文字列をそのまま渡すと '...' で囲まれた文字列リテラルとして扱われるため、
+    # SQL 式として評価させるには text() で包む。
     created_at: Mapped[str] = mapped_column(
         String(30),
         nullable=False,
-        server_default="(datetime('now', 'localtime'))",
+        server_default=text("(datetime('now', 'localtime'))"),
+    )
+
+    # 日記一覧のバージョン番号。日記の作成・更新・削除のたびに 1 増える。
+    # 一覧の ETag に使い、「前回から変わったか」を diaries テーブルを読まずに判定する。
+    diary_version: Mapped[int] = mapped_column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
     )
 
     # relationship: 外部キーを介した関連オブジェクトへのアクセスを定義する。
     # cascade="all, delete-orphan" = User を削除したら紐づく DiaryEntry も削除する。
     # back_populates で双方向の関連を張り、DiaryEntry.user からも User に辿れる。
     # lazy="select" = relationship に最初にアクセスした時点で SELECT を発行する（遅延ロード）。
+    #
+    # passive_deletes=True = 削除は DB の ON DELETE CASCADE に任せる。
+    # 指定しないと SQLAlchemy は User を削除する前に全日記を読み込み、1件ずつ DELETE を発行する
+    # （日記が多いユーザーほど長い書き込みトランザクションになる）。
+    # 既にセッションに読み込まれている日記だけは、SQLAlchemy もセッションから取り除く。
     diaries: Mapped[List["DiaryEntry"]] = relationship(  # type: ignore[name-defined]
         "DiaryEntry",
         back_populates="user",
         cascade="all, delete-orphan",
+        passive_deletes=True,
         lazy="select",
     )
 
     # ---- クラスメソッド（ファクトリ） ----------------------------------------
 
     @classmethod
-    def find_by_email(cls, email: str) -> Optional["User"]:
+    def find_by_email(cls, email: str, from_replica: bool = False) -> Optional["User"]:
         """メールアドレスでユーザーを検索する。存在しなければ None を返す。
 
+        from_replica=True ならレプリカ（設定されていれば）で検索する。
+        ログイン時の検索のように多少の反映遅れを許容できる読み取りだけで使い、
+        登録時の重複チェックのように最新の状態が必要な場合はプライマリで検索する。
+
         ## db.session.scalar()
         クエリを実行して最初の1件を返す。0件なら None。
         SQLAlchemy 2.0 では `db.select(Model).where(...)` で SELECT 文を構築し、
         `db.session.scalar()` / `scalars()` で実行するスタイルが推奨されている。
         """
         return db.session.scalar(
-            db.select(cls).where(cls.email == email)
+            db.select(cls).where(cls.email == email),
+            bind_arguments=read_bind_arguments() if from_replica else None,
         )
 
     @classmethod
@@ -72,8 +111,67 @@ class User(db.Model):
         PRIMARY KEY による検索に特化したメソッド。
         同一セッション内でキャッシュ（identity map）が効くため、
         同じ ID を2回 get() しても SQL は1度しか発行されない。
+        表示用の読み取りなので、レプリカが設定されていればレプリカから読む。
         """
-        return db.session.get(cls, user_id)
+        return db.session.get(cls, user_id, bind_arguments=read_bind_arguments())
+
+    @classmethod
+    def get_identity(cls, user_id: int) -> Optional[UserIdentity]:
+        """ユーザーの軽量な情報を返す。存在しなければ None。
+
+        プロセス内のキャッシュ（LRU + TTL）にあれば DB に問い合わせない。
+        ログイン中のページ表示のたびに users を引き直さないためのもの。
+        User.create / User.delete など、キャッシュする項目を変える操作は必ず
+        _identity_cache.invalidate() を呼ぶこと。別プロセスでの変更は TTL 経過後に反映される。
+        存在しないユーザーはキャッシュしない（登録直後に「存在しない」が残らないように）。
+        """
+        identity = _identity_cache.get(user_id)
+        if identity is not None:
+            return identity
+        row = db.session.execute(
+            db.select(cls.id, cls.username, cls.email).where(cls.id == user_id),
+            bind_arguments=read_bind_arguments(),
+        ).first()
+        if row is None:
+            return None
+        identity = UserIdentity(*row)
+        _identity_cache.set(user_id, identity)
+        return identity
+
+    @classmethod
+    def configure_identity_cache(cls, max_entries: int, ttl_seconds: float) -> None:
+        """get_identity() のキャッシュを、指定した大きさと有効期限で空の状態から作り直す。"""
+        global _identity_cache
+        _identity_cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+    @classmethod
+    def get_diary_version(cls, user_id: int) -> Optional[int]:
+        """日記一覧のバージョン番号だけを取得する。ユーザーが存在しなければ None。
+
+        User オブジェクト全体ではなく1カラムだけを SELECT するため、
+        主キー検索1回で済み、ORM オブジェクトの生成コストもかからない。
+        """
+        return db.session.scalar(
+            db.select(cls.diary_version).where(cls.id == user_id),
+            bind_arguments=read_bind_arguments(),
+        )
+
+    @classmethod
+    def bump_diary_version(cls, user_id: int) -> int:
+        """日記一覧のバージョン番号を 1 増やし、新しい値を返す。commit はしない。
+
+        日記の変更と同じトランザクションで呼ぶことで、
+        「日記は変わったのにバージョンは古いまま」という状態を作らない。
+        UPDATE で書き込みロックを取った後に SELECT するため、並行する書き込みと値が衝突しない。
+        """
+        db.session.execute(
+            db.update(cls)
+            .where(cls.id == user_id)
+            .values(diary_version=cls.diary_version + 1)
+        )
+        return db.session.scalar(
+            db.select(cls.diary_version).where(cls.id == user_id)
+        )
 
     @classmethod
     def create(cls, username: str, email: str, password_hash: str) -> "User":
@@ -88,18 +186,35 @@ class User(db.Model):
         user = cls(username=username, email=email, password_hash=password_hash)
         db.session.add(user)
         db.session.commit()
+        # 同じ id の削除済みユーザーがキャッシュに残っていても新しいユーザーの情報で引き直させる
+        _identity_cache.invalidate(user.id)
         return user
 
+    @classmethod
+    def update_password_hash(cls, user_id: int, password_hash: str) -> None:
+        """パスワードハッシュを書き換えて commit する（ログイン時の再ハッシュ用）。
+
+        ログイン時の User はレプリカから読んだものでありうるため、
+        オブジェクトを変更するのではなく主キー指定の UPDATE をプライマリに発行する。
+        """
+        db.session.execute(
+            db.update(cls).where(cls.id == user_id).values(password_hash=password_hash)
+        )
+        db.session.commit()
+
     @classmethod
     def delete(cls, user_id: int) -> None:
-        """ユーザーを削除する。cascade により日記も自動削除される。
+        """ユーザーを削除する。日記・削除ログは DB の ON DELETE CASCADE で削除される。
 
-        ## db.session.delete()
-        オブジェクトを「削除予定」としてセッションに登録し、commit でDELETE を発行する。
-        relationship に cascade="all, delete-orphan" を設定しているため、
-        SQLAlchemy が DiaryEntry の DELETE を自動で先に実行する。
+        ## ORM を経由しない DELETE
+        db.session.delete(user) はオブジェクトを読み込んでから削除するが、ここでは
+        主キー指定の DELETE 文を1つ発行するだけにする。子テーブルの行は SQLite が
+        外部キー制約（PRAGMA foreign_keys=ON、app.db で全接続に設定）に従って同じ文の中で削除し、
+        Python 側に1行も読み込まない。
+
+        日記が非常に多いユーザーでは、この1文でも書き込みロックを長く握る。
+        その場合は account_service.purge_account で日記を少しずつ消してから呼ぶ。
         """
-        user = db.session.get(cls, user_id)
-        if user is not None:
-            db.session.delete(user)
-            db.session.commit()
+        db.session.execute(db.delete(cls).where(cls.id == user_id))
+        db.session.commit()
+        _identity_cache.invalidate(user_id)
@@ -0,0 +1,78 @@
+import gzip
+from typing import Optional
+
+from flask import Response, current_app, get_flashed_messages, render_template, request
+
+from app.cache import TTLCache
+
+try:
+    # brotli は任意の依存。インストールされていれば br 版も用意する。
+    import brotli
+except ImportError:  # pragma: no cover - 環境による
+    brotli = None
+
+# Content-Encoding とその圧縮関数。優先したい順に並べる（同じ q 値ならこの順で選ぶ）。
+_ENCODERS = {}
+if brotli is not None:
+    _ENCODERS["br"] = lambda body: brotli.compress(body, quality=11)
+_ENCODERS["gzip"] = lambda body: gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def init_app(app) -> None:
+    """描画済みページのキャッシュを app.extensions["page_cache"] に用意する。"""
+    app.extensions["page_cache"] = TTLCache(
+        max_entries=app.config["PAGE_CACHE_MAX_ENTRIES"],
+        ttl_seconds=app.config["PAGE_CACHE_TTL_SECONDS"],
+    )
+
+
+def render_cached(template_name: str, **context) -> Response:
+    """テンプレートを描画して返す。同じ入力の描画結果はキャッシュから返す。
+
+    ## 何をキャッシュするか
+    トップ・ログイン・登録ページのように、出力が「ログイン状態」と「フラッシュメッセージ」
+    だけで決まるページ向け。描画結果に加えて gzip（と brotli が使えれば br）で
+    圧縮したものも一緒に保存し、2回目以降はテンプレートの描画も圧縮もせずにバイト列を返す。
+    圧縮は1度きりなので、最も高い圧縮レベルを使う。
+
+    ## キャッシュのキー
+    テンプレート名・context（ハッシュ可能な値のみ）・フラッシュメッセージ・script_root。
+    テンプレートがこれ以外（session の中身やリクエストの値など）に依存する場合は、
+    その値を context として渡してキーに含めること。
+
+    ## レスポンス
+    Accept-Encoding に合わせて1つの版を選び、Content-Encoding と
+    Vary: Accept-Encoding, Cookie を付ける（Cookie によってログイン状態が変わるため）。
+
+    PAGE_CACHE_ENABLED が False（開発時など）なら毎回そのまま描画する。
+    """
+    # フラッシュメッセージはここで取り出す。同じリクエスト内でテンプレートが
+    # get_flashed_messages() を呼んでも、取り出し済みの同じ一覧が返る。
+    messages = tuple(get_flashed_messages())
+    if not current_app.config["PAGE_CACHE_ENABLED"]:
+        return Response(render_template(template_name, **context), mimetype="text/html")
+
+    cache: TTLCache[dict] = current_app.extensions["page_cache"]
+    key = (template_name, request.script_root, tuple(sorted(context.items())), messages)
+    variants = cache.get(key)
+    if variants is None:
+        body = render_template(template_name, **context).encode("utf-8")
+        variants = {"identity": body}
+        for encoding, compress in _ENCODERS.items():
+            variants[encoding] = compress(body)
+        cache.set(key, variants)
+
+    encoding = _negotiate(variants)
+    response = Response(variants[encoding], mimetype="text/html")
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.vary.update(("Accept-Encoding", "Cookie"))
+    return response
+
+
+def _negotiate(variants: dict) -> str:
+    """Accept-Encoding の q 値が最も高い版を選ぶ。受け付けられるものがなければ identity。"""
+    best: Optional[str] = request.accept_encodings.best_match(
+        [encoding for encoding in variants if encoding != "identity"]
+    )
+    return best or "identity"
@@ -0,0 +1,223 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from functools import wraps
+from typing import Callable, Optional
+
+from flask import current_app, jsonify, request, session
+
+
+class MemoryStore:
+    """プロセス内のメモリにトークンバケットを保持するストア。
+
+    ## トークンバケット
+    キーごとに最大 capacity 個のトークンを持つ「バケツ」を用意し、
+    1秒あたり rate 個ずつ補充する。リクエストのたびに1個取り出し、空なら断る。
+    短時間の連続アクセス（capacity 回まで）は許しつつ、長い目で見た平均を rate に抑えられる。
+    状態は「残りトークン数」と「最後に更新した時刻」だけで、補充はアクセス時にまとめて計算する。
+
+    ## LRU によるメモリ上限
+    IP アドレスのようなキーは攻撃者がいくらでも増やせるため、保持するキー数を max_keys で打ち切り、
+    最も長くアクセスのないキーから捨てる。捨てたキーは次のアクセスで満タンのバケツから再開する。
+    """
+
+    def __init__(self, max_keys: int = 10_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, rate: float, now: float) -> float:
+        """key のバケツからトークンを1個取り出す。
+
+        Returns:
+            取り出せたら 0。空なら次の1個が補充されるまでの秒数。
+        """
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens, wait = _take(tokens, updated, now, capacity, rate)
+            self._buckets[key] = (tokens, now)  # 末尾に入れ直して「最近使った」扱いにする
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class SqliteStore:
+    """SQLite ファイルにトークンバケットを保持するストア。
+
+    同じホストで動く複数のワーカープロセスが1つのファイルを共有することで、
+    どのプロセスにリクエストが振り分けられても同じ上限が効くようにする。
+
+    ## 排他制御
+    BEGIN IMMEDIATE で書き込みロックを取ってから読み・書きするため、
+    複数プロセスが同時に同じキーを更新しても取り出したトークンが二重に数えられない。
+    日記の DB とはファイルを分け、レート制限の書き込みが日記の書き込みとロックを奪い合わないようにする。
+
+    ## 行数の上限
+    満タンまで補充されたバケツは「行がない」のと同じ意味なので、
+    一定回数ごとに満タンになった行を消し、それでも max_keys を超えていれば古い順に消す。
+    """
+
+    _PRUNE_EVERY = 1_000
+
+    def __init__(self, path: str, max_keys: int = 10_000):
+        self.path = path
+        self.max_keys = max_keys
+        # sqlite3 の接続はスレッド間・fork 後のプロセス間で共有できないため、スレッドごとに開く
+        self._local = threading.local()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+                " key TEXT PRIMARY KEY, tokens REAL NOT NULL,"
+                " updated REAL NOT NULL, full_at REAL NOT NULL)"
+            )
+
+    def take(self, key: str, capacity: int, rate: float, now: float) -> float:
+        """key のバケツからトークンを1個取り出す（戻り値は MemoryStore.take と同じ）。"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, updated = row if row is not None else (capacity, now)
+            tokens, wait = _take(tokens, updated, now, capacity, rate)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated, full_at)"
+                " VALUES (?, ?, ?, ?)",
+                (key, tokens, now, now + (capacity - tokens) / rate),
+            )
+            self._local.takes = getattr(self._local, "takes", 0) + 1
+            if self._local.takes % self._PRUNE_EVERY == 0:
+                self._prune(conn, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM rate_limit_buckets WHERE full_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM rate_limit_buckets WHERE key IN ("
+            " SELECT key FROM rate_limit_buckets ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+            (self.max_keys,),
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: トランザクションは take() の BEGIN / COMMIT で明示的に管理する
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+
+def _take(tokens: float, updated: float, now: float, capacity: int, rate: float) -> tuple[float, float]:
+    """経過時間ぶん補充してから1個取り出し、(残りトークン数, 待ち秒数) を返す。"""
+    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+def init_app(app) -> None:
+    """設定に応じたストアを作り、app.extensions["ratelimit"] に登録する。
+
+    RATELIMIT_STORAGE_PATH があれば SQLite ファイル（ワーカー間で共有）、
+    なければプロセスごとのメモリを使う。
+    """
+    path = app.config.get("RATELIMIT_STORAGE_PATH")
+    max_keys = app.config["RATELIMIT_MAX_KEYS"]
+    app.extensions["ratelimit"] = SqliteStore(path, max_keys) if path else MemoryStore(max_keys)
+
+
+def form_email() -> Optional[str]:
+    """ログインフォームのメールアドレスをアカウント単位のキーにする。"""
+    return request.form.get("email", "").strip().lower() or None
+
+
+def session_user() -> Optional[str]:
+    """ログイン中のユーザー ID をアカウント単位のキーにする。"""
+    user_id = session.get("user_id")
+    return str(user_id) if user_id is not None else None
+
+
+def rate_limit(scope: str, account: Optional[Callable[[], Optional[str]]] = None):
+    """RATE_LIMITS[scope] の上限を超えたリクエストを 429 で断るデコレータ。
+
+    @login_required と同じくルート関数の前に挟み、上限を超えていれば
+    ルート本体（DB 検索やパスワードのハッシュ計算）を一切実行せずに応答する。
+    @login_required と併用するときはその外側（上）に置く。アカウントのキーは
+    session から取るので、ログイン確認のユーザー読み込み（キャッシュにない場合は DB 検索）より先に断れる。
+
+    使い方:
+        @auth_bp.route("/auth", methods=["POST"])
+        @rate_limit("auth", account=form_email)
+        def auth():
+            ...
+
+        @diary_bp.route("/create_diary", methods=["POST"])
+        @rate_limit("write", account=session_user)
+        @login_required
+        def create_diary():
+            ...
+
+    Args:
+        scope: 設定 RATE_LIMITS のキー。値は {"ip": (回数, 秒), "account": (回数, 秒)}。
+               「秒 をかけて 回数 ぶん回復し、最大 回数 まで連続で許可」を意味する。
+        account: アカウント単位のキーを返す関数。None を返した場合や省略時は IP 単位のみ。
+
+    IP アドレスは request.remote_addr を使う。リバースプロキシの背後で動かす場合は
+    werkzeug の ProxyFix などで実クライアントのアドレスに置き換えておくこと。
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if current_app.config["RATELIMIT_ENABLED"]:
+                wait = _check(scope, account)
+                if wait > 0:
+                    return _too_many_requests(wait)
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _check(scope: str, account: Optional[Callable[[], Optional[str]]]) -> float:
+    """IP 単位・アカウント単位のバケツを順に消費し、断る場合は待ち秒数を返す。"""
+    limits = current_app.config["RATE_LIMITS"].get(scope, {})
+    store = current_app.extensions["ratelimit"]
+    now = time.time()
+    keys = []
+    if "ip" in limits:
+        keys.append(("ip", request.remote_addr or "unknown"))
+    if "account" in limits and account is not None:
+        account_key = account()
+        if account_key is not None:
+            keys.append(("account", account_key))
+    for kind, value in keys:
+        capacity, period = limits[kind]
+        wait = store.take(f"{scope}:{kind}:{value}", capacity, capacity / period, now)
+        if wait > 0:
+            return wait
+    return 0.0
+
+
+def _too_many_requests(wait: float):
+    """429 応答。Retry-After には次のトークンが補充されるまでの秒数（切り上げ）を入れる。"""
+    headers = {"Retry-After": str(max(1, math.ceil(wait)))}
+    message = "リクエストが多すぎます。しばらくしてから再度お試しください。"
+    # AJAX リクエスト（JSON を期待している場合）は JSON で返す
+    if request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html:
+        return jsonify({"error": message}), 429, headers
+    return message, 429, headers
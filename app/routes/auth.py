@@ -1,11 +1,14 @@
-from flask import Blueprint, render_template, redirect, request, session, flash
+from flask import Blueprint, redirect, request, session, flash
 
+from app.page_cache import render_cached
+from app.ratelimit import form_email, rate_limit
 from app.services.auth_service import (
     register_user,
     authenticate_user,
     EmailAlreadyExistsError,
     InvalidCredentialsError,
 )
+from app.services.hash_pool import HashingOverloadedError
 
 # Blueprint: URL のプレフィックスなし（認証系は / 直下のまま）
 auth_bp = Blueprint("auth", __name__)
@@ -13,9 +16,12 @@ auth_bp = Blueprint("auth", __name__)
 
 @auth_bp.route("/")
 def index():
-    """トップページ。ログイン状態に応じてナビゲーションを切り替える。"""
+    """トップページ。ログイン状態に応じてナビゲーションを切り替える。
+
+    出力はログイン状態だけで決まるため、描画・圧縮済みのページをキャッシュから返す。
+    """
     logged_in = "user_id" in session
-    return render_template(
+    return render_cached(
         "index.html",
         show_signin_signup=not logged_in,
         show_dashboard_signout=logged_in,
@@ -27,7 +33,7 @@ def signin():
     """ログインフォームを表示する。既にログイン済みならダッシュボードへ。"""
     if "user_id" in session:
         return redirect("/dashboard")
-    return render_template("signin.html")
+    return render_cached("signin.html")
 
 
 @auth_bp.route("/signup")
@@ -35,7 +41,7 @@ def signup():
     """ユーザー登録フォームを表示する。既にログイン済みならダッシュボードへ。"""
     if "user_id" in session:
         return redirect("/dashboard")
-    return render_template("signup.html")
+    return render_cached("signup.html")
 
 
 @auth_bp.route("/signout")
@@ -46,6 +52,7 @@ def signout():
 
 
 @auth_bp.route("/auth", methods=["POST"])
+@rate_limit("auth", account=form_email)
 def auth():
     """ログイン処理。
 
@@ -64,6 +71,8 @@ def auth():
     except InvalidCredentialsError:
         flash("メールアドレスまたはパスワードが正しくありません。")
         return redirect("/signin")
+    except HashingOverloadedError:
+        return _busy_response()
 
     # セッションには user_id のみ保存する
     # （ユーザー情報が必要な場合は都度 DB から取得する）
@@ -72,6 +81,7 @@ def auth():
 
 
 @auth_bp.route("/register", methods=["POST"])
+@rate_limit("register")
 def register():
     """ユーザー登録処理。
 
@@ -98,6 +108,16 @@ def register():
     except EmailAlreadyExistsError:
         flash("このメールアドレスは既に登録されています。")
         return redirect("/signup")
+    except HashingOverloadedError:
+        return _busy_response()
 
     session["user_id"] = user.id
     return redirect("/dashboard")
+
+
+def _busy_response():
+    """パスワードハッシュ計算が混雑しているときの 503 応答。
+
+    待たせても応答が遅れるだけなので即座に断り、Retry-After で再試行の目安を伝える。
+    """
+    return "混雑しています。しばらくしてから再度お試しください。", 503, {"Retry-After": "1"}
@@ -1,18 +1,46 @@
-from flask import Blueprint, render_template, request, session, jsonify
+import zlib
+from typing import Iterable, Iterator
+
+from flask import (
+    Blueprint,
+    current_app,
+    g,
+    jsonify,
+    render_template,
+    request,
+    session,
+    stream_with_context,
+)
 
 from app.auth import login_required
-from app.models.user import User
+from app.ratelimit import rate_limit, session_user
 from app.services.diary_service import (
     get_user_diaries,
+    iter_user_diaries,
+    get_user_diaries_page,
+    get_user_diaries_between,
+    count_user_diaries_by_period,
+    get_diary_list_version,
+    sync_user_diaries,
+    search_user_diaries,
     create_diary_entry,
     delete_diary_entry,
     update_diary_entry,
+    apply_diary_batch,
     ValidationError,
     NotFoundOrForbiddenError,
+    PAGE_DEFAULT_LIMIT,
+    SEARCH_DEFAULT_LIMIT,
 )
+from app.services import change_feed
+from app.services.transfer_service import export_user_diaries, import_user_diaries
 
 diary_bp = Blueprint("diary", __name__)
 
+# ストリーミング応答で1回に書き出すおおよそのバイト数。
+# 1件ずつ書き出すと小さな write が大量に発生するため、ある程度まとめてから送る。
+_STREAM_CHUNK_SIZE = 64 * 1024
+
 
 @diary_bp.route("/dashboard")
 @login_required
@@ -20,11 +48,9 @@ def dashboard():
     """ダッシュボード画面を表示する。
 
     @login_required デコレータにより、未ログインの場合は /signin にリダイレクトされる。
-    ユーザー名をテンプレートに渡すために DB からユーザー情報を取得する。
+    ユーザー名は login_required が用意した g.current_user から取る（DB には問い合わせない）。
     """
-    user = User.find_by_id(session["user_id"])
-    username = user.username if user else "ゲスト"
-    return render_template("dashboard.html", username=username)
+    return render_template("dashboard.html", username=g.current_user.username)
 
 
 @diary_bp.route("/get_json")
@@ -33,13 +59,298 @@ def get_json():
     """ユーザーの日記一覧を JSON で返す（AJAX エンドポイント）。
 
     フロントエンドの JavaScript から fetch/$.ajax で呼ばれる。
+
+    クエリ文字列に limit または after が含まれる場合はページ単位で返す:
+        GET /get_json?limit=50            → 先頭ページ
+        GET /get_json?limit=50&after=...  → 前回レスポンスの next 以降
+    レスポンスの next が null なら最終ページ。
+    どちらも無い場合は従来どおり全件を返す。
+
+    ?stream=1 を付けると全件を DB からバッチ単位で読みながら JSON 配列を逐次書き出す。
+    レスポンスの形は全件取得と同じだが、日記のリストも JSON 文字列全体も
+    メモリ上に作らないため、件数が多いユーザーでもワーカーのメモリ使用量が一定に保たれる。
+
+    ## 条件付き GET（ETag / 304）
+    一覧のバージョン番号から ETag を作り、ブラウザが If-None-Match で
+    同じ値を送ってきたら本文なしの 304 を返す。判定に使うのは users テーブルの
+    1カラムだけなので、変化がなければ diaries テーブルへのクエリもシリアライズも発生しない。
+    ETag に user_id を含めるのは、同じブラウザで別ユーザーに切り替えたとき
+    バージョン番号が偶然一致して他人のキャッシュが使われるのを防ぐため。
+    """
+    user_id = session["user_id"]
+    etag = f"{user_id}-{get_diary_list_version(user_id)}"
+    if request.if_none_match.contains_weak(etag):
+        return _with_list_cache_headers(current_app.response_class(status=304), etag)
+
+    if request.args.get("stream") == "1":
+        response = current_app.response_class(
+            stream_with_context(_stream_json_list("diaries", iter_user_diaries(user_id))),
+            mimetype="application/json",
+        )
+        return _with_list_cache_headers(response, etag)
+
+    if "limit" not in request.args and "after" not in request.args:
+        diaries = get_user_diaries(user_id)
+        return _with_list_cache_headers(jsonify({"diaries": diaries}), etag)
+
+    try:
+        limit = int(request.args.get("limit", PAGE_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"error": "limit は整数で指定してください。"}), 400
+    try:
+        diaries, next_cursor = get_user_diaries_page(
+            user_id, limit, request.args.get("after") or None
+        )
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    return _with_list_cache_headers(
+        jsonify({"diaries": diaries, "next": next_cursor}), etag
+    )
+
+
+@diary_bp.route("/range_json")
+@login_required
+def range_json():
+    """指定した期間に作成された日記を新しい順に JSON で返す（AJAX エンドポイント）。
+
+        GET /range_json?start=2024-03-01&end=2024-03-31&tz=540&limit=50
+        GET /range_json?start=...&end=...&tz=540&after=...   → 前回レスポンスの next 以降
+
+    start・end は両端を含む日付。tz は日付を区切るタイムゾーンの UTC からの時差（分）で、
+    ブラウザでは -new Date().getTimezoneOffset() で求められる（省略時は UTC）。
+    """
+    try:
+        limit = int(request.args.get("limit", PAGE_DEFAULT_LIMIT))
+        tz_offset = int(request.args.get("tz", 0))
+    except ValueError:
+        return jsonify({"error": "limit と tz は整数で指定してください。"}), 400
+    try:
+        diaries, next_cursor = get_user_diaries_between(
+            session["user_id"],
+            request.args.get("start", ""),
+            request.args.get("end", ""),
+            tz_offset,
+            limit,
+            request.args.get("after") or None,
+        )
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"diaries": diaries, "next": next_cursor})
+
+
+@diary_bp.route("/calendar_json")
+@login_required
+def calendar_json():
+    """期間内の日記の件数を日ごと・月ごとに JSON で返す（カレンダーのヒートマップ用）。
+
+        GET /calendar_json?unit=day&start=2024-01-01&end=2024-12-31&tz=540
+        → {"unit": "day", "counts": {"2024-01-03": 2, "2024-01-05": 1, ...}}
+
+    日記のない日・月は counts に含まれない（0 件として扱う）。
+    集計は DB の GROUP BY 1回で、1年分でも日記の本文は読まない。
+    """
+    unit = request.args.get("unit", "day")
+    try:
+        tz_offset = int(request.args.get("tz", 0))
+    except ValueError:
+        return jsonify({"error": "tz は整数で指定してください。"}), 400
+    try:
+        counts = count_user_diaries_by_period(
+            session["user_id"],
+            unit,
+            request.args.get("start", ""),
+            request.args.get("end", ""),
+            tz_offset,
+        )
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"unit": unit, "counts": counts})
+
+
+@diary_bp.route("/diary/batch", methods=["POST"])
+@rate_limit("write", account=session_user)
+@login_required
+def batch_diary():
+    """複数の日記の削除・更新を1リクエストで適用する（AJAX エンドポイント）。
+
+    リクエスト本文は JSON:
+        {"operations": [{"op": "delete", "id": 1},
+                        {"op": "update", "id": 2, "title": "...", "comment": "..."}]}
+    レスポンスは操作ごとの結果（入力と同じ順序）:
+        {"results": [{"index": 0, "id": 1, "status": "ok"}, ...]}
+    status は ok / validation_error / not_found_or_forbidden のいずれか。
+    """
+    payload = request.get_json(silent=True)
+    operations = payload.get("operations") if isinstance(payload, dict) else None
+    if not isinstance(operations, list):
+        return jsonify({"error": "operations を配列で指定してください。"}), 400
+    try:
+        results = apply_diary_batch(session["user_id"], operations)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"results": results})
+
+
+@diary_bp.route("/sync_json")
+@login_required
+def sync_json():
+    """前回の同期以降の差分を JSON で返す（AJAX エンドポイント）。
+
+    一覧を既に保持しているクライアント向けの差分同期:
+        GET /sync_json              → 全件 + token（full: true）
+        GET /sync_json?token=...    → token 以降に作成・更新された日記と削除された ID
+    クライアントは diaries を ID で上書き、deleted を取り除き、新しい token を保存する。
+    """
+    try:
+        result = sync_user_diaries(session["user_id"], request.args.get("token") or None)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+
+@diary_bp.route("/search_json")
+@login_required
+def search_json():
+    """ユーザーの日記を全文検索して JSON で返す（AJAX エンドポイント）。
+
+        GET /search_json?q=検索語&limit=20
+
+    結果は常にセッションのユーザーの日記に限られる。
+    """
+    try:
+        limit = int(request.args.get("limit", SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"error": "limit は整数で指定してください。"}), 400
+    try:
+        results = search_user_diaries(session["user_id"], request.args.get("q", ""), limit)
+    except ValidationError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"diaries": results})
+
+
+@diary_bp.route("/export_ndjson")
+@login_required
+def export_ndjson():
+    """ユーザーの日記を NDJSON ファイルとしてダウンロードさせる（バックアップ用）。
+
+    ?gzip=1 を付けると gzip 圧縮したファイル（diaries.ndjson.gz）を返す。
+    どちらも DB から読みながら逐次書き出すため、件数が多くてもメモリ使用量は一定。
+    """
+    lines = export_user_diaries(session["user_id"])
+    if request.args.get("gzip") == "1":
+        body, mimetype, filename = _gzip_chunks(lines), "application/gzip", "diaries.ndjson.gz"
+    else:
+        body, mimetype, filename = lines, "application/x-ndjson", "diaries.ndjson"
+    response = current_app.response_class(stream_with_context(body), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+
+@diary_bp.route("/import_ndjson", methods=["POST"])
+@rate_limit("write", account=session_user)
+@login_required
+def import_ndjson():
+    """NDJSON（gzip 圧縮も可）から日記を一括登録する（AJAX エンドポイント）。
+
+    リクエスト本文にそのまま NDJSON を送るか、multipart/form-data の file フィールドで
+    ファイルを送る。不正な行があっても取り込みは中断せず、行番号付きで報告する。
+    """
+    upload = request.files.get("file")
+    stream = upload.stream if upload is not None else request.stream
+    return jsonify(import_user_diaries(session["user_id"], stream))
+
+
+@diary_bp.route("/diary/events")
+@login_required
+def diary_events():
+    """ログイン中のユーザーの日記の変更を Server-Sent Events で配信する。
+
+    ブラウザは EventSource('/diary/events') で接続し、次のイベントを受け取る:
+        event: created / updated   data: {"type": ..., "diary": {...}}（to_dict() と同じ形）
+        event: deleted             data: {"type": "deleted", "id": 1}
+        event: resync              data: {"type": "resync"}（一覧を取得し直す合図）
+    別のタブや端末での変更も、一覧全体を取得し直さずに画面へ反映できる。
+
+    ## 接続中の資源
+    接続は閉じられるまでスレッドを1つ占有するが、DB の接続やセッションは持たない
+    （stream_with_context を使わないため、ジェネレータが動く時点でリクエストの後始末は済んでいる）。
+    flask serve では通常のリクエストとは別枠のスレッドで動くので、接続が増えても
+    他のリクエストを待たせない（app/server.py）。停止時は change_feed.close_all() で終わる。
+    イベントがない間も SSE_HEARTBEAT_SECONDS ごとにコメント行を送り、
+    途中のプロキシに無通信で切断されないようにする。切断はこの書き込みの失敗で検知される。
     """
     user_id = session["user_id"]
-    diaries = get_user_diaries(user_id)
-    return jsonify({"diaries": diaries})
+    heartbeat = current_app.config["SSE_HEARTBEAT_SECONDS"]
+    dumps = current_app.json.dumps
+
+    def generate() -> Iterator[str]:
+        with change_feed.subscribe(user_id) as subscription:
+            # 切断時に EventSource が再接続するまでの待ち時間（ミリ秒）
+            yield "retry: 3000\n\n"
+            while True:
+                event = subscription.get(timeout=heartbeat)
+                if subscription.closed:
+                    return  # ワーカーの停止。クライアントは retry の後に接続し直す
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {dumps(event)}\n\n"
+
+    response = current_app.response_class(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # nginx などのリバースプロキシにバッファリングさせず、イベントをすぐに届けさせる
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _gzip_chunks(chunks: Iterable[str]) -> Iterator[bytes]:
+    """文字列のチャンク列を gzip 形式で逐次圧縮する。
+
+    wbits=31 は zlib に gzip ヘッダー・トレーラー付きで出力させる指定。
+    """
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _stream_json_list(key: str, items: Iterable[dict]) -> Iterator[str]:
+    """{"<key>": [...]} 形式の JSON を、要素を1件ずつエンコードしながら書き出す。
+
+    要素のエンコードには app.json（jsonify と同じ設定）を使うため、
+    一括で返す場合と同じ JSON になる。
+    """
+    dumps = current_app.json.dumps
+    buffer = [f"{{{dumps(key)}:["]
+    size = 0
+    for i, item in enumerate(items):
+        encoded = dumps(item)
+        buffer.append(encoded if i == 0 else "," + encoded)
+        size += len(encoded)
+        if size >= _STREAM_CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    buffer.append("]}")
+    yield "".join(buffer)
+
+
+def _with_list_cache_headers(response, etag: str):
+    """一覧レスポンスに ETag とキャッシュ制御ヘッダーを付ける。
+
+    no-cache は「キャッシュするな」ではなく「使う前に必ず再検証せよ」の意味。
+    ブラウザは保存した本文を再利用しつつ毎回 If-None-Match を送るため、
+    $.get('/get_json') 側を変更しなくても 304 の恩恵を受けられる。
+    private は共有キャッシュ（プロキシ）に他人の日記が残らないようにするため。
+    """
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 
 @diary_bp.route("/create_diary", methods=["POST"])
+@rate_limit("write", account=session_user)
 @login_required
 def create_diary():
     """日記エントリを作成する（AJAX エンドポイント）。
@@ -59,6 +370,7 @@ def create_diary():
 
 
 @diary_bp.route("/diary/<int:diary_id>/delete", methods=["POST"])
+@rate_limit("write", account=session_user)
 @login_required
 def delete_diary(diary_id: int):
     """日記を削除する（AJAX エンドポイント）。
@@ -78,6 +390,7 @@ def delete_diary(diary_id: int):
 
 
 @diary_bp.route("/diary/<int:diary_id>/update", methods=["POST"])
+@rate_limit("write", account=session_user)
 @login_required
 def update_diary(diary_id: int):
     """日記を更新する（AJAX エンドポイント）。
@@ -0,0 +1,25 @@
+import hmac
+
+from flask import Blueprint, abort, current_app, request
+
+from app import metrics
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics")
+def metrics_endpoint():
+    """全ワーカープロセスのリクエスト数・エラー数・レイテンシ・プールの使用状況を返す。
+
+    Prometheus から `Authorization: Bearer <METRICS_TOKEN>` を付けて取得する。
+    METRICS_TOKEN が設定されていなければ、エンドポイントは存在しないものとして 404 を返す
+    （ルート名やアクセス数は外部に見せる情報ではないため）。
+    """
+    token = current_app.config["METRICS_TOKEN"]
+    if not token:
+        abort(404)
+    supplied = request.headers.get("Authorization", "")
+    # 比較にかかる時間からトークンを推測されないよう、定数時間で比較する
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+        return "Unauthorized", 401, {"WWW-Authenticate": 'Bearer realm="metrics"'}
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE, "Cache-Control": "no-store"}
@@ -0,0 +1,323 @@
+"""本番向けの複数プロセスのサーバー（`flask serve`）。標準ライブラリと Werkzeug だけで動く。
+
+`python run.py`（app.run）は1プロセスの開発用サーバーで、負荷をかけることは想定されていない。
+こちらは gunicorn の sync / gthread ワーカーと同じ prefork 型の構成をとる。
+
+## 仕組み
+- マスタープロセスがアプリを1回だけ作り（preload）、待ち受けソケットを開いてから
+  workers 個のワーカープロセスを fork する。import とアプリの初期化は fork 前の1回で済み、
+  その後変更されないメモリは copy-on-write でワーカー間で共有される。
+- 各ワーカーは同じソケットで accept し、最大 threads 本のスレッドでリクエストを処理する。
+  スレッドが埋まっている間は accept しないため、接続はカーネルの待ち行列に残り、
+  手の空いた別のワーカーが受け取る。
+- マスター自身はリクエストを処理せず、ワーカーの終了を監視して、落ちたものを起動し直す。
+- SIGTERM / SIGINT を受けると、マスターは全ワーカーに SIGTERM を送る。ワーカーは新しい接続の
+  受け付けをやめ、処理中のリクエストを graceful_timeout 秒まで待ってから終了する（drain）。
+
+## Server-Sent Events の接続
+SSE（Accept: text/event-stream）の接続は閉じられるまで終わらないため、threads 本の枠に
+数えると、開いたタブの数だけ通常のリクエストが処理できなくなる。そこでリクエスト行と
+ヘッダーを読んだ時点で SSE の接続を別枠（1ワーカーあたり最大 streams 本）に移し、
+通常の枠を空ける。別枠も埋まっていれば 503 と Retry-After を返す。
+停止時は change_feed.close_all() で SSE の応答を終わらせてから drain するので、
+開いたままの接続があっても graceful_timeout まで待たされない。
+
+## fork 後の初期化
+SQLAlchemy の接続プールは、fork 前に開いていた接続をそのまま子プロセスに複製する。
+1つの SQLite 接続を2つのプロセスから使うと DB が壊れうるため、ワーカーは最初に
+engine.dispose(close=False) でプールを作り直す（親の接続は閉じずに手放すだけ）。
+パスワードハッシュのプロセスプール・変更イベントの配信・メトリクスは、
+各モジュールが os.register_at_fork で自分の状態を作り直す。
+"""
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from app.db import db
+from app.services import change_feed
+
+logger = logging.getLogger(__name__)
+
+# 起動からこの秒数以内に終了したワーカーは起動直後の失敗とみなし、再起動の前に同じだけ待つ
+# （設定の誤りなどで fork と終了を高速に繰り返さないため）
+MIN_WORKER_LIFETIME = 1.0
+
+# マスターがワーカーの終了を確かめる間隔、ワーカーが停止の指示を確かめる間隔（秒）
+_POLL_INTERVAL = 0.2
+
+# マスターとワーカーが停止の合図として扱うシグナル
+_STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+# SSE の枠が埋まっているときに、クライアントに再試行を待たせる秒数（Retry-After）
+STREAM_RETRY_AFTER = 5
+
+
+class _RequestHandler(WSGIRequestHandler):
+    """1つの接続で1リクエストだけ処理して閉じる（HTTP/1.0）。
+
+    スレッド数に上限があるため、keep-alive で次のリクエストを待つだけの接続に
+    スレッドを占有させない。keep-alive はリバースプロキシ（nginx 等）で終端する。
+    """
+
+    protocol_version = "HTTP/1.0"
+
+    def parse_request(self) -> bool:
+        if not super().parse_request():
+            return False
+        if "text/event-stream" not in self.headers.get("Accept", ""):
+            return True
+        if self.server.begin_stream():
+            return True
+        # False を返すと、応答を送り終えたものとして接続を閉じる
+        self.send_response(503)
+        self.send_header("Retry-After", str(STREAM_RETRY_AFTER))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return False
+
+
+class _WorkerServer(BaseWSGIServer):
+    """共有の待ち受けソケットで accept し、決まった数のスレッドでリクエストを処理する。
+
+    通常のリクエストは threads 本、SSE の接続はそれとは別に streams 本まで同時に処理する。
+    """
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, app, listener: socket.socket, threads: int, streams: int):
+        host, port = listener.getsockname()[:2]
+        # fd を渡すと Werkzeug は bind せず、そのソケットを複製して使う
+        super().__init__(host, port, app, handler=_RequestHandler, fd=listener.fileno())
+        self._threads = threads
+        self._streams = streams
+        self._slots = threading.BoundedSemaphore(threads)
+        self._stream_slots = threading.BoundedSemaphore(streams)
+        # SSE に移ったスレッドは通常の枠を返すので、スレッドは両方の枠の合計だけ用意する
+        self._executor = ThreadPoolExecutor(max_workers=threads + streams, thread_name_prefix="nota-request")
+        # 処理中のスレッドが SSE の枠を使っているか
+        self._local = threading.local()
+
+    def get_request(self):
+        # 空いたスレッドがなければ accept しない。OSError は socketserver が
+        # 「今回は何もしない」として扱うので、次の周回でもう一度試す。
+        if not self._slots.acquire(timeout=_POLL_INTERVAL):
+            raise BlockingIOError("no idle request thread")
+        try:
+            # 待ち受けソケットは非ブロッキング。他のワーカーが先に受け取った場合は BlockingIOError
+            request, client_address = super().get_request()
+        except BaseException:
+            self._slots.release()
+            raise
+        request.setblocking(True)
+        return request, client_address
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process, request, client_address)
+
+    def begin_stream(self) -> bool:
+        """処理中のリクエストを SSE の枠に移し、通常の枠を空ける。SSE の枠が埋まっていれば False。"""
+        if not self._stream_slots.acquire(blocking=False):
+            return False
+        self._local.stream = True
+        self._slots.release()
+        return True
+
+    def _process(self, request, client_address):
+        self._local.stream = False
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            if self._local.stream:
+                self._stream_slots.release()
+            else:
+                self._slots.release()
+
+    def drain(self, timeout: float) -> bool:
+        """処理中のリクエストと SSE の接続が終わるまで最大 timeout 秒待つ。全て終われば True を返す。
+
+        SSE の応答は呼び出し側が change_feed.close_all() で終わらせておく。
+        """
+        deadline = time.monotonic() + timeout
+        for slots, count in ((self._slots, self._threads), (self._stream_slots, self._streams)):
+            for _ in range(count):
+                if not slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                    return False
+        return True
+
+
+def listen(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    """全ワーカーで共有する待ち受けソケットを開く。
+
+    非ブロッキングにするのは、複数のワーカーが同じ接続で同時に起こされたとき、
+    受け取れなかったワーカーが accept で止まらずに次の周回へ進めるようにするため
+    （O_NONBLOCK は fork・複製したソケットでも共有される）。
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    listener = socket.create_server((host, port), family=family, backlog=backlog)
+    listener.setblocking(False)
+    return listener
+
+
+def serve(
+    app, listener: socket.socket, workers: int, threads: int, graceful_timeout: float, streams: int = 100
+) -> None:
+    """workers 個のワーカーで app を配信し、SIGTERM / SIGINT で全ワーカーを止めるまで戻らない。
+
+    Args:
+        app: fork 前に作っておいた Flask アプリ（全ワーカーで共有される）
+        listener: listen() で開いた待ち受けソケット
+        workers: ワーカープロセスの数
+        threads: 1ワーカーあたりのリクエスト処理スレッドの数
+        graceful_timeout: 停止時に処理中のリクエストを待つ秒数
+        streams: 1ワーカーあたりの SSE 接続の上限（threads とは別枠）
+    """
+    _Master(app, listener, workers, threads, graceful_timeout, streams).run()
+
+
+class _Master:
+    """ワーカーを起動し、落ちたら起動し直し、停止の合図で全ワーカーを drain させる。"""
+
+    def __init__(
+        self, app, listener: socket.socket, workers: int, threads: int, graceful_timeout: float, streams: int
+    ):
+        self.app = app
+        self.listener = listener
+        self.size = workers
+        self.threads = threads
+        self.streams = streams
+        self.graceful_timeout = graceful_timeout
+        # pid → 起動時刻（time.monotonic()）
+        self.workers: Dict[int, float] = {}
+        self.stopping = False
+
+    def run(self) -> None:
+        for signum in _STOP_SIGNALS:
+            signal.signal(signum, self._request_stop)
+        host, port = self.listener.getsockname()[:2]
+        logger.info("Listening on %s:%d (master %d, %d workers x %d threads, %d streams)",
+                    host, port, os.getpid(), self.size, self.threads, self.streams)
+        for _ in range(self.size):
+            self._spawn()
+        while not self.stopping:
+            self._reap(restart=True)
+            time.sleep(_POLL_INTERVAL)
+        self._stop()
+
+    def _request_stop(self, signum, frame) -> None:
+        self.stopping = True
+
+    def _spawn(self) -> None:
+        # fork の前後でシグナルを保留する。子プロセスがハンドラを入れ替える前に届いた合図が
+        # 複製されたマスター用のハンドラで処理され、握りつぶされるのを防ぐ。
+        previous = signal.pthread_sigmask(signal.SIG_BLOCK, _STOP_SIGNALS)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    _run_worker(self.app, self.listener, self.threads, self.streams,
+                                self.graceful_timeout, previous)
+                    code = 0
+                except BaseException:
+                    logger.exception("Worker %d failed", os.getpid())
+                finally:
+                    # 親から複製された atexit の処理やスレッドの後始末を走らせずに終了する
+                    logging.shutdown()
+                    os._exit(code)
+        finally:
+            signal.pthread_sigmask(signal.SIG_SETMASK, previous)
+        self.workers[pid] = time.monotonic()
+        logger.info("Booted worker %d", pid)
+
+    def _reap(self, restart: bool) -> None:
+        """終了したワーカーを回収する。restart なら同じ数だけ起動し直す。"""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            if started is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if not restart:
+                continue
+            logger.warning("Worker %d exited with %d; restarting", pid, code)
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            if not self.stopping:
+                self._spawn()
+
+    def _stop(self) -> None:
+        logger.info("Stopping %d workers", len(self.workers))
+        for pid in list(self.workers):
+            _signal(pid, signal.SIGTERM)
+        # ワーカーは graceful_timeout で drain を打ち切るので、少しの余裕を見て待つ
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap(restart=False)
+            time.sleep(_POLL_INTERVAL / 4)
+        for pid in list(self.workers):
+            logger.warning("Killing worker %d", pid)
+            _signal(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.workers.clear()
+        self.listener.close()
+
+
+def _signal(pid: int, signum: int) -> None:
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def _run_worker(
+    app, listener: socket.socket, threads: int, streams: int, graceful_timeout: float, signal_mask
+) -> None:
+    """ワーカープロセスの本体。SIGTERM / SIGINT を受けるまでリクエストを処理し、drain して戻る。"""
+    _reinitialize_after_fork(app)
+    server = _WorkerServer(app, listener, threads, streams)
+    # server が複製を持つので、マスターから引き継いだ分は閉じる
+    listener.close()
+
+    def stop(signum, frame):
+        # shutdown() は serve_forever() の終了を待つため、それを動かしているこのスレッドでは呼べない
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    for signum in _STOP_SIGNALS:
+        signal.signal(signum, stop)
+    signal.pthread_sigmask(signal.SIG_SETMASK, signal_mask)
+
+    server.serve_forever(poll_interval=_POLL_INTERVAL)
+    # SSE の応答は自分からは終わらないので、drain の前に終わらせる
+    change_feed.close_all()
+    if not server.drain(graceful_timeout):
+        logger.warning("Worker %d: requests still running after %.0fs; exiting", os.getpid(), graceful_timeout)
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+
+def _reinitialize_after_fork(app) -> None:
+    """マスターから複製された DB の接続プールを捨て、このプロセス専用のプールにする。
+
+    close=False にするのは、複製された接続を子プロセスから閉じると、
+    同じソケット・ファイルを使っている親プロセス側の接続まで壊れるため。
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,51 @@
+import time
+
+from app.models.diary import DiaryEntry, DiaryTombstone
+from app.models.user import User
+
+# 段階的な削除で1回のトランザクションに消す行数と、トランザクションの間に空ける秒数。
+# 1回あたり数ミリ秒で書き込みロックを手放し、その間に他のリクエストの書き込みを通す。
+PURGE_BATCH_SIZE = 500
+PURGE_PAUSE_SECONDS = 0.005
+
+
+def delete_account(user_id: int) -> None:
+    """アカウントを即座に削除する。日記・削除ログは DB の ON DELETE CASCADE で消える。
+
+    日記が数千件程度までならこれで十分速い。それ以上のアカウントは purge_account を使う。
+    """
+    User.delete(user_id)
+
+
+def purge_account(
+    user_id: int,
+    batch_size: int = PURGE_BATCH_SIZE,
+    pause_seconds: float = PURGE_PAUSE_SECONDS,
+) -> int:
+    """日記と削除ログを batch_size 件ずつ消してから、アカウントを削除する。
+
+    ## なぜ分けて消すか
+    SQLite の書き込みは DB 全体で1つしか同時に進めない。10万件の日記を1つの DELETE
+    （ON DELETE CASCADE を含む）で消すと、その間ほかのユーザーの書き込みがすべて待たされる。
+    小さなトランザクションに分けて間を空ければ、1回の待ち時間は数ミリ秒で済む。
+
+    ## 途中で止まった場合
+    各バッチは commit 済みなので、プロセスが落ちても消した分は戻らない。
+    もう一度呼べば残りから続きを消す（同じ user_id で何度呼んでもよい）。
+    最後のアカウント削除までの間はログインも書き込みもできるが、
+    その間に増えた日記も最後の DELETE の ON DELETE CASCADE で消える。
+
+    Returns:
+        段階的に削除した日記・削除ログの行数（最後のアカウント削除で消えた分は含まない）
+    """
+    deleted = 0
+    for model in (DiaryEntry, DiaryTombstone):
+        while True:
+            count = model.delete_batch_by_user(user_id, batch_size)
+            deleted += count
+            if count < batch_size:
+                break
+            time.sleep(pause_seconds)
+    User.delete(user_id)
+    return deleted
+
@@ -1,7 +1,10 @@
+from functools import lru_cache
 from typing import Optional
-from werkzeug.security import generate_password_hash, check_password_hash
 
 from app.models.user import User
+from app.services import hash_pool, password_hasher
+from app.services.hash_pool import HashingOverloadedError
+from app.services.password_hasher import Pbkdf2Hasher
 
 
 class EmailAlreadyExistsError(Exception):
@@ -18,7 +21,7 @@ def register_user(username: str, email: str, password: str) -> User:
     処理内容:
     1. 入力値の基本バリデーション（空文字チェックはルート層で行う）
     2. メールアドレスの重複チェック
-    3. パスワードを Werkzeug でハッシュ化（pbkdf2:sha256 + ソルト自動付与）
+    3. パスワードを現在のハッシュ方式でハッシュ化（password_hasher で設定。ソルト自動付与）
     4. DB に保存
 
     Args:
@@ -31,14 +34,15 @@ def register_user(username: str, email: str, password: str) -> User:
 
     Raises:
         EmailAlreadyExistsError: メールアドレスが既に存在する場合
+        HashingOverloadedError: ハッシュ計算の待ち行列が満杯の場合
     """
     if User.find_by_email(email) is not None:
         raise EmailAlreadyExistsError(f"Email '{email}' is already registered")
 
-    # generate_password_hash は「pbkdf2:sha256$<ソルト>$<ハッシュ>」形式の文字列を返す
+    # ハッシュは「pbkdf2:sha256:<回数>$<ソルト>$<ハッシュ>」形式の文字列になる
     # ソルトは呼び出すたびにランダム生成されるため、同じパスワードでも毎回異なる値になる
-    # method を明示: Python 3.9 の macOS システム Python は scrypt を未サポートのため pbkdf2:sha256 を使用
-    hashed = generate_password_hash(password, method="pbkdf2:sha256")
+    # 計算は hash_pool のプロセスで行い、Web ワーカーのスレッドを CPU 処理で塞がない
+    hashed = hash_pool.run(password_hasher.current().hash, password)
     return User.create(username, email, hashed)
 
 
@@ -48,17 +52,45 @@ def authenticate_user(email: str, password: str) -> User:
     check_password_hash は DB に保存されたハッシュ文字列からソルトを自動で取り出し、
     平文パスワードと照合する。タイミング攻撃を防ぐため比較は定数時間で行われる。
 
+    ## 透過的な再ハッシュ
+    照合に成功し、保存済みハッシュのパラメータ（方式・イテレーション回数）が
+    現在の設定と異なれば、手元にある平文パスワードで作り直して保存する。
+    平文が分かるのはログインの瞬間だけなので、設定を強くした後も
+    ユーザーに再設定を求めずに、ログインした順に新しい設定へ移行できる。
+
     Raises:
         InvalidCredentialsError: メールアドレスが存在しない、またはパスワードが違う場合
+        HashingOverloadedError: ハッシュ計算の待ち行列が満杯の場合
     """
-    user: Optional[User] = User.find_by_email(email)
+    # ログインは読み取りのみなのでレプリカで検索する
+    user: Optional[User] = User.find_by_email(email, from_replica=True)
 
     # ユーザーが存在しない場合でもハッシュ検証を行う
     # （ユーザーの存在有無をレスポンス時間から推測されないようにするため）
-    dummy_hash = generate_password_hash("dummy", method="pbkdf2:sha256")
-    stored_hash = user.password_hash if user else dummy_hash
+    hasher = password_hasher.current()
+    stored_hash = user.password_hash if user else _dummy_hash(hasher)
 
-    if not check_password_hash(stored_hash, password) or user is None:
+    if not hash_pool.run(hasher.verify, stored_hash, password) or user is None:
         raise InvalidCredentialsError("Invalid email or password")
 
+    if hasher.needs_rehash(stored_hash):
+        try:
+            new_hash = hash_pool.run(hasher.hash, password)
+        except HashingOverloadedError:
+            # 混雑時はログインを優先し、再ハッシュは次回のログインに回す
+            return user
+        User.update_password_hash(user.id, new_hash)
+
     return user
+
+
+@lru_cache(maxsize=4)
+def _dummy_hash(hasher: Pbkdf2Hasher) -> str:
+    """存在しないユーザーの照合に使うダミーのハッシュ（設定ごとに1度だけ計算する）。
+
+    照合にかかる時間はハッシュの method とイテレーション回数で決まり、ソルトや
+    元のパスワードには依存しない。現在の設定で作ったハッシュを使い回せば、
+    ログインのたびにダミーを計算し直さなくても応答時間は実ユーザーと揃う。
+    hasher をキーにキャッシュするため、設定を変えればダミーも新しい設定で作り直される。
+    """
+    return hasher.hash("dummy")
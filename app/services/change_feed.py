@@ -0,0 +1,257 @@
+import atexit
+import json
+import os
+import queue
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Set
+
+# 購読者のキューが溢れたときに送るイベント。受け取ったクライアントは一覧を取得し直す。
+RESYNC_EVENT = {"type": "resync"}
+
+# Unix ドメインソケットの datagram 1通の上限の目安。超えるイベントは resync に置き換えて送る。
+_MAX_DATAGRAM_BYTES = 64 * 1024
+
+
+class Subscription:
+    """1つの SSE 接続が受け取るイベントのキュー。
+
+    ## 上限付きキューと背圧（backpressure）
+    キューは queue_size 件で打ち切る。読み出しの遅いクライアントのために
+    発行側（日記を保存したリクエストのスレッド）を待たせたり、メモリを際限なく使ったりしない。
+    溢れたら以降のイベントを捨てて「溢れた」印だけを残し、次の get() で resync を返す。
+    個々の差分を取りこぼしても、クライアントが一覧を取得し直せば最新の状態に戻れる。
+
+    ## 閉じる
+    サーバーの停止時には close() で購読を閉じる。待っている get() はすぐに None を返し、
+    closed が True になるので、SSE の応答はイベントを待ち続けずに終わる。
+    """
+
+    def __init__(self, user_id: int, queue_size: int):
+        self.user_id = user_id
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=queue_size)
+        self._overflowed = False
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self) -> None:
+        self._closed = True
+        try:
+            # get() で待っているスレッドを起こす。キューが一杯なら get() は待たずに返る
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def put(self, event: dict) -> None:
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._overflowed = True
+
+    def get(self, timeout: float) -> Optional[dict]:
+        """次のイベントを返す。timeout 秒待っても来なければ、または閉じられたら None。"""
+        if self._closed:
+            return None
+        if self._overflowed:
+            # 先に印を消してからキューを空にする。その間に届いたイベントも、
+            # クライアントが resync で取得し直す一覧には含まれる。
+            self._overflowed = False
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    return RESYNC_EVENT
+        try:
+            event = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return None if self._closed else event
+
+
+class _UnixFanout:
+    """同じホストの他のワーカープロセスにイベントを配る Unix ドメインソケット（datagram）。
+
+    各プロセスが socket_dir/<pid>.sock に受信用ソケットを作り、発行時はディレクトリ内の
+    他のソケットすべてに同じ datagram を送る。受信したイベントは自プロセスの購読者に配る。
+    仲介プロセスを置かないため、どのワーカーが落ちても他のワーカーの配信は止まらない。
+
+    相手の受信バッファが一杯で送れない場合は、そのプロセス向けの1通を諦める
+    （発行側のリクエストを待たせないため）。取りこぼしたクライアントは再接続時に一覧を取得し直す。
+    """
+
+    _SEND_TIMEOUT_SECONDS = 0.1
+
+    def __init__(self, socket_dir: str):
+        os.makedirs(socket_dir, exist_ok=True)
+        self.socket_dir = socket_dir
+        self._pid = os.getpid()
+        self.path = os.path.join(socket_dir, f"{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # 同じ PID で前回残ったソケット
+        self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._receiver.bind(self.path)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.settimeout(self._SEND_TIMEOUT_SECONDS)
+        self._send_lock = threading.Lock()
+        threading.Thread(target=self._receive_forever, name="change-feed-receiver", daemon=True).start()
+        atexit.register(self.close)
+
+    def send(self, payload: bytes) -> None:
+        for name in os.listdir(self.socket_dir):
+            peer = os.path.join(self.socket_dir, name)
+            if not name.endswith(".sock") or peer == self.path:
+                continue
+            try:
+                with self._send_lock:
+                    self._sender.sendto(payload, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 終了したプロセスのソケット。次回から送らないように消す
+                _unlink_quietly(peer)
+            except (socket.timeout, BlockingIOError):
+                pass
+
+    def close(self) -> None:
+        # fork した子プロセスにも atexit ごと複製されるため、作ったプロセスでだけ後始末する
+        if os.getpid() != self._pid:
+            return
+        self._receiver.close()
+        _unlink_quietly(self.path)
+
+    def _receive_forever(self) -> None:
+        while True:
+            try:
+                payload = self._receiver.recv(_MAX_DATAGRAM_BYTES)
+            except OSError:
+                return  # close() 済み
+            try:
+                message = json.loads(payload)
+                user_id, event = message["user_id"], message["event"]
+            except (ValueError, KeyError, TypeError):
+                continue  # 壊れた datagram は捨てる
+            _deliver_local(user_id, event)
+
+
+def _unlink_quietly(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+# プロセスごとの状態。configure() で設定し、Unix ソケットは最初の利用時に作る。
+_queue_size = 100
+_socket_dir: Optional[str] = None
+_subscribers: Dict[int, Set[Subscription]] = {}
+_fanout: Optional[_UnixFanout] = None
+_fanout_pid: Optional[int] = None
+_closing = False
+_lock = threading.Lock()
+
+
+def configure(queue_size: int, socket_dir: Optional[str] = None) -> None:
+    """購読者ごとのキューの大きさと、プロセス間配信に使うディレクトリを設定する。
+
+    Args:
+        queue_size: 1つの接続に溜めておけるイベント数。超えたら resync を送る。
+        socket_dir: 複数ワーカーで動かす場合に、各プロセスの Unix ソケットを置くディレクトリ。
+                    None ならイベントは発行したプロセス内の接続にだけ届く。
+    """
+    global _queue_size, _socket_dir, _fanout, _fanout_pid, _closing
+    with _lock:
+        if _fanout is not None and _fanout_pid == os.getpid():
+            _fanout.close()
+        _closing = False
+        _queue_size = queue_size
+        _socket_dir = socket_dir
+        _fanout = None
+        _fanout_pid = None
+
+
+@contextmanager
+def subscribe(user_id: int) -> Iterator[Subscription]:
+    """user_id の日記の変更イベントを受け取る。with を抜けると購読をやめる。"""
+    subscription = Subscription(user_id, _queue_size)
+    _get_fanout()  # 他のプロセスからのイベントを受け取れるようにしておく
+    with _lock:
+        if _closing:
+            subscription.close()  # close_all() の後に始まった購読もすぐに終わらせる
+        _subscribers.setdefault(user_id, set()).add(subscription)
+    try:
+        yield subscription
+    finally:
+        with _lock:
+            subscribers = _subscribers.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del _subscribers[user_id]
+
+
+def close_all() -> None:
+    """このプロセスの購読をすべて閉じ、以降の購読もすぐに閉じる（ワーカーの停止時に使う）。
+
+    SSE の接続は自分からは終わらないため、閉じなければ drain が graceful_timeout まで待たされる。
+    閉じられた接続のクライアント（EventSource）は retry の後、別のワーカーへ接続し直す。
+    """
+    global _closing
+    with _lock:
+        _closing = True
+        subscriptions = [s for subscribers in _subscribers.values() for s in subscribers]
+    for subscription in subscriptions:
+        subscription.close()
+
+
+def publish(user_id: int, event: dict) -> None:
+    """user_id の日記の変更イベントを、このプロセスと（設定されていれば）他のプロセスの購読者に配る。
+
+    DB への commit が終わった後に呼ぶこと。受け取ったクライアントが一覧を取得し直したとき、
+    変更がまだ見えないということがないようにするため。
+    """
+    _deliver_local(user_id, event)
+    fanout = _get_fanout()
+    if fanout is None:
+        return
+    payload = json.dumps({"user_id": user_id, "event": event}, ensure_ascii=False).encode("utf-8")
+    if len(payload) > _MAX_DATAGRAM_BYTES:
+        payload = json.dumps({"user_id": user_id, "event": RESYNC_EVENT}).encode("utf-8")
+    fanout.send(payload)
+
+
+def _deliver_local(user_id: int, event: dict) -> None:
+    with _lock:
+        subscribers = list(_subscribers.get(user_id, ()))
+    for subscription in subscribers:
+        subscription.put(event)
+
+
+def _get_fanout() -> Optional[_UnixFanout]:
+    """このプロセスの Unix ソケットを返す（設定されていて未作成なら作る）。"""
+    global _fanout, _fanout_pid
+    if _socket_dir is None:
+        return None
+    with _lock:
+        if _fanout is None or _fanout_pid != os.getpid():
+            _fanout = _UnixFanout(_socket_dir)
+            _fanout_pid = os.getpid()
+        return _fanout
+
+
+def _reset_after_fork() -> None:
+    """fork 直後の子プロセスで、親から複製された購読者・ソケット・ロックを捨てる。
+
+    親の SSE 接続は子には存在せず、受信スレッドも複製されない。
+    ソケットは子プロセスの PID で次の利用時に作り直す。
+    """
+    global _lock, _subscribers, _fanout, _fanout_pid, _closing
+    _lock = threading.Lock()
+    _subscribers = {}
+    _closing = False
+    _fanout = None
+    _fanout_pid = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,11 +1,43 @@
-from typing import List
-from app.models.diary import DiaryEntry
+import base64
+import binascii
+import calendar
+import html
+import json
+import re
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+from app.models.diary import DiaryEntry, DiaryTombstone
+from app.models.user import User
+from app.services import change_feed
 
 
 # バリデーション定数
 TITLE_MAX_LENGTH = 100
 COMMENT_MAX_LENGTH = 10000
 
+# ページネーション定数
+PAGE_DEFAULT_LIMIT = 50
+PAGE_MAX_LIMIT = 200
+
+# 期間指定・カレンダー集計の定数
+# unit ごとの区切りの書式（SQLite の strftime()）
+CALENDAR_UNITS = {"day": "%Y-%m-%d", "month": "%Y-%m"}
+# 1回に指定できる期間の日数（月ごとの集計で約10年分）
+CALENDAR_MAX_DAYS = 3660
+# タイムゾーンの時差として受け付ける範囲（分）。実在する時差は -12:00〜+14:00
+TZ_OFFSET_MAX_MINUTES = 14 * 60
+
+# 一括操作で1リクエストに含められる操作数の上限
+BATCH_MAX_OPERATIONS = 1000
+
+# 検索定数
+SEARCH_QUERY_MAX_LENGTH = 100
+SEARCH_DEFAULT_LIMIT = 20
+# trigram トークナイザが索引できる最短の語の長さ
+_TRIGRAM_MIN_LENGTH = 3
+# 部分一致検索でスニペットとして一致箇所の前後に残す文字数
+_SNIPPET_RADIUS = 32
+
 
 class ValidationError(Exception):
     """入力値バリデーション失敗時に送出する例外。"""
@@ -24,25 +56,278 @@ class NotFoundOrForbiddenError(Exception):
 def get_user_diaries(user_id: int) -> List[dict]:
     """ユーザーの日記一覧を辞書のリストで返す（新しい順）。
 
-    JSON レスポンス用に to_dict() で変換している。
+    JSON レスポンス用なので、ORM オブジェクトを作らずに必要なカラムだけを
+    辞書に詰めて返す（DiaryEntry.list_dicts_by_user）。
     """
-    return [entry.to_dict() for entry in DiaryEntry.list_by_user(user_id)]
+    return DiaryEntry.list_dicts_by_user(user_id)
 
 
-def create_diary_entry(user_id: int, title: str, comment: str) -> DiaryEntry:
-    """日記エントリを作成して返す。
+def iter_user_diaries(user_id: int) -> Iterator[dict]:
+    """ユーザーの日記を新しい順に辞書で1件ずつ返す（ストリーミング用）。
 
-    バリデーション:
-    - title・comment が空でないこと
-    - 各フィールドが最大長を超えないこと
+    get_user_diaries と違い全件のリストを作らないため、
+    件数が多くてもメモリ使用量は DB から読むバッチ1つ分で頭打ちになる。
+    """
+    return DiaryEntry.iter_dicts_by_user(user_id)
+
+
+def get_diary_list_version(user_id: int) -> int:
+    """日記一覧のバージョン番号を返す。
+
+    日記の作成・更新・削除のたびに増える値で、一覧の ETag に使う。
+    users テーブルの主キー検索1回で済み、diaries テーブルには触れない。
+    """
+    return User.get_diary_version(user_id) or 0
+
+
+def get_user_diaries_page(
+    user_id: int,
+    limit: int = PAGE_DEFAULT_LIMIT,
+    after: Optional[str] = None,
+    between: Optional[Tuple[int, int]] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """ユーザーの日記を新しい順に1ページ分返す。
+
+    limit + 1 件を取得し、溢れた1件の有無で「次ページがあるか」を判定する
+    （件数を数える COUNT クエリを別途発行しないため）。
 
     Args:
         user_id: 所有者のユーザーID
-        title: 日記タイトル（最大 TITLE_MAX_LENGTH 文字）
-        comment: 日記本文（最大 COMMENT_MAX_LENGTH 文字）
+        limit: 1ページの件数（1〜PAGE_MAX_LIMIT）
+        after: 前回のレスポンスで受け取った next カーソル。None なら先頭ページ。
+        between: (開始, 終了) の UNIX 時刻。指定するとその期間に作成された日記だけを返す。
 
     Returns:
-        作成した DiaryEntry
+        (日記の辞書のリスト, 次ページのカーソル)。最終ページならカーソルは None。
+
+    Raises:
+        ValidationError: limit が範囲外、またはカーソルが不正な場合
+    """
+    if not 1 <= limit <= PAGE_MAX_LIMIT:
+        raise ValidationError(f"limit は 1〜{PAGE_MAX_LIMIT} の範囲で指定してください。")
+
+    position = tuple(_decode_opaque(after, (int, int))) if after else None
+    entries = DiaryEntry.list_page_by_user(user_id, limit + 1, position, between)
+
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        last = entries[-1]
+        next_cursor = _encode_opaque(last.created_ts, last.id)
+    return [entry.to_dict() for entry in entries], next_cursor
+
+
+def get_user_diaries_between(
+    user_id: int,
+    start: str,
+    end: str,
+    tz_offset: int = 0,
+    limit: int = PAGE_DEFAULT_LIMIT,
+    after: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """start 日から end 日まで（両端を含む）に作成された日記を新しい順に1ページ分返す。
+
+    日付の境界は tz_offset のタイムゾーンの 0 時で決まる。ページの扱いは
+    get_user_diaries_page と同じ（next カーソルを after に渡すと続きを返す）。
+
+    Args:
+        start / end: YYYY-MM-DD 形式の日付
+        tz_offset: 日付を解釈するタイムゾーンの UTC からの時差（分。日本時間なら 540）
+
+    Raises:
+        ValidationError: 日付・時差・limit・カーソルが不正な場合
+    """
+    between = _date_range(start, end, tz_offset, CALENDAR_MAX_DAYS)
+    return get_user_diaries_page(user_id, limit, after, between)
+
+
+def count_user_diaries_by_period(
+    user_id: int, unit: str, start: str, end: str, tz_offset: int = 0
+) -> Dict[str, int]:
+    """start 日から end 日までの日記の件数を、日または月ごとに数えて返す（カレンダー表示用）。
+
+    DB 側で GROUP BY した結果を受け取るだけなので、1年分の日ごとの件数でも
+    クエリは1回、受け取る行は日記のある日の数だけで済む。日記のない日・月は含まない。
+
+    Args:
+        unit: "day"（'YYYY-MM-DD' ごと）または "month"（'YYYY-MM' ごと）
+        start / end: YYYY-MM-DD 形式の日付（両端を含む）
+        tz_offset: 日・月の区切りを決めるタイムゾーンの UTC からの時差（分）
+
+    Returns:
+        {"2024-03-01": 2, ...} のように区切りから件数への辞書（古い順）
+
+    Raises:
+        ValidationError: unit・日付・時差が不正な場合
+    """
+    if unit not in CALENDAR_UNITS:
+        raise ValidationError(f"unit は {' / '.join(CALENDAR_UNITS)} のいずれかで指定してください。")
+    between = _date_range(start, end, tz_offset, CALENDAR_MAX_DAYS)
+    rows = DiaryEntry.count_by_period(user_id, between, CALENDAR_UNITS[unit], tz_offset * 60)
+    return {row.period: row.count for row in rows}
+
+
+def _date_range(start: str, end: str, tz_offset: int, max_days: int) -> Tuple[int, int]:
+    """日付の範囲を、created_ts と比べる (開始, 終了) の UNIX 時刻にする。
+
+    終了は end の翌日 0 時（その時刻を含まない）。created_ts は整数なので、
+    「23:59:59 以下」ではなく「翌日 0 時未満」とすれば端の秒を取りこぼさない。
+    """
+    if not -TZ_OFFSET_MAX_MINUTES <= tz_offset <= TZ_OFFSET_MAX_MINUTES:
+        raise ValidationError(f"tz は ±{TZ_OFFSET_MAX_MINUTES} 分の範囲で指定してください。")
+    try:
+        first = date.fromisoformat(start)
+        last = date.fromisoformat(end)
+    except (TypeError, ValueError):
+        raise ValidationError("start と end は YYYY-MM-DD 形式で指定してください。")
+    if last < first:
+        raise ValidationError("end は start 以降の日付を指定してください。")
+    if (last - first).days >= max_days:
+        raise ValidationError(f"期間は {max_days} 日以内で指定してください。")
+    try:
+        next_day = last + timedelta(days=1)
+    except OverflowError:
+        # date の上限（9999-12-31）には翌日がない
+        raise ValidationError(f"end は {date.max - timedelta(days=1)} 以前の日付を指定してください。")
+    offset = tz_offset * 60
+    since = calendar.timegm(first.timetuple()) - offset
+    until = calendar.timegm(next_day.timetuple()) - offset
+    return since, until
+
+
+def sync_user_diaries(user_id: int, token: Optional[str] = None) -> dict:
+    """前回の同期以降の差分（作成・更新された日記と削除された ID）を返す。
+
+    クライアントは返された token を保存し、次回の呼び出しで渡す。
+    token は一覧のバージョン番号を包んだもので、差分は (user_id, change_seq) の
+    インデックスで引くため、コストは履歴全体ではなく変更件数に比例する。
+
+    token が無い、またはサーバーの現在値より新しい（ユーザーの作り直し等で
+    巻き戻った）場合は全件を返し、full=True でクライアントに置き換えを指示する。
+
+    Returns:
+        {"diaries": [...], "deleted": [id, ...], "token": str, "full": bool}
+
+    Raises:
+        ValidationError: token が不正な場合
+    """
+    # 先にバージョンを読んでから差分を読む。間に書き込みが割り込んでも、
+    # その変更は次回の同期で再送されるだけで取りこぼしは起きない。
+    version = get_diary_list_version(user_id)
+    since = _decode_opaque(token, (int,))[0] if token else None
+
+    if since is None or since > version:
+        return {
+            "diaries": get_user_diaries(user_id),
+            "deleted": [],
+            "token": _encode_opaque(version),
+            "full": True,
+        }
+    return {
+        "diaries": [e.to_dict() for e in DiaryEntry.list_changed_since(user_id, since)],
+        "deleted": DiaryTombstone.list_diary_ids_since(user_id, since),
+        "token": _encode_opaque(version),
+        "full": False,
+    }
+
+
+def search_user_diaries(
+    user_id: int, query: str, limit: int = SEARCH_DEFAULT_LIMIT
+) -> List[dict]:
+    """ユーザーの日記を全文検索し、関連度順に返す。
+
+    空白で区切った全ての語を含む日記が対象（AND 検索）。
+    各結果には一致箇所を <mark> で囲んだ HTML の snippet が付く。
+    snippet 以外の本文はエスケープしていないため、表示時は通常どおりエスケープすること。
+
+    全ての語が3文字以上なら trigram の全文検索インデックスを使う。
+    日本語では2文字の語（「日記」等）も多いため、3文字未満の語を含むときは
+    そのユーザーの日記に絞った部分一致検索に切り替える（結果は新しい順）。
+
+    Raises:
+        ValidationError: 検索語が空・長すぎる、または limit が範囲外の場合
+    """
+    terms = query.split()
+    if not terms:
+        raise ValidationError("検索語を入力してください。")
+    if len(query) > SEARCH_QUERY_MAX_LENGTH:
+        raise ValidationError(f"検索語は {SEARCH_QUERY_MAX_LENGTH} 文字以内で入力してください。")
+    if not 1 <= limit <= PAGE_MAX_LIMIT:
+        raise ValidationError(f"limit は 1〜{PAGE_MAX_LIMIT} の範囲で指定してください。")
+
+    if all(len(term) >= _TRIGRAM_MIN_LENGTH for term in terms):
+        # 各語を "..." で囲んでフレーズ扱いにし、AND や * などの
+        # FTS5 のクエリ構文として解釈されないようにする
+        match_query = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        return [
+            {**row._mapping, "snippet": _highlight(row.snippet)}
+            for row in DiaryEntry.search(user_id, match_query, limit)
+        ]
+
+    return [
+        {**entry.to_dict(), "snippet": _highlight(_make_snippet(entry, terms))}
+        for entry in DiaryEntry.search_by_substring(user_id, terms, limit)
+    ]
+
+
+def _make_snippet(entry: DiaryEntry, terms: List[str]) -> str:
+    """FTS5 の snippet() と同じ形式（一致部分を \x02 / \x03 で挟む）の抜粋を作る。"""
+    pattern = re.compile(
+        "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)),
+        re.IGNORECASE,
+    )
+    source = entry.comment if pattern.search(entry.comment) else entry.title
+    match = pattern.search(source)
+    start = max(0, match.start() - _SNIPPET_RADIUS) if match else 0
+    end = min(len(source), (match.end() if match else 0) + _SNIPPET_RADIUS)
+    excerpt = pattern.sub(lambda m: f"\x02{m.group(0)}\x03", source[start:end])
+    return ("…" if start > 0 else "") + excerpt + ("…" if end < len(source) else "")
+
+
+def _highlight(snippet: str) -> str:
+    """抜粋を HTML エスケープしてから、一致部分の目印を <mark> に置き換える。"""
+    return html.escape(snippet).replace("\x02", "<mark>").replace("\x03", "</mark>")
+
+
+def _encode_opaque(*values) -> str:
+    """カーソルや同期トークンを URL にそのまま載せられる不透明な文字列にする。
+
+    クライアントに中身を解釈させない（= 後から形式を変えられる）ため、
+    JSON を URL-safe Base64 で包んで渡す。
+    """
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_opaque(value: str, types: Tuple[type, ...]) -> list:
+    """_encode_opaque の逆変換。改ざん・破損した値は ValidationError にする。
+
+    Args:
+        value: _encode_opaque で作った文字列
+        types: 各要素に期待する型（要素数もこれで検証する）
+    """
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)))
+    except (binascii.Error, ValueError):
+        raise ValidationError("トークンが不正です。")
+    if (
+        not isinstance(decoded, list)
+        or len(decoded) != len(types)
+        # bool は int のサブクラスなので明示的に除外する
+        or any(type(v) is not t for v, t in zip(decoded, types))
+    ):
+        raise ValidationError("トークンが不正です。")
+    return decoded
+
+
+def validate_diary_fields(title: str, comment: str) -> Tuple[str, str]:
+    """タイトル・本文を検証し、前後の空白を除いた値を返す。
+
+    作成・更新・インポートのすべてで同じルールを適用するため1箇所にまとめている。
+
+    バリデーション:
+    - title・comment が空でないこと
+    - 各フィールドが最大長を超えないこと
 
     Raises:
         ValidationError: バリデーション失敗時
@@ -59,7 +344,29 @@ def create_diary_entry(user_id: int, title: str, comment: str) -> DiaryEntry:
     if len(comment) > COMMENT_MAX_LENGTH:
         raise ValidationError(f"本文は {COMMENT_MAX_LENGTH} 文字以内で入力してください。")
 
-    return DiaryEntry.create(user_id, title, comment)
+    return title, comment
+
+
+def create_diary_entry(user_id: int, title: str, comment: str) -> DiaryEntry:
+    """日記エントリを作成して返す。
+
+    バリデーションは validate_diary_fields を参照。
+
+    Args:
+        user_id: 所有者のユーザーID
+        title: 日記タイトル（最大 TITLE_MAX_LENGTH 文字）
+        comment: 日記本文（最大 COMMENT_MAX_LENGTH 文字）
+
+    Returns:
+        作成した DiaryEntry
+
+    Raises:
+        ValidationError: バリデーション失敗時
+    """
+    title, comment = validate_diary_fields(title, comment)
+    entry = DiaryEntry.create(user_id, title, comment)
+    change_feed.publish(user_id, {"type": "created", "diary": entry.to_dict()})
+    return entry
 
 
 def delete_diary_entry(diary_id: int, user_id: int) -> None:
@@ -70,30 +377,91 @@ def delete_diary_entry(diary_id: int, user_id: int) -> None:
     """
     if not DiaryEntry.delete_by_id_and_user(diary_id, user_id):
         raise NotFoundOrForbiddenError()
+    change_feed.publish(user_id, {"type": "deleted", "id": diary_id})
 
 
 def update_diary_entry(diary_id: int, user_id: int, title: str, comment: str) -> DiaryEntry:
     """日記を更新して返す。
 
-    バリデーションは create_diary_entry と同じルールを適用する。
+    バリデーションは create_diary_entry と同じルール（validate_diary_fields）を適用する。
 
     Raises:
         ValidationError: タイトル・本文が空、または最大長超過
         NotFoundOrForbiddenError: 対象が存在しない、または user_id が一致しない
     """
-    title = title.strip()
-    comment = comment.strip()
-
-    if not title:
-        raise ValidationError("タイトルは必須です。")
-    if not comment:
-        raise ValidationError("本文は必須です。")
-    if len(title) > TITLE_MAX_LENGTH:
-        raise ValidationError(f"タイトルは {TITLE_MAX_LENGTH} 文字以内で入力してください。")
-    if len(comment) > COMMENT_MAX_LENGTH:
-        raise ValidationError(f"本文は {COMMENT_MAX_LENGTH} 文字以内で入力してください。")
-
+    title, comment = validate_diary_fields(title, comment)
     entry = DiaryEntry.update_by_id_and_user(diary_id, user_id, title, comment)
     if entry is None:
         raise NotFoundOrForbiddenError()
+    change_feed.publish(user_id, {"type": "updated", "diary": entry.to_dict()})
     return entry
+
+
+def apply_diary_batch(user_id: int, operations: List[dict]) -> List[dict]:
+    """複数の削除・更新をまとめて1トランザクションで適用し、操作ごとの結果を返す。
+
+    各操作は {"op": "delete", "id": 1} または
+    {"op": "update", "id": 2, "title": "...", "comment": "..."} の形式。
+    結果は入力と同じ順序で、各操作の成否を次のいずれかで表す:
+
+    - {"status": "ok"}
+    - {"status": "validation_error", "error": 理由}: delete_diary_entry / update_diary_entry で
+      ValidationError になる入力、形式が不正な操作、同じ ID への2回目以降の操作
+    - {"status": "not_found_or_forbidden"}: 対象が存在しない、または他人の日記
+
+    検証に失敗した操作は適用されないが、他の操作の適用は妨げない。
+
+    Raises:
+        ValidationError: 操作数が BATCH_MAX_OPERATIONS を超える場合（何も適用しない）
+    """
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise ValidationError(f"一度に操作できるのは {BATCH_MAX_OPERATIONS} 件までです。")
+
+    results: List[dict] = []
+    delete_ids: List[int] = []
+    updates = {}
+    seen = set()
+    for index, operation in enumerate(operations):
+        result = {"index": index}
+        results.append(result)
+        try:
+            op, diary_id = _parse_batch_operation(operation)
+            result["id"] = diary_id
+            if diary_id in seen:
+                # 適用順序によって結果が変わる操作は受け付けない
+                raise ValidationError("同じ日記を1回の一括操作で複数回操作することはできません。")
+            seen.add(diary_id)
+            if op == "delete":
+                delete_ids.append(diary_id)
+            else:
+                title, comment = operation.get("title"), operation.get("comment")
+                if not isinstance(title, str) or not isinstance(comment, str):
+                    raise ValidationError("title と comment は文字列で指定してください。")
+                updates[diary_id] = validate_diary_fields(title, comment)
+        except ValidationError as e:
+            result.update(status="validation_error", error=str(e))
+
+    deleted, updated = DiaryEntry.apply_batch(user_id, delete_ids, updates)
+    for diary_id in sorted(deleted):
+        change_feed.publish(user_id, {"type": "deleted", "id": diary_id})
+    for entry in DiaryEntry.list_by_ids(user_id, updated):
+        change_feed.publish(user_id, {"type": "updated", "diary": entry.to_dict()})
+    applied = deleted | updated
+    for result in results:
+        if "status" not in result:
+            result["status"] = "ok" if result["id"] in applied else "not_found_or_forbidden"
+    return results
+
+
+def _parse_batch_operation(operation) -> Tuple[str, int]:
+    """一括操作の1件から (op, id) を取り出す。形式が不正なら ValidationError。"""
+    if not isinstance(operation, dict):
+        raise ValidationError("各操作はオブジェクトで指定してください。")
+    op = operation.get("op")
+    diary_id = operation.get("id")
+    if op not in ("delete", "update"):
+        raise ValidationError("op は delete か update を指定してください。")
+    # bool は int のサブクラスなので明示的に除外する
+    if type(diary_id) is not int:
+        raise ValidationError("id は整数で指定してください。")
+    return op, diary_id
@@ -0,0 +1,115 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class HashingOverloadedError(Exception):
+    """パスワードハッシュ計算の待ち行列が上限に達している場合に送出する例外。
+
+    待たせても応答が遅れるだけなので、受け付けずにすぐ失敗させる（503 を返す想定）。
+    """
+
+
+# プロセスごとの状態。configure() で設定し、プールは最初の run() で作る。
+_workers = 0
+_capacity = 0
+_in_flight = 0
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def configure(workers: int, queue_limit: int) -> None:
+    """ハッシュ計算用プロセスプールの大きさを設定する。
+
+    ## なぜプロセスプールか
+    PBKDF2 は意図的に重い CPU 処理で、スレッドで並行させても GIL に阻まれて
+    1コアしか使えない。別プロセスで計算すればログインが集中しても全コアを使え、
+    Web ワーカーのスレッドは結果を待つ間 GIL を手放すため他のリクエストも止まらない。
+
+    Args:
+        workers: ハッシュ計算に使うプロセス数。0 なら呼び出し元のスレッドでそのまま計算する。
+        queue_limit: 全プロセスが埋まっているときに待たせてよい件数。
+                     workers + queue_limit を超える同時要求は HashingOverloadedError になる。
+    """
+    global _workers, _capacity
+    shutdown()
+    _workers = workers
+    _capacity = workers + queue_limit
+
+
+def run(fn: Callable[..., T], *args, **kwargs) -> T:
+    """fn(*args, **kwargs) をハッシュ計算用プロセスで実行し、結果を返す。
+
+    fn と引数はプロセス間で受け渡すため pickle 可能である必要がある
+    （モジュールのトップレベル関数や、その引数の文字列など）。
+
+    Raises:
+        HashingOverloadedError: 実行中と待機中の合計が上限に達している場合
+    """
+    global _in_flight
+    if _workers == 0:
+        return fn(*args, **kwargs)
+    with _lock:
+        # 空きがなければ待たずに即座に断る
+        if _in_flight >= _capacity:
+            raise HashingOverloadedError("Password hashing queue is full")
+        _in_flight += 1
+    try:
+        return _get_executor().submit(fn, *args, **kwargs).result()
+    finally:
+        with _lock:
+            _in_flight -= 1
+
+
+def stats() -> dict:
+    """現在の同時要求数（実行中 + 待機中）と上限を返す（監視用）。"""
+    return {"workers": _workers, "capacity": _capacity, "in_flight": _in_flight}
+
+
+def shutdown() -> None:
+    """プロセスプールを停止する。次の run() で必要になれば作り直される。"""
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        _executor_pid = None
+
+
+def _reset_after_fork() -> None:
+    """fork 直後の子プロセスで、親から複製された状態を捨てる。
+
+    親のプールのプロセスは子からは使えず、ロックは fork の瞬間に
+    他スレッドが握っていた状態のまま複製されうるため、どちらも新しくする。
+    """
+    global _lock, _in_flight, _executor, _executor_pid
+    _lock = threading.Lock()
+    _in_flight = 0
+    _executor = None
+    _executor_pid = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """このプロセス用のプロセスプールを返す（なければ作る）。
+
+    PID を確認するのは、fork 後の子プロセスが親のプールを使わないようにするための念押し。
+    プロセスの起動には spawn を使う。スレッドを持つプロセスで fork すると、
+    他スレッドが握っていたロックが子プロセスに複製されてデッドロックしうるため。
+    """
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(
+                max_workers=_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _executor_pid = os.getpid()
+        return _executor
@@ -0,0 +1,118 @@
+import statistics
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+@dataclass(frozen=True)
+class Pbkdf2Hasher:
+    """PBKDF2-HMAC によるパスワードハッシュ（Werkzeug の形式で保存する）。
+
+    ## 保存形式
+    generate_password_hash は「pbkdf2:sha256:<回数>$<ソルト>$<ハッシュ>」を返す。
+    先頭の method 部分にパラメータが含まれるため、保存済みのハッシュを見るだけで
+    「今の設定で作られたものか」を判定できる（needs_rehash）。
+
+    ## work_factor
+    PBKDF2 のイテレーション回数。計算時間はほぼ回数に比例するため、
+    calibrate() で測った時間から目標のレイテンシに合う回数を逆算できる。
+
+    hash_pool で別プロセスに渡すため、pickle 可能な不変オブジェクトにしている。
+    """
+
+    work_factor: int = DEFAULT_PBKDF2_ITERATIONS
+    digest: str = "sha256"
+
+    # calibrate() で最初に計測する回数と、設定できる下限
+    CALIBRATION_PROBE = 100_000
+    MIN_WORK_FACTOR = 1_000
+
+    @property
+    def method(self) -> str:
+        return f"pbkdf2:{self.digest}:{self.work_factor}"
+
+    def hash(self, password: str) -> str:
+        """ランダムなソルト付きでハッシュ化した文字列を返す。"""
+        return generate_password_hash(password, method=self.method)
+
+    def verify(self, stored_hash: str, password: str) -> bool:
+        """保存済みハッシュと平文パスワードを照合する。
+
+        パラメータは stored_hash 側に書かれているため、古い設定で作った
+        ハッシュ（別の回数や scrypt など）もそのまま照合できる。
+        """
+        return check_password_hash(stored_hash, password)
+
+    def needs_rehash(self, stored_hash: str) -> bool:
+        """stored_hash が現在の設定と異なるパラメータで作られていれば True。"""
+        return stored_hash.split("$", 1)[0] != self.method
+
+
+# 設定名（PASSWORD_HASHER）とハッシュ方式の対応表。方式を増やすときはここに登録する。
+HASHERS = {
+    "pbkdf2": Pbkdf2Hasher,
+}
+
+# プロセスごとの現在の設定。create_app() から configure() で差し替える。
+_current: Pbkdf2Hasher = Pbkdf2Hasher()
+
+
+def configure(name: str, work_factor: Optional[int] = None) -> None:
+    """新規登録とログイン時の再ハッシュに使うハッシュ方式を設定する。
+
+    Args:
+        name: HASHERS のキー
+        work_factor: 計算コスト（pbkdf2 ならイテレーション回数）。None なら方式の既定値。
+
+    Raises:
+        RuntimeError: 未知の方式名、または下限未満の work_factor が指定された場合
+    """
+    global _current
+    if name not in HASHERS:
+        raise RuntimeError(f"Unknown PASSWORD_HASHER: {name!r} (choose from {', '.join(HASHERS)})")
+    cls = HASHERS[name]
+    if work_factor is None:
+        _current = cls()
+        return
+    if work_factor < cls.MIN_WORK_FACTOR:
+        raise RuntimeError(f"PASSWORD_HASH_WORK_FACTOR must be at least {cls.MIN_WORK_FACTOR}")
+    _current = cls(work_factor=work_factor)
+
+
+def current() -> Pbkdf2Hasher:
+    """現在設定されているハッシュ方式を返す。"""
+    return _current
+
+
+def calibrate(name: str, target_seconds: float, samples: int = 5) -> tuple[int, float]:
+    """このマシンで1回のハッシュ計算が target_seconds（中央値）になる work_factor を求める。
+
+    ## 手順
+    1. CALIBRATION_PROBE の回数で samples 回計測し、中央値を取る
+    2. 計算時間は回数に比例するので、目標時間との比で回数を逆算する
+    3. 求めた回数で計測し直し、実際の中央値を確認用に返す
+
+    中央値を使うのは、初回のウォームアップや他プロセスの割り込みで
+    たまたま遅くなった計測に結果を引きずられないようにするため。
+
+    Returns:
+        (work_factor, その work_factor で計測した中央値の秒数)
+    """
+    cls = HASHERS[name]
+    probe = cls(work_factor=cls.CALIBRATION_PROBE)
+    probe_seconds = _median_seconds(probe, samples)
+    # 設定ファイルに書きやすいよう 1,000 単位に丸める
+    estimate = round(probe.work_factor * target_seconds / probe_seconds, -3)
+    work_factor = max(cls.MIN_WORK_FACTOR, int(estimate))
+    return work_factor, _median_seconds(cls(work_factor=work_factor), samples)
+
+
+def _median_seconds(hasher: Pbkdf2Hasher, samples: int) -> float:
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.hash("calibration-password")
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
@@ -0,0 +1,162 @@
+import gzip
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import BinaryIO, Iterator, List, Optional
+
+from app.models.diary import CREATED_AT_FORMAT, DiaryEntry
+from app.services import change_feed
+from app.services.diary_service import ValidationError, validate_diary_fields
+
+
+# 1トランザクションで INSERT する最大件数。
+# 大きすぎると SQLite の書き込みロックを長く握り、他のリクエストを待たせてしまう。
+IMPORT_BATCH_SIZE = 1000
+
+# レスポンスに含めるエラー行の最大数（件数自体は error_count で全て数える）。
+# 壊れたファイルを投げられてもエラーのリストでメモリを使い切らないようにする。
+IMPORT_MAX_REPORTED_ERRORS = 100
+
+# 1行の最大バイト数。本文の最大長に JSON のエスケープ分を見込んだ値。
+IMPORT_MAX_LINE_BYTES = 128 * 1024
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def export_user_diaries(user_id: int) -> Iterator[str]:
+    """ユーザーの日記を NDJSON（1行1件の JSON）で1行ずつ返す。
+
+    日記は DB からバッチ単位で読むため、件数が多くてもメモリ使用量は一定。
+    出力した行はそのまま import_user_diaries に渡せる。
+    """
+    for entry in DiaryEntry.iter_dicts_by_user(user_id):
+        record = {
+            "title": entry["title"],
+            "comment": entry["comment"],
+            "created_at": entry["created_at"],
+        }
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def import_user_diaries(user_id: int, stream: BinaryIO) -> dict:
+    """NDJSON のストリームから日記を一括登録する。
+
+    各行は {"title": ..., "comment": ..., "created_at": "YYYY-MM-DD HH:MM:SS"} 形式
+    （created_at は省略可）。gzip 圧縮されたストリームは先頭バイトで判別して自動で展開する。
+
+    - 検証は create_diary_entry と同じルール（validate_diary_fields）
+    - 検証を通った行は IMPORT_BATCH_SIZE 件ごとに1トランザクションで INSERT する
+    - 不正な行はスキップして行番号と理由を記録し、取り込みは中断しない
+    - gzip が途中で途切れている・壊れている場合は、そこまでの行を取り込み、
+      読めなくなった行番号をエラーとして記録する（例外にはしない）
+
+    Returns:
+        {"imported": 登録件数, "error_count": 不正な行の数,
+         "errors": [{"line": 行番号, "error": 理由}, ...]}
+        errors は先頭 IMPORT_MAX_REPORTED_ERRORS 件まで。
+    """
+    imported = 0
+    error_count = 0
+    errors: List[dict] = []
+    batch: List[dict] = []
+
+    def report(line_no: int, message: str) -> None:
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+            errors.append({"line": line_no, "error": message})
+
+    line_no = 0
+    try:
+        for line_no, line in enumerate(_iter_lines(_open_maybe_gzip(stream)), start=1):
+            if line is not None and not line.strip():
+                continue
+            try:
+                batch.append(_parse_record(line))
+            except ValidationError as e:
+                report(line_no, str(e))
+                continue
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                imported += DiaryEntry.bulk_create(user_id, batch)
+                batch = []
+    except (EOFError, OSError, zlib.error):
+        # gzip が途中で切れている・壊れている。先のバッチは commit 済みなので、
+        # それまでに読めた行も取り込んだうえで、読めなくなった位置を報告する
+        report(line_no + 1, "ファイルが途中で途切れているか壊れています。これ以降の行は取り込んでいません。")
+
+    imported += DiaryEntry.bulk_create(user_id, batch)
+    if imported:
+        # 件数が多くなりうるため1件ずつは配らず、開いている画面には一覧の取得し直しを促す
+        change_feed.publish(user_id, change_feed.RESYNC_EVENT)
+    return {"imported": imported, "error_count": error_count, "errors": errors}
+
+
+def _open_maybe_gzip(stream: BinaryIO) -> BinaryIO:
+    """先頭2バイトが gzip のマジックナンバーなら展開するストリームで包んで返す。
+
+    peek() は読み位置を進めずに先読みできるため、判別後も先頭から読み直せる。
+    """
+    buffered = stream if isinstance(stream, io.BufferedReader) else io.BufferedReader(stream)
+    if buffered.peek(len(_GZIP_MAGIC))[: len(_GZIP_MAGIC)] == _GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=buffered, mode="rb")
+    return buffered
+
+
+def _iter_lines(stream: BinaryIO) -> Iterator[Optional[bytes]]:
+    """ストリームを1行ずつ返す。長すぎる行は読み捨てて None を返す。
+
+    readline() に上限を渡さないと、改行のない巨大な入力で1行分を丸ごと
+    メモリに読み込んでしまうため、上限付きで読む。
+    """
+    while True:
+        line = stream.readline(IMPORT_MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        if len(line) > IMPORT_MAX_LINE_BYTES:
+            # 行の残りを改行まで読み捨てる
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(IMPORT_MAX_LINE_BYTES)
+            yield None
+            continue
+        yield line
+
+
+def _parse_record(line: Optional[bytes]) -> dict:
+    """NDJSON の1行を検証し、DiaryEntry.bulk_create に渡せる辞書にする。
+
+    Raises:
+        ValidationError: 行が JSON として不正、または値が検証ルールを満たさない場合
+    """
+    if line is None:
+        raise ValidationError(f"1行は {IMPORT_MAX_LINE_BYTES} バイト以内にしてください。")
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise ValidationError("JSON として読み取れません。")
+    if not isinstance(record, dict):
+        raise ValidationError("各行は JSON オブジェクトにしてください。")
+
+    title = record.get("title")
+    comment = record.get("comment")
+    if not isinstance(title, str) or not isinstance(comment, str):
+        raise ValidationError("title と comment は文字列で指定してください。")
+    title, comment = validate_diary_fields(title, comment)
+
+    created_at = record.get("created_at")
+    if created_at is None:
+        # DB の server_default と同じくローカル時刻で埋める。
+        # executemany は全行で同じカラムを持つ必要があるため、省略時も値を入れておく。
+        created_at = datetime.now().strftime(CREATED_AT_FORMAT)
+    elif not isinstance(created_at, str) or not _is_valid_created_at(created_at):
+        raise ValidationError(f"created_at は {CREATED_AT_FORMAT} 形式で指定してください。")
+
+    return {"title": title, "comment": comment, "created_at": created_at}
+
+
+def _is_valid_created_at(value: str) -> bool:
+    try:
+        datetime.strptime(value, CREATED_AT_FORMAT)
+    except ValueError:
+        return False
+    return True
@@ -0,0 +1,120 @@
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from flask import before_render_template, current_app, g, has_request_context, request, template_rendered
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RequestTiming:
+    """1リクエストの内訳。クエリは app.db のエンジンイベントから record_query() で加算される。"""
+    started: float = field(default_factory=time.perf_counter)
+    queries: int = 0
+    db_seconds: float = 0.0
+    render_seconds: float = 0.0
+    _render_started: Optional[float] = None
+
+    def server_timing(self, total_seconds: float) -> str:
+        """Server-Timing ヘッダーの値。ブラウザの開発者ツールの Timing タブにそのまま表示される。"""
+        return ", ".join([
+            f'db;dur={self.db_seconds * 1000:.2f};desc="{self.queries} queries"',
+            f"render;dur={self.render_seconds * 1000:.2f}",
+            f"app;dur={total_seconds * 1000:.2f}",
+        ])
+
+
+def current() -> Optional[RequestTiming]:
+    """処理中のリクエストの RequestTiming。リクエストの外（CLI・テストの準備など）では None。"""
+    if not has_request_context():
+        return None
+    return g.get("request_timing")
+
+
+def record_query(statement: str, parameters, executemany: bool, seconds: float, slow_seconds: float) -> None:
+    """実行し終えたクエリ1つを、処理中のリクエストの内訳に加え、遅ければログに残す。"""
+    timing = current()
+    if timing is not None:
+        timing.queries += 1
+        timing.db_seconds += seconds
+    if seconds >= slow_seconds:
+        _log("slow_query", {
+            "duration_ms": round(seconds * 1000, 2),
+            "statement": " ".join(statement.split()),
+            "parameters": redact_parameters(parameters, executemany),
+            "path": request.path if has_request_context() else None,
+        })
+
+
+def redact_parameters(parameters, executemany: bool = False):
+    """バインドパラメータを値の型名に置き換える。
+
+    ## なぜ値を残さないか
+    パラメータにはメールアドレス・パスワードハッシュ・日記の本文が入る。
+    ログは DB より広い範囲の人とシステムが読むため、値は書かず、
+    クエリの形（どの型の値が何個渡されたか）だけを残す。executemany は件数だけにする。
+    """
+    if executemany:
+        return {"rows": len(parameters)}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def _log(event: str, fields: dict) -> None:
+    # 1行1つの JSON にし、ログ基盤で event や duration_ms で絞り込めるようにする
+    logger.warning(json.dumps({"event": event, **fields}, ensure_ascii=False))
+
+
+def _start_request():
+    g.request_timing = RequestTiming()
+
+
+def _before_render(app, template, context, **extra):
+    timing = current()
+    if timing is not None:
+        timing._render_started = time.perf_counter()
+
+
+def _after_render(app, template, context, **extra):
+    timing = current()
+    if timing is not None and timing._render_started is not None:
+        timing.render_seconds += time.perf_counter() - timing._render_started
+        timing._render_started = None
+
+
+def _finish_request(response):
+    timing = current()
+    if timing is None:
+        return response
+
+    total = time.perf_counter() - timing.started
+    if current_app.config["SERVER_TIMING_ENABLED"]:
+        response.headers["Server-Timing"] = timing.server_timing(total)
+    if total * 1000 >= current_app.config["SLOW_REQUEST_MS"]:
+        _log("slow_request", {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(total * 1000, 2),
+            "queries": timing.queries,
+            "db_ms": round(timing.db_seconds * 1000, 2),
+            "render_ms": round(timing.render_seconds * 1000, 2),
+        })
+    return response
+
+
+def init_app(app) -> None:
+    """リクエストごとのクエリ数・DB 時間・テンプレート描画時間・処理時間の計測を登録する。
+
+    ## 計測の範囲
+    before_request から after_request までを処理時間とする。?stream=1 や SSE のように
+    レスポンスを返した後に本文を作りながら発行するクエリは、ヘッダーを送った後なので含まれない。
+    """
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
@@ -0,0 +1,200 @@
+"""主要エンドポイント（/get_json・/auth・/create_diary）の性能を測り、基準値と比べるベンチマーク。
+
+データセットごとに DB を作り直して投入し、Flask のテストクライアント（プロセス内の WSGI 呼び出し）で
+各エンドポイントを順に叩いて、スループットと p50 / p95 / p99 のレイテンシを表示する。
+--baseline に以前の結果（--save で保存した JSON）を渡すと、しきい値を超えて遅くなった
+項目を表示して終了コード 1 で終わる（CI で性能の劣化を検出するため）。
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.endpoints --save benchmarks/baseline.json
+    python -m benchmarks.endpoints --baseline benchmarks/baseline.json --threshold 0.2
+    python -m benchmarks.endpoints --datasets small,medium --db file --requests 500
+
+データセット（--datasets）:
+    small   利用者 1 人 / 計測するユーザーの日記 10 件
+    medium  利用者 100 人 / 各 1,000 件
+    large   利用者 10,000 人 / 他のユーザーは各 10 件、計測するユーザーは 100,000 件
+
+基準値は計測したマシンに依存するため、同じマシン（CI ランナー）で保存したものと比べること。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+from app import create_app
+from app.config import TestingConfig, config
+from app.db import db, init_db
+from app.models.diary import DiaryEntry
+from app.models.user import User
+from app.services import password_hasher
+
+PASSWORD = "benchmark-password"
+
+# name: (ユーザー数, 計測するユーザーの日記数, 他のユーザー1人あたりの日記数)
+DATASETS = {
+    "small": (1, 10, 0),
+    "medium": (100, 1_000, 1_000),
+    "large": (10_000, 100_000, 10),
+}
+ENDPOINTS = ("get_json", "auth", "create_diary")
+
+_SEED_BATCH = 10_000
+
+
+class FileBenchmarkConfig(TestingConfig):
+    """ファイルの SQLite を本番と同じ PRAGMA で使う設定（パスは実行時に決める）。"""
+    SQLITE_PRAGMA_PROFILE = "tuned"
+
+
+def make_app(db_kind: str, tmp_dir: str):
+    """db_kind が "memory" なら testing 設定、"file" なら一時ファイルの SQLite でアプリを作る。"""
+    if db_kind == "memory":
+        return create_app("testing")
+    FileBenchmarkConfig.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+    config["benchmark-file"] = FileBenchmarkConfig
+    return create_app("benchmark-file")
+
+
+def seed(users: int, target_entries: int, other_entries: int) -> str:
+    """ユーザーと日記を投入し、計測に使うユーザーのメールアドレスを返す。
+
+    ハッシュ計算を人数分繰り返さないよう、全員に同じパスワードハッシュを使う。
+    """
+    password_hash = password_hasher.current().hash(PASSWORD)
+    db.session.execute(db.insert(User), [
+        {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": password_hash}
+        for i in range(users)
+    ])
+    db.session.commit()
+    ids = db.session.scalars(db.select(User.id).order_by(User.id)).all()
+    for index, user_id in enumerate(ids):
+        count = target_entries if index == 0 else other_entries
+        for start in range(0, count, _SEED_BATCH):
+            DiaryEntry.bulk_create(user_id, [
+                {
+                    "title": f"日記 {i}",
+                    "comment": "今日は授業でデータベースのインデックスについて学んだ。" * 4,
+                    "created_at": f"2024-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}",
+                }
+                for i in range(start, min(start + _SEED_BATCH, count))
+            ])
+    return "user0@example.com"
+
+
+def measure(call: Callable[[], int], requests: int, warmup: int) -> dict:
+    """call を順に requests 回呼び、スループットとレイテンシの分位点を返す。
+
+    call は HTTP ステータスコードを返す。2xx / 3xx 以外が返ったら計測を中止する
+    （エラー応答の速さを測っても意味がないため）。
+    """
+    for _ in range(warmup):
+        call()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        start = time.perf_counter()
+        status = call()
+        latencies.append(time.perf_counter() - start)
+        if status >= 400:
+            raise RuntimeError(f"unexpected status {status}")
+    elapsed = time.perf_counter() - started
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": requests,
+        "rps": requests / elapsed,
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+    }
+
+
+def run_dataset(name: str, db_kind: str, requests: int, warmup: int, endpoints: List[str]) -> Dict[str, dict]:
+    users, target_entries, other_entries = DATASETS[name]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = make_app(db_kind, tmp_dir)
+        with app.app_context():
+            init_db()
+            email = seed(users, target_entries, other_entries)
+            client = app.test_client()
+            client.post("/auth", data={"email": email, "password": PASSWORD})
+            anonymous = app.test_client()
+            calls = {
+                "get_json": lambda: client.get("/get_json").status_code,
+                "auth": lambda: anonymous.post(
+                    "/auth", data={"email": email, "password": PASSWORD}
+                ).status_code,
+                "create_diary": lambda: client.post(
+                    "/create_diary", data={"title": "bench", "comment": "計測用の日記"}
+                ).status_code,
+            }
+            results = {endpoint: measure(calls[endpoint], requests, warmup) for endpoint in endpoints}
+            db.session.remove()
+            db.drop_all()
+            for engine in db.engines.values():
+                engine.dispose()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """基準値より threshold（割合）を超えて悪化した項目の説明を返す。
+
+    スループットは下がったら、p95 レイテンシは上がったら悪化とみなす。
+    基準値にない項目（新しく追加したデータセットなど）は比較しない。
+    """
+    regressions = []
+    for key, current in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if current["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{key}: rps {current['rps']:.1f} < baseline {base['rps']:.1f}")
+        if current["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{key}: p95 {current['p95_ms']:.2f} ms > baseline {base['p95_ms']:.2f} ms")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--datasets", default="small,medium")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--db", choices=("memory", "file"), default="memory")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--baseline", help="比較する基準値の JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="許容する悪化の割合（0.2 = 20%%）")
+    parser.add_argument("--save", help="結果を JSON で保存するパス（次回の --baseline に使う）")
+    args = parser.parse_args(argv)
+
+    endpoints = args.endpoints.split(",")
+    results = {}
+    print(f"db={args.db} requests={args.requests}")
+    print(f"{'dataset/endpoint':<24}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name in args.datasets.split(","):
+        for endpoint, result in run_dataset(name, args.db, args.requests, args.warmup, endpoints).items():
+            key = f"{args.db}/{name}/{endpoint}"
+            results[key] = result
+            print(
+                f"{name + '/' + endpoint:<24}{result['rps']:>10.1f}"
+                f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+            )
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
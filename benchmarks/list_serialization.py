@@ -0,0 +1,99 @@
+"""日記一覧の読み取り〜JSON 化を、ORM 経由と Core + orjson の経路で比べるベンチマーク。
+
+件数ごとに次の2つで jsonify() 相当のレスポンス本文を作り、
+所要時間（repeat 回の最小値）とピークメモリ（tracemalloc）を表示する。
+- orm:  db.select(DiaryEntry) で ORM オブジェクトを読む → to_dict() → 標準の JSON プロバイダ
+- core: DiaryEntry.list_dicts_by_user() → app.json（orjson があれば OrjsonProvider）
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.list_serialization
+    python -m benchmarks.list_serialization --sizes 1000,10000 --repeat 5
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from flask.json.provider import DefaultJSONProvider
+
+from app import create_app
+from app.db import db, init_db
+from app.models.diary import DiaryEntry
+from app.models.user import User
+
+_SEED_BATCH = 10_000
+
+
+def _orm_path(provider, user_id: int) -> bytes:
+    entries = db.session.scalars(
+        db.select(DiaryEntry)
+        .where(DiaryEntry.user_id == user_id)
+        .order_by(DiaryEntry.created_ts.desc(), DiaryEntry.id.desc())
+    )
+    diaries = [entry.to_dict() for entry in entries]
+    return provider.response({"diaries": diaries}).get_data()
+
+
+def _core_path(provider, user_id: int) -> bytes:
+    return provider.response({"diaries": DiaryEntry.list_dicts_by_user(user_id)}).get_data()
+
+
+def _seed(count: int) -> int:
+    user = User.create(f"bench{count}", f"bench{count}@example.com", "x")
+    for start in range(0, count, _SEED_BATCH):
+        DiaryEntry.bulk_create(user.id, [
+            {
+                "title": f"日記 {i}",
+                "comment": "今日は授業でデータベースのインデックスについて学んだ。" * 4,
+                "created_at": f"2024-01-01 00:00:{i % 60:02d}",
+            }
+            for i in range(start, min(start + _SEED_BATCH, count))
+        ])
+    return user.id
+
+
+def _measure(fn, repeat: int) -> tuple[float, int, int]:
+    """(最短の秒数, ピークメモリのバイト数, 出力の長さ) を返す。"""
+    best = float("inf")
+    for _ in range(repeat):
+        db.session.remove()  # identity map を空にし、毎回 DB から読み直させる
+        gc.collect()
+        start = time.perf_counter()
+        output = fn()
+        best = min(best, time.perf_counter() - start)
+        del output
+
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    output = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, len(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = create_app("testing")
+    with app.app_context():
+        init_db()
+        stdlib = DefaultJSONProvider(app)
+        stdlib.ensure_ascii = False
+        print(f"json provider: {type(app.json).__name__}")
+        print(f"{'entries':>8}{'path':>6}{'ms':>10}{'peak MiB':>10}{'speedup':>9}")
+        for size in (int(s) for s in args.sizes.split(",")):
+            user_id = _seed(size)
+            orm = _measure(lambda: _orm_path(stdlib, user_id), args.repeat)
+            core = _measure(lambda: _core_path(app.json, user_id), args.repeat)
+            for name, (seconds, peak, _) in (("orm", orm), ("core", core)):
+                speedup = f"{orm[0] / seconds:.2f}x"
+                print(f"{size:>8}{name:>6}{seconds * 1000:>10.1f}{peak / 2**20:>10.1f}{speedup:>9}")
+        db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
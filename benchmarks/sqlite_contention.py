@@ -0,0 +1,141 @@
+"""SQLite の PRAGMA プロファイルごとの同時アクセス性能を比べるベンチマーク。
+
+書き込みスレッドと読み取りスレッドを同時に走らせ、一定時間内に完了した操作数と
+"database is locked" で失敗した操作数をプロファイルごとに表示する。
+
+既定ではアプリと同じ接続設定（sqlite3 自身のロック待ち 5 秒を含む）で測るため、
+表示される値がそのままアプリの挙動になる。--no-driver-timeout を付けると sqlite3 の待機を
+無効にして、PRAGMA busy_timeout の有無による差だけを取り出して比べられる
+（この場合の locked の数はアプリでは起きない失敗を含む）。
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.sqlite_contention
+    python -m benchmarks.sqlite_contention --writers 4 --readers 16 --seconds 10
+    python -m benchmarks.sqlite_contention --no-driver-timeout
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from app.config import SQLITE_PRAGMA_PROFILES
+from app.db import _REQUIRED_SQLITE_PRAGMAS, apply_sqlite_pragmas
+
+# diaries テーブルの一覧クエリと同じ形のスキーマ・インデックス
+_SCHEMA = [
+    "CREATE TABLE diaries (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL,"
+    " title VARCHAR(100) NOT NULL, comment TEXT NOT NULL, created_ts INTEGER NOT NULL)",
+    "CREATE INDEX ix_diaries_user_created_ts_id ON diaries (user_id, created_ts, id)",
+]
+_USERS = 50
+_SEED_ROWS = 20_000
+
+
+def run_profile(
+    profile: str, writers: int, readers: int, seconds: float, driver_timeout: bool = True
+) -> dict:
+    """1つのプロファイルで負荷をかけ、操作数と失敗数を返す。
+
+    Args:
+        driver_timeout: False なら sqlite3 自身のロック待ち（既定 5 秒）を無効にする。
+                        アプリは常に有効なので、アプリの値を知りたいときは True のままにする。
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        # 本番と同じく1スレッド1接続。プール待ちではなく DB のロック競合を測るため、
+        # プールはスレッド数より大きくしておく。
+        engine = create_engine(
+            f"sqlite:///{path}", pool_size=writers + readers, max_overflow=0,
+            connect_args={} if driver_timeout else {"timeout": 0},
+        )
+        # アプリの db.init_app() と同じく、必須の PRAGMA にプロファイルを重ねる
+        apply_sqlite_pragmas(engine, {**_REQUIRED_SQLITE_PRAGMAS, **SQLITE_PRAGMA_PROFILES[profile]})
+        _seed(engine)
+
+        counts = {"writes": 0, "reads": 0, "locked": 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def worker(kind: str, seed: int):
+            done = failed = 0
+            with engine.connect() as conn:
+                i = seed
+                while time.perf_counter() < deadline:
+                    i += 1
+                    try:
+                        if kind == "writes":
+                            with conn.begin():
+                                conn.execute(
+                                    text("INSERT INTO diaries (user_id, title, comment, created_ts)"
+                                         " VALUES (:u, 'bench', :c, unixepoch())"),
+                                    {"u": i % _USERS, "c": "本文" * 200},
+                                )
+                        else:
+                            conn.execute(
+                                text("SELECT id, title, comment, created_ts FROM diaries"
+                                     " WHERE user_id = :u ORDER BY created_ts DESC, id DESC LIMIT 50"),
+                                {"u": i % _USERS},
+                            ).all()
+                            conn.rollback()
+                        done += 1
+                    except OperationalError:
+                        conn.rollback()
+                        failed += 1
+            with lock:
+                counts[kind] += done
+                counts["locked"] += failed
+
+        threads = [threading.Thread(target=worker, args=("writes", n)) for n in range(writers)]
+        threads += [threading.Thread(target=worker, args=("reads", n)) for n in range(readers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        engine.dispose()
+        return counts
+
+
+def _seed(engine) -> None:
+    with engine.begin() as conn:
+        for ddl in _SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(
+            text("INSERT INTO diaries (user_id, title, comment, created_ts)"
+                 " VALUES (:u, 'seed', :c, unixepoch() - :offset)"),
+            [
+                {"u": i % _USERS, "c": "本文" * 200, "offset": i}
+                for i in range(_SEED_ROWS)
+            ],
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--profiles", default=",".join(SQLITE_PRAGMA_PROFILES))
+    parser.add_argument("--no-driver-timeout", action="store_true",
+                        help="sqlite3 のロック待ちを無効にし、PRAGMA の差だけを比べる（アプリの値ではない）")
+    args = parser.parse_args()
+
+    print(f"writers={args.writers} readers={args.readers} seconds={args.seconds}"
+          f" driver_timeout={'off' if args.no_driver_timeout else 'on (app default)'}")
+    print(f"{'profile':<10}{'writes/s':>12}{'reads/s':>12}{'locked':>10}")
+    for profile in args.profiles.split(","):
+        counts = run_profile(profile, args.writers, args.readers, args.seconds,
+                             driver_timeout=not args.no_driver_timeout)
+        print(
+            f"{profile:<10}"
+            f"{counts['writes'] / args.seconds:>12.1f}"
+            f"{counts['reads'] / args.seconds:>12.1f}"
+            f"{counts['locked']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
+from contextlib import contextmanager
+
 import pytest
+from sqlalchemy import event
+
 from app import create_app
 from app.db import db, init_db
 
@@ -42,3 +46,35 @@ def registered_user(client):
         "username": "testuser",
     })
     return client
+
+
+@pytest.fixture
+def assert_max_queries(app):
+    """with ブロック内で発行された SQL が limit 件以下であることを確かめる。
+
+    一覧の件数を増やしてもクエリ数が変わらないことを確かめれば、
+    1件ごとに追加のクエリを発行する N+1 の退行を検出できる。
+
+        with assert_max_queries(2):
+            client.get("/get_json")
+    """
+    @contextmanager
+    def check(limit: int):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engines = list(db.engines.values())
+        for engine in engines:
+            event.listen(engine, "after_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            for engine in engines:
+                event.remove(engine, "after_cursor_execute", record)
+        assert len(statements) <= limit, (
+            f"{len(statements)} queries (limit {limit}):\n" + "\n".join(statements)
+        )
+
+    return check
@@ -0,0 +1,77 @@
+"""アカウント削除（ON DELETE CASCADE と段階的な削除）のテスト。"""
+import pytest
+from sqlalchemy import event, text
+
+from app.db import db
+from app.models.diary import DiaryEntry, DiaryTombstone
+from app.models.user import User
+from app.services import account_service
+from app.services.auth_service import register_user
+from app.services.diary_service import delete_diary_entry
+
+
+@pytest.fixture
+def user_with_diaries(app):
+    user = register_user("pat", "pat@example.com", "password123")
+    DiaryEntry.bulk_create(user.id, [{"title": f"日記 {i}", "comment": "本文"} for i in range(10)])
+    delete_diary_entry(DiaryEntry.list_dicts_by_user(user.id)[0]["id"], user.id)  # 削除ログを1件残す
+    other = register_user("quinn", "quinn@example.com", "password123")
+    DiaryEntry.bulk_create(other.id, [{"title": "他人の日記", "comment": "本文"}])
+    ids = user.id, other.id
+    db.session.expunge_all()
+    return ids
+
+
+def _count(model, user_id: int) -> int:
+    return db.session.scalar(db.select(db.func.count()).select_from(model).where(model.user_id == user_id))
+
+
+@pytest.fixture
+def statements(app):
+    recorded = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        recorded.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    yield recorded
+    event.remove(db.engine, "before_cursor_execute", record)
+
+
+def test_foreign_keys_enabled(app):
+    assert db.session.execute(text("PRAGMA foreign_keys")).scalar() == 1
+
+
+def test_delete_cascades_in_database(user_with_diaries, statements):
+    """日記を読み込まず、DELETE 1文で日記と削除ログも消える。"""
+    user_id, other_id = user_with_diaries
+    account_service.delete_account(user_id)
+
+    assert [s for s in statements if s.lstrip().upper().startswith(("SELECT", "DELETE"))] == [
+        "DELETE FROM users WHERE users.id = ?"
+    ]
+    assert db.session.get(User, user_id) is None
+    assert _count(DiaryEntry, user_id) == 0
+    assert _count(DiaryTombstone, user_id) == 0
+    assert _count(DiaryEntry, other_id) == 1
+
+
+def test_purge_deletes_in_batches(user_with_diaries, statements):
+    user_id, other_id = user_with_diaries
+    purged = account_service.purge_account(user_id, batch_size=4, pause_seconds=0)
+
+    assert purged == 9 + 1  # 日記 9 件 + 削除ログ 1 件
+    diary_deletes = [s for s in statements if s.startswith("DELETE FROM diaries ")]
+    assert len(diary_deletes) == 3  # 4 + 4 + 1
+    assert db.session.get(User, user_id) is None
+    assert _count(DiaryEntry, user_id) == 0
+    assert _count(DiaryEntry, other_id) == 1
+    assert account_service.purge_account(user_id) == 0  # 削除済みでも失敗しない
+
+
+def test_cli_delete_user_chunked(app, user_with_diaries):
+    user_id, _ = user_with_diaries
+    result = app.test_cli_runner().invoke(args=["delete-user", "pat@example.com", "--chunked", "--batch-size", "5"])
+    assert result.exit_code == 0, result.output
+    assert "10 rows purged" in result.output
+    assert User.find_by_email("pat@example.com") is None
@@ -0,0 +1,51 @@
+"""static ファイルのフィンガープリント・事前圧縮のテスト。"""
+import gzip
+import shutil
+
+import pytest
+from flask import url_for
+
+from app.assets import IMMUTABLE_CACHE_CONTROL
+
+
+@pytest.fixture
+def built_app(app, tmp_path):
+    """static をコピーした一時ディレクトリで flask build-assets を実行したアプリ。"""
+    static = tmp_path / "static"
+    shutil.copytree(app.static_folder, static, ignore=shutil.ignore_patterns("dist"))
+    app.static_folder = str(static)
+    result = app.test_cli_runner().invoke(args=["build-assets"])
+    assert result.exit_code == 0
+    return app
+
+
+class TestAssets:
+    def test_unbuilt_static_served_as_is(self, app, client):
+        """未ビルドなら元のファイル名の URL のまま配信される。"""
+        with app.test_request_context():
+            assert url_for("static", filename="css/style.css") == "/static/css/style.css"
+
+    def test_url_for_emits_fingerprinted_name(self, built_app):
+        """ビルド後の url_for は内容のハッシュ入りのファイル名を返す。"""
+        with built_app.test_request_context():
+            url = url_for("static", filename="css/style.css")
+        assert url.startswith("/static/dist/css/style.") and url.endswith(".css")
+        assert url in built_app.test_client().get("/signin").get_data(as_text=True)
+
+    def test_fingerprinted_asset_served_precompressed_and_immutable(self, built_app):
+        """ハッシュ入りの URL は .gz を Content-Encoding 付き・immutable で返す。"""
+        with built_app.test_request_context():
+            url = url_for("static", filename="vendor/jquery-3.7.1.min.js")
+        client = built_app.test_client()
+        resp = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert resp.status_code == 200
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert resp.headers["Cache-Control"] == IMMUTABLE_CACHE_CONTROL
+        assert "javascript" in resp.mimetype
+        assert gzip.decompress(resp.data).startswith(b"/*! jQuery v3.7.1")
+        resp.close()
+
+        plain = client.get(url)
+        assert "Content-Encoding" not in plain.headers
+        assert plain.data.startswith(b"/*! jQuery v3.7.1")
+        plain.close()
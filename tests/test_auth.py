@@ -1,5 +1,14 @@
 """認証フロー（登録・ログイン・ログアウト）のテスト。"""
+import gzip
+import threading
+import time
+
 import pytest
+from sqlalchemy import event
+
+from app.cache import TTLCache
+from app import page_cache
+from app.db import db
 from app.services.auth_service import (
     register_user,
     authenticate_user,
@@ -7,6 +16,16 @@ from app.services.auth_service import (
     InvalidCredentialsError,
 )
 from app.models.user import User
+from app.services import hash_pool, password_hasher
+from app.services.hash_pool import HashingOverloadedError
+
+
+@pytest.fixture
+def process_hash_pool():
+    """ハッシュ計算を実際に別プロセスで行う設定にし、テスト後に元に戻す。"""
+    hash_pool.configure(workers=1, queue_limit=0)
+    yield hash_pool
+    hash_pool.configure(workers=0, queue_limit=0)
 
 
 class TestRegisterUser:
@@ -50,6 +69,131 @@ class TestAuthenticateUser:
             authenticate_user("nobody@example.com", "any")
 
 
+class TestPasswordRehash:
+    def test_outdated_hash_upgraded_on_login(self, app):
+        """設定より古いパラメータのハッシュは、ログイン成功時に現在の設定で作り直される。"""
+        register_user("dan", "dan@example.com", "password123")
+        password_hasher.configure("pbkdf2", 2_000)
+        try:
+            user = authenticate_user("dan@example.com", "password123")
+            assert user.password_hash.startswith("pbkdf2:sha256:2000$")
+            # 作り直したハッシュでもログインでき、再度の書き換えは起きない
+            assert authenticate_user("dan@example.com", "password123").id == user.id
+        finally:
+            password_hasher.configure("pbkdf2", app.config["PASSWORD_HASH_WORK_FACTOR"])
+
+    def test_failed_login_keeps_hash(self, app):
+        """照合に失敗したときはハッシュを書き換えない。"""
+        user = register_user("eve", "eve@example.com", "password123")
+        original = user.password_hash
+        password_hasher.configure("pbkdf2", 2_000)
+        try:
+            with pytest.raises(InvalidCredentialsError):
+                authenticate_user("eve@example.com", "wrong-password")
+            assert User.find_by_email("eve@example.com").password_hash == original
+        finally:
+            password_hasher.configure("pbkdf2", app.config["PASSWORD_HASH_WORK_FACTOR"])
+
+    def test_calibrate_hash_command(self, app):
+        """flask calibrate-hash は目標時間に合う work factor を表示する。"""
+        result = app.test_cli_runner().invoke(args=["calibrate-hash", "--target-ms", "5", "--samples", "1"])
+        assert result.exit_code == 0
+        assert "PASSWORD_HASH_WORK_FACTOR=" in result.output
+
+    def test_unknown_hasher_rejected(self):
+        """存在しないハッシュ方式名は設定時にエラーになる。"""
+        with pytest.raises(RuntimeError):
+            password_hasher.configure("md5")
+
+
+class TestHashPool:
+    def test_register_and_authenticate_in_process_pool(self, app, process_hash_pool):
+        """別プロセスで計算したハッシュで登録・認証できる。"""
+        register_user("pool", "pool@example.com", "password123")
+        assert authenticate_user("pool@example.com", "password123").username == "pool"
+        with pytest.raises(InvalidCredentialsError):
+            authenticate_user("pool@example.com", "wrong-password")
+
+    def test_saturated_pool_fails_fast(self, process_hash_pool):
+        """実行中と待機中の合計が上限に達していれば待たずに例外を送出する。"""
+        busy = threading.Thread(target=hash_pool.run, args=(time.sleep, 1.0))
+        busy.start()
+        try:
+            deadline = time.time() + 10
+            while hash_pool.stats()["in_flight"] == 0 and time.time() < deadline:
+                time.sleep(0.01)
+            with pytest.raises(HashingOverloadedError):
+                hash_pool.run(time.sleep, 0)
+        finally:
+            busy.join()
+
+
+class TestCurrentUser:
+    def test_dashboard_steady_state_issues_no_user_queries(self, app, registered_user):
+        """2回目以降のダッシュボード表示では users テーブルへの SQL を発行しない。"""
+        registered_user.get("/dashboard")
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            resp = registered_user.get("/dashboard")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        assert resp.status_code == 200
+        assert "testuser" in resp.get_data(as_text=True)
+        assert not [s for s in statements if "users" in s]
+
+    def test_delete_invalidates_cached_identity(self, app, registered_user):
+        """削除したユーザーのセッションはキャッシュに関係なく未ログイン扱いになる。"""
+        registered_user.get("/dashboard")
+        User.delete(User.find_by_email("test@example.com").id)
+        resp = registered_user.get("/dashboard")
+        assert resp.status_code == 302
+        assert resp.headers["Location"].endswith("/signin")
+
+    def test_ttl_cache_expires_and_evicts(self):
+        """期限切れの項目と、上限を超えた最も古い項目は返されない。"""
+        cache = TTLCache(max_entries=1, ttl_seconds=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") is None and cache.get("b") == 2
+        expired = TTLCache(max_entries=10, ttl_seconds=0)
+        expired.set("a", 1)
+        assert expired.get("a") is None
+
+
+class TestPageCache:
+    def test_gzip_variant_served(self, client):
+        """Accept-Encoding: gzip なら圧縮済みの版を Content-Encoding 付きで返す。"""
+        resp = client.get("/signin", headers={"Accept-Encoding": "gzip"})
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in resp.headers["Vary"]
+        assert "おかえりなさい" in gzip.decompress(resp.data).decode()
+        assert "Content-Encoding" not in client.get("/signin").headers
+
+    def test_second_request_skips_rendering(self, client, monkeypatch):
+        """同じ入力のページは2回目以降テンプレートを描画しない。"""
+        calls = []
+        original = page_cache.render_template
+        monkeypatch.setattr(page_cache, "render_template", lambda *a, **k: calls.append(a) or original(*a, **k))
+        client.get("/")
+        client.get("/")
+        assert len(calls) == 1
+
+    def test_flash_messages_and_login_state_are_part_of_key(self, registered_user):
+        """フラッシュメッセージやログイン状態が違えば別のページとして描画される。"""
+        client = registered_user
+        assert "ノートを開く" in client.get("/").get_data(as_text=True)
+        client.get("/signout")
+        assert "無料ではじめる" in client.get("/").get_data(as_text=True)
+        client.post("/auth", data={"email": "test@example.com", "password": "wrongpass"})
+        assert "正しくありません" in client.get("/signin").get_data(as_text=True)
+        assert "正しくありません" not in client.get("/signin").get_data(as_text=True)
+
+
 class TestAuthRoutes:
     def test_signup_page(self, client):
         """GET /signup は 200 を返す。"""
@@ -113,6 +257,19 @@ class TestAuthRoutes:
         assert resp.status_code == 302
         assert resp.headers["Location"].endswith("/signin")
 
+    def test_login_returns_503_when_hashing_saturated(self, registered_user, monkeypatch):
+        """ハッシュ計算が混雑していれば 503 と Retry-After を返す。"""
+        client = registered_user
+        client.get("/signout")
+
+        def saturated(*args, **kwargs):
+            raise HashingOverloadedError()
+
+        monkeypatch.setattr(hash_pool, "run", saturated)
+        resp = client.post("/auth", data={"email": "test@example.com", "password": "testpass123"})
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == "1"
+
     def test_signout_clears_session(self, registered_user):
         """GET /signout 後はダッシュボードにアクセスできない。"""
         client = registered_user
@@ -0,0 +1,91 @@
+"""日記の変更イベント（SSE）のテスト。"""
+import json
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from app.services import change_feed
+from app.services.auth_service import register_user
+from app.services.diary_service import (
+    apply_diary_batch,
+    create_diary_entry,
+    delete_diary_entry,
+    update_diary_entry,
+)
+
+
+@pytest.fixture
+def feed(app):
+    """テスト後に change_feed の設定をアプリの設定に戻す。"""
+    yield change_feed
+    change_feed.configure(app.config["CHANGE_FEED_QUEUE_SIZE"], app.config["CHANGE_FEED_SOCKET_DIR"])
+
+
+class TestChangeFeed:
+    def test_service_functions_publish_events(self, app):
+        """作成・更新・削除・一括操作のたびに、その日記の内容付きでイベントが届く。"""
+        user = register_user("sse", "sse@example.com", "password123")
+        other = register_user("oth", "oth@example.com", "password123")
+        with change_feed.subscribe(user.id) as subscription:
+            entry = create_diary_entry(user.id, "T", "C")
+            create_diary_entry(other.id, "他人", "C")
+            update_diary_entry(entry.id, user.id, "T2", "C2")
+            second = create_diary_entry(user.id, "S", "C")
+            apply_diary_batch(user.id, [{"op": "delete", "id": entry.id},
+                                        {"op": "update", "id": second.id, "title": "S2", "comment": "C"}])
+            delete_diary_entry(second.id, user.id)
+            events = [subscription.get(timeout=0) for _ in range(6)]
+            assert subscription.get(timeout=0) is None
+        assert [e["type"] for e in events] == ["created", "updated", "created", "deleted", "updated", "deleted"]
+        assert events[1]["diary"]["title"] == "T2"
+        assert events[4]["diary"]["title"] == "S2"
+
+    def test_overflow_turns_into_resync(self, feed):
+        """キューが溢れたら古いイベントを捨て、resync を1回だけ返す。"""
+        feed.configure(queue_size=2)
+        with feed.subscribe(1) as subscription:
+            for i in range(5):
+                feed.publish(1, {"type": "deleted", "id": i})
+            assert subscription.get(timeout=0) == feed.RESYNC_EVENT
+            assert subscription.get(timeout=0) is None
+
+    def test_close_all_wakes_waiting_subscribers(self, feed):
+        """close_all() で待っている get() がすぐに戻り、以降の購読も閉じた状態で始まる。"""
+        with feed.subscribe(1) as subscription:
+            closer = threading.Timer(0.1, feed.close_all)
+            closer.start()
+            started = time.monotonic()
+            assert subscription.get(timeout=5) is None
+            assert time.monotonic() - started < 2
+            assert subscription.closed
+        with feed.subscribe(1) as late:
+            assert late.closed
+
+    def test_fan_out_to_other_process(self, feed, tmp_path):
+        """CHANGE_FEED_SOCKET_DIR を設定すると、別プロセスで発行したイベントも届く。"""
+        feed.configure(queue_size=10, socket_dir=str(tmp_path / "feed"))
+        with feed.subscribe(7) as subscription:
+            child = multiprocessing.get_context("fork").Process(
+                target=feed.publish, args=(7, {"type": "deleted", "id": 42})
+            )
+            child.start()
+            child.join(10)
+            assert subscription.get(timeout=5) == {"type": "deleted", "id": 42}
+
+
+class TestEventsRoute:
+    def test_stream_delivers_created_event(self, app, registered_user):
+        """GET /diary/events は text/event-stream で変更イベントを送る。"""
+        resp = registered_user.get("/diary/events", buffered=False)
+        assert resp.mimetype == "text/event-stream"
+        chunks = iter(resp.response)
+        assert next(chunks).startswith(b"retry:")  # ここで購読が始まる
+
+        registered_user.post("/create_diary", data={"title": "Live", "comment": "C"})
+        event = next(chunks).decode()
+        resp.close()
+        assert event.startswith("event: created\n")
+        data = json.loads(event.split("data: ", 1)[1])
+        assert data["diary"]["title"] == "Live"
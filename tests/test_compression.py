@@ -0,0 +1,110 @@
+"""レスポンス圧縮ミドルウェアのテスト。"""
+import gzip
+import json
+
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from app.compression import CompressionMiddleware
+from app.services.diary_service import create_diary_entry
+from app.models.user import User
+
+GZIP = {"Accept-Encoding": "gzip"}
+
+
+def _fill_diaries(count: int = 30) -> None:
+    user = User.find_by_email("test@example.com")
+    for i in range(count):
+        create_diary_entry(user.id, f"日記{i}", "今日は授業で圧縮について学んだ。" * 10)
+
+
+class TestCompressionRoutes:
+    def test_large_json_compressed(self, registered_user):
+        """閾値以上の JSON は gzip で圧縮され、展開すると元の JSON になる。"""
+        _fill_diaries()
+        plain = registered_user.get("/get_json")
+        resp = registered_user.get("/get_json", headers=GZIP)
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in resp.headers["Vary"]
+        assert resp.headers["ETag"].startswith("W/")
+        assert len(resp.data) < len(plain.data) / 3
+        assert json.loads(gzip.decompress(resp.data)) == plain.get_json()
+
+    def test_small_json_not_compressed(self, registered_user):
+        """閾値未満の本文は圧縮しない。"""
+        resp = registered_user.get("/get_json", headers=GZIP)
+        assert "Content-Encoding" not in resp.headers
+        assert resp.get_json() == {"diaries": []}
+
+    def test_streamed_json_compressed(self, registered_user):
+        """?stream=1 のストリーミングレスポンスも圧縮される。"""
+        _fill_diaries()
+        resp = registered_user.get("/get_json?stream=1", headers=GZIP)
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert len(json.loads(gzip.decompress(resp.data))["diaries"]) == 30
+
+    def test_gzip_export_not_compressed_twice(self, registered_user):
+        """既に gzip のエクスポートは種類が対象外なのでそのまま返す。"""
+        _fill_diaries(3)
+        resp = registered_user.get("/export_ndjson?gzip=1", headers=GZIP)
+        assert "Content-Encoding" not in resp.headers
+        assert len(gzip.decompress(resp.data).splitlines()) == 3
+
+    def test_partial_content_not_compressed(self, client):
+        """Range 付きの static（206）は、Content-Range と合うよう圧縮せずに返す。"""
+        resp = client.get("/static/css/style.css", headers={**GZIP, "Range": "bytes=0-1999"})
+        assert resp.status_code == 206
+        assert resp.headers["Content-Range"].startswith("bytes 0-1999/")
+        assert "Content-Encoding" not in resp.headers
+        assert len(resp.data) == 2000
+
+
+class TestCompressionMiddleware:
+    def test_chunks_compressed_incrementally_and_closed(self):
+        """Content-Length のない本文はチャンクごとに圧縮して送り出し、close() を伝える。"""
+        closed = []
+
+        def chunks():
+            try:
+                for i in range(3):
+                    yield json.dumps({"i": i, "text": "あ" * 600}).encode()
+            finally:
+                closed.append(True)
+
+        def app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "application/json")])
+            return chunks()
+
+        client = Client(CompressionMiddleware(app, min_size=100), Response)
+        resp = client.get("/", headers=GZIP)
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(resp.data).count(b'"i"') == 3
+        assert closed == [True]
+
+    def test_only_plain_200_responses_compressed(self):
+        """200 以外・Content-Range 付き・符号化済みの本文は、大きくてもそのまま返す。"""
+        cases = [
+            ("206 Partial Content", [("Content-Range", "bytes 0-4999/9000")]),
+            ("200 OK", [("Content-Range", "bytes 0-4999/5000")]),
+            ("200 OK", [("Content-Encoding", "br")]),
+            ("404 NOT FOUND", []),
+        ]
+        for status, extra in cases:
+            def app(environ, start_response, status=status, extra=extra):
+                start_response(status, [("Content-Type", "application/json"), *extra])
+                return [b"x" * 5000]
+
+            resp = Client(CompressionMiddleware(app), Response).get("/", headers=GZIP)
+            assert resp.headers.get("Content-Encoding") != "gzip", status
+            assert resp.data == b"x" * 5000
+
+    def test_identity_when_not_accepted(self):
+        """Accept-Encoding がなければ圧縮しないが、Vary は付ける。"""
+        def app(environ, start_response):
+            start_response("200 OK", [("Content-Type", "application/json")])
+            return [b"x" * 5000]
+
+        resp = Client(CompressionMiddleware(app), Response).get("/")
+        assert "Content-Encoding" not in resp.headers
+        assert resp.headers["Vary"] == "Accept-Encoding"
+        assert resp.data == b"x" * 5000
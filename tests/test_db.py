@@ -0,0 +1,149 @@
+"""DB 接続設定とスキーマ初期化のテスト。"""
+import sqlite3
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from app import create_app
+from app.config import SQLITE_PRAGMA_PROFILES, TestingConfig
+from app.db import apply_sqlite_pragmas, db, init_db
+from app.services.auth_service import InvalidCredentialsError, authenticate_user, register_user
+from app.services.diary_service import create_diary_entry, get_user_diaries
+
+
+class TestSqlitePragmas:
+    def test_tuned_profile_applied_on_connect(self, tmp_path):
+        """tuned プロファイルの PRAGMA が新しい接続すべてに適用される。"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'tuned.db'}")
+        apply_sqlite_pragmas(engine, SQLITE_PRAGMA_PROFILES["tuned"])
+        with engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        engine.dispose()
+
+    def test_unknown_profile_rejected(self, monkeypatch):
+        """存在しないプロファイル名は起動時にエラーになる。"""
+        monkeypatch.setattr(TestingConfig, "SQLITE_PRAGMA_PROFILE", "nope")
+        with pytest.raises(RuntimeError):
+            create_app("testing")
+
+
+class TestInitDb:
+    def test_adds_missing_columns_to_existing_tables(self, tmp_path, monkeypatch):
+        """既存 DB に後から追加したカラムとインデックスが init_db で補われる。"""
+        path = tmp_path / "old.db"
+        conn = sqlite3.connect(path)
+        conn.executescript(
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(100) NOT NULL,"
+            " email VARCHAR(254) NOT NULL UNIQUE, password_hash TEXT NOT NULL,"
+            " created_at VARCHAR(30) NOT NULL DEFAULT '');"
+            "CREATE TABLE diaries (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL,"
+            " title VARCHAR(100) NOT NULL, comment TEXT NOT NULL,"
+            " created_at VARCHAR(30) NOT NULL DEFAULT '');"
+            "INSERT INTO users (username, email, password_hash) VALUES ('a', 'a@example.com', 'x');"
+        )
+        conn.commit()
+
+        monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{path}")
+        app = create_app("testing")
+        with app.app_context():
+            init_db()
+
+        user_columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(diaries)")}
+        assert "diary_version" in user_columns
+        assert "ix_diaries_user_created_ts_id" in indexes
+        assert conn.execute("SELECT diary_version FROM users").fetchone() == (0,)
+        conn.close()
+
+    def test_backfills_created_ts_from_created_at(self, tmp_path, monkeypatch):
+        """既存の日記の created_ts が created_at（ローカル時刻）から埋まり、旧インデックスが消える。"""
+        path = tmp_path / "old.db"
+        conn = sqlite3.connect(path)
+        conn.executescript(
+            "CREATE TABLE diaries (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL,"
+            " title VARCHAR(100) NOT NULL, comment TEXT NOT NULL,"
+            " created_at VARCHAR(30) NOT NULL DEFAULT '');"
+            "CREATE INDEX ix_diaries_user_created_id ON diaries (user_id, created_at, id);"
+            "INSERT INTO diaries (user_id, title, comment, created_at)"
+            " VALUES (1, 't', 'c', '2024-03-01 09:30:00');"
+        )
+        conn.commit()
+
+        monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{path}")
+        app = create_app("testing")
+        with app.app_context():
+            init_db()
+            init_db()  # 2回目は何もしない
+
+        expected = int(time.mktime(time.strptime("2024-03-01 09:30:00", "%Y-%m-%d %H:%M:%S")))
+        assert conn.execute("SELECT created_ts FROM diaries").fetchone() == (expected,)
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(diaries)")}
+        assert "ix_diaries_user_created_id" not in indexes
+        conn.close()
+
+
+@pytest.fixture
+def replica_app(tmp_path, monkeypatch):
+    """プライマリとレプリカに別々の SQLite ファイルを使うアプリ。
+
+    レプリカは flask sync-replica を実行した時点の複製になる。
+    """
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_BINDS", {
+        "replica": {"url": f"sqlite:///{tmp_path / 'replica.db'}", "pool_pre_ping": True},
+    })
+    app = create_app("testing")
+    with app.app_context():
+        init_db()
+        app.test_cli_runner().invoke(args=["sync-replica"])
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    # Flask-SQLAlchemy はバインドごとの MetaData を db オブジェクト全体で共有するため、
+    # 残すと後続テストの drop_all() が存在しない "replica" バインドを探してしまう
+    db.metadatas.pop("replica", None)
+
+
+class TestReadReplica:
+    def test_reads_go_to_replica_until_synced(self, replica_app):
+        """書き込みのない新しいリクエストの一覧はレプリカから読まれる。"""
+        user = register_user("rep", "rep@example.com", "password123")
+        create_diary_entry(user.id, "A", "content")
+        user_id = user.id
+        db.session.remove()  # 新しいリクエストを模す
+
+        assert get_user_diaries(user_id) == []
+        result = replica_app.test_cli_runner().invoke(args=["sync-replica"])
+        assert result.exit_code == 0
+        db.session.remove()
+        assert [d["title"] for d in get_user_diaries(user_id)] == ["A"]
+
+    def test_reads_after_write_in_same_request_use_primary(self, replica_app):
+        """同じリクエスト内で書き込んだ後の読み取りはプライマリに行く。"""
+        user = register_user("ryw", "ryw@example.com", "password123")
+        create_diary_entry(user.id, "A", "content")
+        assert [d["title"] for d in get_user_diaries(user.id)] == ["A"]
+
+    def test_sign_in_reads_replica(self, replica_app):
+        """ログイン時のユーザー検索はレプリカで行われる。"""
+        register_user("sig", "sig@example.com", "password123")
+        db.session.remove()
+        with pytest.raises(InvalidCredentialsError):
+            authenticate_user("sig@example.com", "password123")
+        replica_app.test_cli_runner().invoke(args=["sync-replica"])
+        db.session.remove()
+        assert authenticate_user("sig@example.com", "password123").email == "sig@example.com"
+
+    def test_sticky_after_write_across_requests(self, replica_app):
+        """書き込んだユーザーの次のリクエストは、同期前でもプライマリから読む。"""
+        client = replica_app.test_client()
+        client.post("/register", data={
+            "email": "web@example.com", "password": "password123", "username": "web",
+        })
+        client.post("/create_diary", data={"title": "Mine", "comment": "content"})
+        data = client.get("/get_json").get_json()
+        assert [d["title"] for d in data["diaries"]] == ["Mine"]
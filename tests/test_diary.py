@@ -1,17 +1,32 @@
 """日記 CRUD のテスト。"""
+import calendar
 import json
+import time
+
 import pytest
+from sqlalchemy import event
+
+from app.db import db
 from app.services.diary_service import (
     create_diary_entry,
     delete_diary_entry,
     update_diary_entry,
     get_user_diaries,
+    iter_user_diaries,
+    get_user_diaries_page,
+    get_user_diaries_between,
+    count_user_diaries_by_period,
+    sync_user_diaries,
+    search_user_diaries,
+    apply_diary_batch,
+    get_diary_list_version,
     ValidationError,
     NotFoundOrForbiddenError,
     TITLE_MAX_LENGTH,
     COMMENT_MAX_LENGTH,
 )
 from app.services.auth_service import register_user
+from app.models.diary import DiaryEntry
 
 
 class TestDiaryService:
@@ -36,6 +51,15 @@ class TestDiaryService:
         assert diaries[0]["title"] == "Second"
         assert diaries[1]["title"] == "First"
 
+    def test_core_list_matches_orm_to_dict(self, app):
+        """ORM を経由しない一覧は、ORM オブジェクトの to_dict() と同じ辞書を同じ順で返す。"""
+        user = register_user("erin", "erin@example.com", "password123")
+        for i in range(3):
+            create_diary_entry(user.id, f"T{i}", "content")
+        expected = [entry.to_dict() for entry in DiaryEntry.list_page_by_user(user.id, limit=10)]
+        assert get_user_diaries(user.id) == expected
+        assert list(iter_user_diaries(user.id)) == expected
+
     def test_empty_title_raises(self, app):
         """空のタイトルは ValidationError を発生させる。"""
         user = register_user("frank", "frank@example.com", "password123")
@@ -113,6 +137,283 @@ class TestDiaryService:
             update_diary_entry(entry.id, user.id, "", "content")
 
 
+class TestDiaryPagination:
+    def test_pages_cover_all_entries_in_order(self, app):
+        """カーソルを辿ると全件を新しい順に重複なく取得できる。"""
+        user = register_user("tom", "tom@example.com", "password123")
+        for i in range(5):
+            create_diary_entry(user.id, f"Title {i}", "content")
+
+        titles, cursor = [], None
+        while True:
+            page, cursor = get_user_diaries_page(user.id, limit=2, after=cursor)
+            titles.extend(d["title"] for d in page)
+            if cursor is None:
+                break
+        assert titles == [d["title"] for d in get_user_diaries(user.id)]
+        assert titles[0] == "Title 4"
+
+    def test_last_page_has_no_cursor(self, app):
+        """件数ちょうどのページでは next カーソルが返らない。"""
+        user = register_user("uma", "uma@example.com", "password123")
+        create_diary_entry(user.id, "Only", "content")
+        page, cursor = get_user_diaries_page(user.id, limit=1)
+        assert len(page) == 1
+        assert cursor is None
+
+    def test_invalid_cursor_raises(self, app):
+        """改ざんされたカーソルは ValidationError を発生させる。"""
+        user = register_user("vic", "vic@example.com", "password123")
+        with pytest.raises(ValidationError):
+            get_user_diaries_page(user.id, limit=10, after="not-a-cursor")
+
+    def test_limit_out_of_range_raises(self, app):
+        """limit が範囲外なら ValidationError を発生させる。"""
+        user = register_user("wes", "wes@example.com", "password123")
+        with pytest.raises(ValidationError):
+            get_user_diaries_page(user.id, limit=0)
+
+
+class TestDiarySync:
+    def test_initial_sync_returns_full_list(self, app):
+        """トークンなしの同期は全件と token を返す。"""
+        user = register_user("xena", "xena@example.com", "password123")
+        create_diary_entry(user.id, "A", "content")
+        result = sync_user_diaries(user.id)
+        assert result["full"] is True
+        assert [d["title"] for d in result["diaries"]] == ["A"]
+        assert result["token"]
+
+    def test_sync_returns_only_changes(self, app):
+        """token 以降に作成・更新された日記と削除された ID だけが返る。"""
+        user = register_user("yuri", "yuri@example.com", "password123")
+        kept = create_diary_entry(user.id, "Kept", "content")
+        edited = create_diary_entry(user.id, "Edited", "content")
+        removed = create_diary_entry(user.id, "Removed", "content")
+        token = sync_user_diaries(user.id)["token"]
+
+        update_diary_entry(edited.id, user.id, "Edited v2", "content")
+        delete_diary_entry(removed.id, user.id)
+        added = create_diary_entry(user.id, "Added", "content")
+
+        result = sync_user_diaries(user.id, token)
+        assert result["full"] is False
+        assert {d["id"] for d in result["diaries"]} == {edited.id, added.id}
+        assert kept.id not in {d["id"] for d in result["diaries"]}
+        assert result["deleted"] == [removed.id]
+
+    def test_sync_without_changes_is_empty(self, app):
+        """変更がなければ差分は空で、token も変わらない。"""
+        user = register_user("zoe", "zoe@example.com", "password123")
+        create_diary_entry(user.id, "A", "content")
+        token = sync_user_diaries(user.id)["token"]
+        result = sync_user_diaries(user.id, token)
+        assert result["diaries"] == [] and result["deleted"] == []
+        assert result["token"] == token
+
+    def test_invalid_token_raises(self, app):
+        """不正な token は ValidationError を発生させる。"""
+        user = register_user("abe", "abe@example.com", "password123")
+        with pytest.raises(ValidationError):
+            sync_user_diaries(user.id, "garbage")
+
+
+class TestDiarySearch:
+    def test_search_japanese_text(self, app):
+        """分かち書きなしの日本語を部分一致で検索でき、一致箇所が <mark> で囲まれる。"""
+        user = register_user("ann", "ann@example.com", "password123")
+        create_diary_entry(user.id, "週末", "今日は図書館で勉強した。")
+        create_diary_entry(user.id, "平日", "公園を散歩した。")
+        results = search_user_diaries(user.id, "図書館")
+        assert [r["title"] for r in results] == ["週末"]
+        assert "<mark>図書館</mark>" in results[0]["snippet"]
+
+    def test_search_short_term(self, app):
+        """trigram で索引できない2文字の語でも検索できる。"""
+        user = register_user("ben", "ben@example.com", "password123")
+        create_diary_entry(user.id, "メモ", "日記を書いた。")
+        create_diary_entry(user.id, "別件", "買い物に行った。")
+        results = search_user_diaries(user.id, "日記")
+        assert [r["title"] for r in results] == ["メモ"]
+        assert "<mark>日記</mark>" in results[0]["snippet"]
+
+    def test_search_scoped_to_user(self, app):
+        """他のユーザーの日記は検索結果に含まれない。"""
+        owner = register_user("cal", "cal@example.com", "password123")
+        other = register_user("dee", "dee@example.com", "password123")
+        create_diary_entry(owner.id, "秘密", "誰にも言えない話")
+        assert search_user_diaries(other.id, "言えない") == []
+
+    def test_search_follows_update_and_delete(self, app):
+        """更新・削除した内容は検索インデックスにも反映される。"""
+        user = register_user("eli", "eli@example.com", "password123")
+        entry = create_diary_entry(user.id, "旅行", "京都に行った")
+        update_diary_entry(entry.id, user.id, "旅行", "奈良に行った")
+        assert search_user_diaries(user.id, "京都に") == []
+        assert len(search_user_diaries(user.id, "奈良に")) == 1
+        delete_diary_entry(entry.id, user.id)
+        assert search_user_diaries(user.id, "奈良に") == []
+
+    def test_search_escapes_html(self, app):
+        """本文中の HTML はスニペットでエスケープされる。"""
+        user = register_user("fay", "fay@example.com", "password123")
+        create_diary_entry(user.id, "XSS", "<script>alert(1)</script>")
+        snippet = search_user_diaries(user.id, "alert")[0]["snippet"]
+        assert "<script>" not in snippet
+        assert "&lt;script&gt;" in snippet
+
+    def test_empty_query_raises(self, app):
+        """空の検索語は ValidationError を発生させる。"""
+        user = register_user("gus", "gus@example.com", "password123")
+        with pytest.raises(ValidationError):
+            search_user_diaries(user.id, "   ")
+
+
+class TestDiaryDateRange:
+    @pytest.fixture
+    def user_id(self, app):
+        """UTC の 2024-02-29 23:30 / 2024-03-01 00:30 / 2024-03-15 12:00 / 2024-04-01 00:00 の日記を持つユーザー。"""
+        user = register_user("ivy", "ivy@example.com", "password123")
+        stamps = ["2024-02-29 23:30", "2024-03-01 00:30", "2024-03-15 12:00", "2024-04-01 00:00"]
+        DiaryEntry.bulk_create(user.id, [
+            {"title": stamp, "comment": "本文", "created_at": stamp + ":00", "created_ts": _utc(stamp)}
+            for stamp in stamps
+        ])
+        return user.id
+
+    def test_between_includes_both_end_dates(self, user_id):
+        diaries, cursor = get_user_diaries_between(user_id, "2024-03-01", "2024-03-31")
+        assert [d["title"] for d in diaries] == ["2024-03-15 12:00", "2024-03-01 00:30"]
+        assert cursor is None
+        assert diaries[0]["created_ts"] == _utc("2024-03-15 12:00")
+
+    def test_between_uses_timezone_offset(self, user_id):
+        """日本時間（+9:00）では UTC 2024-02-29 23:30 も 3月1日になる。"""
+        diaries, _ = get_user_diaries_between(user_id, "2024-03-01", "2024-03-01", tz_offset=540)
+        assert [d["title"] for d in diaries] == ["2024-03-01 00:30", "2024-02-29 23:30"]
+
+    def test_between_pages_with_cursor(self, user_id):
+        page, cursor = get_user_diaries_between(user_id, "2024-01-01", "2024-12-31", limit=3)
+        rest, last = get_user_diaries_between(user_id, "2024-01-01", "2024-12-31", limit=3, after=cursor)
+        assert len(page) == 3 and [d["title"] for d in rest] == ["2024-02-29 23:30"]
+        assert last is None
+
+    def test_counts_per_day_and_month(self, user_id):
+        assert count_user_diaries_by_period(user_id, "month", "2024-01-01", "2024-12-31") == {
+            "2024-02": 1, "2024-03": 2, "2024-04": 1,
+        }
+        # 日本時間では UTC 2/29 23:30 が 3/1 に、UTC 4/1 00:00 は 4/1 09:00（範囲外）になる
+        assert count_user_diaries_by_period(user_id, "day", "2024-03-01", "2024-03-31", 540) == {
+            "2024-03-01": 2, "2024-03-15": 1,
+        }
+
+    @pytest.mark.parametrize("unit, start, end, tz", [
+        ("week", "2024-01-01", "2024-01-31", 0),
+        ("day", "2024-02-01", "2024-01-01", 0),
+        ("day", "2024/01/01", "2024-01-31", 0),
+        ("day", "2000-01-01", "2024-01-31", 0),
+        ("day", "2024-01-01", "2024-01-31", 15 * 60),
+    ])
+    def test_invalid_calendar_arguments_raise(self, user_id, unit, start, end, tz):
+        with pytest.raises(ValidationError):
+            count_user_diaries_by_period(user_id, unit, start, end, tz)
+
+    def test_calendar_query_reads_only_the_index(self, user_id):
+        """集計は (user_id, created_ts, id) のインデックスだけで済み、テーブル本体を読まない。"""
+        recorded = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            recorded.append((statement, parameters))
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            count_user_diaries_by_period(user_id, "day", "2024-01-01", "2024-12-31", 540)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        (statement, parameters), = [r for r in recorded if "GROUP BY" in r[0]]
+        plan = db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+        assert any("COVERING INDEX ix_diaries_user_created_ts_id" in row[-1] for row in plan)
+
+
+def _utc(stamp: str) -> int:
+    return calendar.timegm(time.strptime(stamp, "%Y-%m-%d %H:%M"))
+
+
+class TestDiaryBatch:
+    def test_batch_applies_deletes_and_updates(self, app):
+        """削除と更新をまとめて適用できる。"""
+        user = register_user("hal", "hal@example.com", "password123")
+        a = create_diary_entry(user.id, "A", "content")
+        b = create_diary_entry(user.id, "B", "content")
+        results = apply_diary_batch(user.id, [
+            {"op": "delete", "id": a.id},
+            {"op": "update", "id": b.id, "title": "B2", "comment": "new"},
+        ])
+        assert [r["status"] for r in results] == ["ok", "ok"]
+        diaries = get_user_diaries(user.id)
+        assert [(d["title"], d["comment"]) for d in diaries] == [("B2", "new")]
+
+    def test_batch_reports_per_item_errors(self, app):
+        """他人の日記・存在しない ID・不正な入力は個別に報告され、他の操作は適用される。"""
+        owner = register_user("ida", "ida@example.com", "password123")
+        other = register_user("jon", "jon@example.com", "password123")
+        mine = create_diary_entry(owner.id, "Mine", "content")
+        theirs = create_diary_entry(other.id, "Theirs", "content")
+        results = apply_diary_batch(owner.id, [
+            {"op": "delete", "id": theirs.id},
+            {"op": "delete", "id": 9999},
+            {"op": "update", "id": mine.id, "title": "", "comment": "x"},
+            {"op": "rename", "id": mine.id},
+            "not an object",
+        ])
+        assert [r["status"] for r in results] == [
+            "not_found_or_forbidden",
+            "not_found_or_forbidden",
+            "validation_error",
+            "validation_error",
+            "validation_error",
+        ]
+        assert len(get_user_diaries(other.id)) == 1
+        assert get_user_diaries(owner.id)[0]["title"] == "Mine"
+
+    def test_batch_rejects_duplicate_ids(self, app):
+        """同じ ID への2回目の操作は validation_error になり、1回目だけ適用される。"""
+        user = register_user("kim", "kim@example.com", "password123")
+        entry = create_diary_entry(user.id, "A", "content")
+        results = apply_diary_batch(user.id, [
+            {"op": "update", "id": entry.id, "title": "A2", "comment": "content"},
+            {"op": "delete", "id": entry.id},
+        ])
+        assert [r["status"] for r in results] == ["ok", "validation_error"]
+        assert get_user_diaries(user.id)[0]["title"] == "A2"
+
+    def test_batch_deletes_visible_to_sync(self, app):
+        """一括削除は差分同期の deleted にも現れる。"""
+        user = register_user("lia", "lia@example.com", "password123")
+        entry = create_diary_entry(user.id, "A", "content")
+        token = sync_user_diaries(user.id)["token"]
+        apply_diary_batch(user.id, [{"op": "delete", "id": entry.id}])
+        assert sync_user_diaries(user.id, token)["deleted"] == [entry.id]
+
+    def test_batch_locks_before_reading_owned_ids(self, app, assert_max_queries):
+        """所有する ID の絞り込みは、書き込みロックを取る UPDATE の後に行う。"""
+        user = register_user("mia", "mia@example.com", "password123")
+        entry = create_diary_entry(user.id, "A", "content")
+        with assert_max_queries(10) as statements:
+            apply_diary_batch(user.id, [{"op": "delete", "id": entry.id}])
+        lock = next(i for i, sql in enumerate(statements) if sql.startswith("UPDATE users"))
+        owned = next(i for i, sql in enumerate(statements) if sql.startswith("SELECT diaries.id"))
+        assert lock < owned
+
+    def test_batch_without_owned_ids_keeps_version(self, app):
+        """適用する操作がなければ、一覧のバージョンは変わらない。"""
+        user = register_user("noa", "noa@example.com", "password123")
+        version = get_diary_list_version(user.id)
+        apply_diary_batch(user.id, [{"op": "delete", "id": 9999}])
+        assert get_diary_list_version(user.id) == version
+
+
 class TestDiaryRoutes:
     def test_get_json_returns_empty_list(self, registered_user):
         """ログイン直後は空の日記一覧が返る。"""
@@ -152,12 +453,128 @@ class TestDiaryRoutes:
         assert len(data["diaries"]) == 1
         assert data["diaries"][0]["title"] == "Test Title"
 
+    def test_get_json_paginated(self, registered_user):
+        """limit を指定すると1ページ分と next カーソルが返る。"""
+        for i in range(3):
+            registered_user.post("/create_diary", data={"title": f"T{i}", "comment": "c"})
+        first = json.loads(registered_user.get("/get_json?limit=2").data)
+        assert [d["title"] for d in first["diaries"]] == ["T2", "T1"]
+        assert first["next"] is not None
+
+        second = json.loads(
+            registered_user.get(f"/get_json?limit=2&after={first['next']}").data
+        )
+        assert [d["title"] for d in second["diaries"]] == ["T0"]
+        assert second["next"] is None
+
+    def test_get_json_invalid_limit_returns_400(self, registered_user):
+        """数値でない limit は 400 を返す。"""
+        resp = registered_user.get("/get_json?limit=abc")
+        assert resp.status_code == 400
+
+    def test_get_json_returns_etag(self, registered_user):
+        """一覧レスポンスには ETag と再検証を促す Cache-Control が付く。"""
+        resp = registered_user.get("/get_json")
+        assert resp.headers.get("ETag")
+        assert "no-cache" in resp.headers["Cache-Control"]
+
+    def test_get_json_not_modified(self, registered_user):
+        """変更がなければ If-None-Match に 304 を返す。"""
+        etag = registered_user.get("/get_json").headers["ETag"]
+        resp = registered_user.get("/get_json", headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.data == b""
+
+    def test_get_json_etag_changes_after_write(self, registered_user):
+        """作成・更新・削除のたびに ETag が変わり、古い ETag では 200 が返る。"""
+        etags = [registered_user.get("/get_json").headers["ETag"]]
+        registered_user.post("/create_diary", data={"title": "T", "comment": "c"})
+        etags.append(registered_user.get("/get_json").headers["ETag"])
+        diary_id = json.loads(registered_user.get("/get_json").data)["diaries"][0]["id"]
+        registered_user.post(f"/diary/{diary_id}/update", data={"title": "U", "comment": "c"})
+        etags.append(registered_user.get("/get_json").headers["ETag"])
+        registered_user.post(f"/diary/{diary_id}/delete")
+        etags.append(registered_user.get("/get_json").headers["ETag"])
+        assert len(set(etags)) == 4
+
+        resp = registered_user.get("/get_json", headers={"If-None-Match": etags[0]})
+        assert resp.status_code == 200
+
+    def test_sync_json_roundtrip(self, registered_user):
+        """GET /sync_json の token を使うと、その後の変更だけが返る。"""
+        first = json.loads(registered_user.get("/sync_json").data)
+        registered_user.post("/create_diary", data={"title": "New", "comment": "c"})
+        resp = registered_user.get(f"/sync_json?token={first['token']}")
+        data = json.loads(resp.data)
+        assert [d["title"] for d in data["diaries"]] == ["New"]
+        assert data["full"] is False
+
+    def test_search_json(self, registered_user):
+        """GET /search_json?q= で自分の日記を検索できる。"""
+        registered_user.post("/create_diary", data={"title": "検索", "comment": "見つけてほしい本文"})
+        data = json.loads(registered_user.get("/search_json?q=見つけて").data)
+        assert [d["title"] for d in data["diaries"]] == ["検索"]
+
+    def test_get_json_stream_matches_full_list(self, registered_user):
+        """?stream=1 の応答は全件取得と同じ JSON になる。"""
+        for i in range(3):
+            registered_user.post("/create_diary", data={"title": f"T{i}", "comment": "日本語"})
+        full = json.loads(registered_user.get("/get_json").data)
+        resp = registered_user.get("/get_json?stream=1")
+        assert resp.is_streamed
+        assert json.loads(resp.data) == full
+
+    def test_get_json_stream_empty(self, registered_user):
+        """日記がなくても ?stream=1 は正しい JSON を返す。"""
+        resp = registered_user.get("/get_json?stream=1")
+        assert json.loads(resp.data) == {"diaries": []}
+
+    def test_batch_endpoint(self, registered_user):
+        """POST /diary/batch で複数の日記を1リクエストで削除できる。"""
+        for i in range(3):
+            registered_user.post("/create_diary", data={"title": f"T{i}", "comment": "c"})
+        ids = [d["id"] for d in json.loads(registered_user.get("/get_json").data)["diaries"]]
+        resp = registered_user.post("/diary/batch", json={
+            "operations": [{"op": "delete", "id": i} for i in ids],
+        })
+        assert resp.status_code == 200
+        assert all(r["status"] == "ok" for r in json.loads(resp.data)["results"])
+        assert json.loads(registered_user.get("/get_json").data)["diaries"] == []
+
+    def test_batch_endpoint_requires_operations(self, registered_user):
+        """operations が配列でなければ 400 を返す。"""
+        resp = registered_user.post("/diary/batch", json={"operations": "nope"})
+        assert resp.status_code == 400
+
     def test_get_json_unauthenticated_redirects(self, client):
         """未ログイン時は /signin にリダイレクトされる。"""
         resp = client.get("/get_json")
         assert resp.status_code == 302
         assert resp.headers["Location"].endswith("/signin")
 
+    def test_calendar_and_range_json(self, registered_user):
+        """作成したばかりの日記が今日の件数と期間検索に現れる。"""
+        registered_user.post("/create_diary", data={"title": "Today", "comment": "c"})
+        today = time.strftime("%Y-%m-%d", time.gmtime())
+
+        resp = registered_user.get(f"/calendar_json?unit=month&start={today}&end={today}")
+        assert resp.get_json() == {"unit": "month", "counts": {today[:7]: 1}}
+        resp = registered_user.get(f"/range_json?start={today}&end={today}&limit=10")
+        assert [d["title"] for d in resp.get_json()["diaries"]] == ["Today"]
+
+    @pytest.mark.parametrize("url", [
+        "/calendar_json?start=2024-01-01&end=2024-01-31&tz=abc",
+        "/calendar_json?unit=year&start=2024-01-01&end=2024-01-31",
+        "/range_json?start=2024-01-01",
+        "/range_json?start=2024-01-01&end=2024-01-31&limit=0",
+        "/range_json?start=9999-12-31&end=9999-12-31",  # 翌日が date の範囲を超える
+        "/calendar_json?unit=month&start=9999-12-01&end=9999-12-31",
+    ])
+    def test_calendar_and_range_json_reject_invalid_arguments(self, registered_user, url):
+        resp = registered_user.get(url)
+        assert resp.status_code == 400
+        assert "error" in resp.get_json()
+
     def test_delete_diary_success(self, registered_user):
         """POST /diary/<id>/delete で自分の日記を削除できる。"""
         registered_user.post("/create_diary", data={"title": "To Delete", "comment": "bye"})
@@ -203,3 +620,36 @@ class TestDiaryRoutes:
             "comment": "content",
         })
         assert resp.status_code == 400
+
+
+class TestQueryCounts:
+    """一覧・ダッシュボードのクエリ数が日記の件数に比例しない（N+1 にならない）ことを確かめる。"""
+
+    @pytest.fixture
+    def user_with_diaries(self, registered_user):
+        for i in range(30):
+            registered_user.post("/create_diary", data={"title": f"日記 {i}", "comment": "本文"})
+        return registered_user
+
+    def test_get_json(self, user_with_diaries, assert_max_queries):
+        # 一覧のバージョン番号 + 一覧
+        with assert_max_queries(2):
+            resp = user_with_diaries.get("/get_json")
+        assert len(resp.get_json()["diaries"]) == 30
+
+    def test_get_json_page(self, user_with_diaries, assert_max_queries):
+        with assert_max_queries(2):
+            resp = user_with_diaries.get("/get_json?limit=10")
+        assert len(resp.get_json()["diaries"]) == 10
+
+    def test_calendar_json(self, user_with_diaries, assert_max_queries):
+        # 一覧と同じく件数によらず集計 1 回（+ ユーザー情報）
+        with assert_max_queries(2):
+            resp = user_with_diaries.get("/calendar_json?unit=day&start=2000-01-01&end=2009-12-31")
+        assert resp.status_code == 200
+
+    def test_dashboard(self, user_with_diaries, assert_max_queries):
+        # ログイン中ユーザーの情報（キャッシュに無ければ 1 回）だけ
+        with assert_max_queries(1):
+            resp = user_with_diaries.get("/dashboard")
+        assert resp.status_code == 200
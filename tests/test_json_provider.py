@@ -0,0 +1,55 @@
+"""JSON プロバイダ（orjson）のテスト。"""
+import datetime
+import json
+
+import pytest
+from flask.json.provider import DefaultJSONProvider
+
+from app import create_app
+from app.config import TestingConfig
+from app.json_provider import OrjsonProvider, orjson
+
+pytestmark = pytest.mark.skipif(orjson is None, reason="orjson is not installed")
+
+
+class TestOrjsonProvider:
+    def test_used_by_default(self, app):
+        """orjson がインストールされていれば app.json として使われる。"""
+        assert isinstance(app.json, OrjsonProvider)
+
+    def test_same_values_as_stdlib(self, app):
+        """標準のプロバイダと同じ値（キーの並び・日付の形式・日本語）を出力する。"""
+        data = {"b": "日本語", "a": [1, 2.5, None], "when": datetime.datetime(2024, 1, 2, 3, 4, 5)}
+        stdlib = DefaultJSONProvider(app)
+        stdlib.ensure_ascii = False
+        assert app.json.dumps(data) == stdlib.dumps(data, separators=(",", ":"))
+        assert app.json.loads(app.json.dumps(data)) == json.loads(stdlib.dumps(data))
+
+    @pytest.mark.parametrize("payload", [
+        {1: "a", 2: "b"},
+        {"counts": {3: [True, None]}},
+        {True: 1},
+        {1.5: "x"},
+        ["日本語", {"k": None}],
+    ])
+    def test_payloads_match_stdlib(self, app, payload):
+        """str 以外のキーを含む値も、標準のプロバイダと同じ JSON になる（jsonify でも失敗しない）。"""
+        stdlib = DefaultJSONProvider(app)
+        stdlib.ensure_ascii = False
+        assert app.json.dumps(payload) == stdlib.dumps(payload, separators=(",", ":"))
+        with app.test_request_context():
+            body = app.json.response(payload).get_data(as_text=True)
+            expected = stdlib.response(payload).get_data(as_text=True)
+        assert json.loads(body) == json.loads(expected)
+
+    def test_jsonify_response(self, app):
+        """jsonify() のレスポンス本文は UTF-8 の compact な JSON になる。"""
+        with app.test_request_context():
+            resp = app.json.response({"title": "日記"})
+        assert resp.mimetype == "application/json"
+        assert resp.data == '{"title":"日記"}\n'.encode()
+
+    def test_stdlib_selectable(self, monkeypatch):
+        """JSON_PROVIDER=stdlib なら標準のプロバイダのまま。"""
+        monkeypatch.setattr(TestingConfig, "JSON_PROVIDER", "stdlib")
+        assert not isinstance(create_app("testing").json, OrjsonProvider)
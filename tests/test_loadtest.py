@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from app import loadtest
+from app.models.user import User
+
+
+class TestParsing:
+    def test_parse_mix(self):
+        assert loadtest.parse_mix("list=3, create=1") == {"list": 3, "create": 1}
+
+    @pytest.mark.parametrize("spec", ["browse=1", "list=x", "list=-1", "list=0"])
+    def test_parse_mix_rejects_invalid(self, spec):
+        with pytest.raises(ValueError):
+            loadtest.parse_mix(spec)
+
+    def test_load_script(self):
+        lines = ['{"op": "list"}\n', "\n", '{"op": "create"}\n']
+        assert loadtest.load_script(lines) == ["list", "create"]
+        with pytest.raises(ValueError, match="line 1"):
+            loadtest.load_script(['{"op": "drop"}'])
+
+
+def test_summary_percentiles_and_histogram():
+    samples = [loadtest.Sample(0.1, "list", ms / 1000, ms < 90, 200) for ms in range(1, 101)]
+    summary = loadtest._summarize(samples, 2.0)
+    assert summary["rps"] == 50
+    assert (summary["p50_ms"], summary["p95_ms"], summary["p99_ms"]) == pytest.approx((50, 95, 99))
+    assert summary["error_rate"] == pytest.approx(0.11)
+    assert sum(summary["histogram"]) == 100
+    assert summary["histogram"][:2] == [4, 5]  # 1-4 ms, 5-9 ms
+
+
+class TestRun:
+    def test_in_process_run_registers_users_and_mixes_operations(self, app):
+        report = loadtest.run(
+            loadtest.WsgiTransport(app), users=3, concurrency=1, duration=0.5, interval=0.1, seed=1
+        )
+        assert report.samples
+        assert all(sample.ok for sample in report.samples), report.total()["statuses"]
+        assert {"signin", "list", "create"} <= set(report.by_operation())
+        assert User.find_by_email("loadtest-2@example.com") is not None
+        assert sum(row["requests"] for row in report.timeline()) == len(report.samples)
+
+    def test_replay_script(self, app):
+        report = loadtest.run(
+            loadtest.WsgiTransport(app), users=1, concurrency=1, duration=0.3, script=["create"]
+        )
+        # 最初の1回はログイン（登録）、以降は記録どおり create だけ
+        assert report.samples[0].op == "signin"
+        assert {sample.op for sample in report.samples[1:]} == {"create"}
+
+    def test_cli_reports_and_writes_json(self, app, tmp_path):
+        path = tmp_path / "report.json"
+        result = app.test_cli_runner().invoke(args=[
+            "loadtest", "--users", "2", "-c", "1", "--duration", "0.3", "--json", str(path),
+        ])
+        assert result.exit_code == 0, result.output
+        assert "total" in result.output
+        assert json.loads(path.read_text())["total"]["requests"] > 0
@@ -0,0 +1,132 @@
+import json
+import os
+import re
+import threading
+
+import pytest
+
+from app import metrics
+
+TOKEN = "metrics-secret"
+
+
+@pytest.fixture
+def metrics_app(app):
+    app.config["METRICS_TOKEN"] = TOKEN
+    app.add_url_rule("/unavailable", "unavailable", lambda: ("down", 503))
+    return app
+
+
+def _scrape(client) -> str:
+    resp = client.get("/metrics", headers={"Authorization": f"Bearer {TOKEN}"})
+    assert resp.status_code == 200
+    assert resp.content_type == metrics.CONTENT_TYPE
+    return resp.get_data(as_text=True)
+
+
+def _value(text: str, series: str) -> float:
+    match = re.search(rf"^{re.escape(series)} (\S+)$", text, re.MULTILINE)
+    assert match, f"{series} not found in:\n{text}"
+    return float(match.group(1))
+
+
+class TestEndpoint:
+    def test_not_found_without_token_configured(self, client):
+        assert client.get("/metrics").status_code == 404
+
+    def test_requires_token(self, metrics_app, client):
+        assert client.get("/metrics").status_code == 401
+        resp = client.get("/metrics", headers={"Authorization": "Bearer wrong"})
+        assert resp.status_code == 401
+
+    def test_request_counts_and_histogram(self, metrics_app, registered_user):
+        for _ in range(3):
+            registered_user.get("/get_json")
+        text = _scrape(registered_user)
+
+        labels = 'endpoint="diary.get_json",method="GET"'
+        assert _value(text, f'nota_http_requests_total{{{labels},status="200"}}') == 3
+        assert _value(text, f'nota_http_request_duration_seconds_bucket{{{labels},le="+Inf"}}') == 3
+        assert _value(text, f"nota_http_request_duration_seconds_count{{{labels}}}") == 3
+        assert _value(text, f"nota_http_request_duration_seconds_sum{{{labels}}}") > 0
+        assert "# TYPE nota_http_request_duration_seconds histogram" in text
+        assert re.search(r'^nota_hash_pool_in_flight\{pid="\d+"\} 0$', text, re.MULTILINE)
+
+    def test_errors_and_unmatched_routes(self, metrics_app, client):
+        client.get("/unavailable")
+        client.get("/no/such/page")
+        text = _scrape(client)
+        assert _value(text, 'nota_http_request_errors_total{endpoint="unavailable",method="GET"}') == 1
+        assert _value(text, 'nota_http_requests_total{endpoint="<unmatched>",method="GET",status="404"}') == 1
+
+
+class TestAggregation:
+    def test_sums_counters_from_forked_workers(self, metrics_app, client, tmp_path):
+        metrics.configure(str(tmp_path), 0)
+        client.get("/signin")
+
+        pid = os.fork()
+        if pid == 0:
+            # 子プロセス: 親の値を引き継がず、自分の分だけを書き出して終了する
+            try:
+                metrics._registry.observe("auth.signin", "GET", 200, 0.02)
+                metrics._registry.observe("auth.signin", "GET", 200, 0.02)
+                metrics.flush()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        text = _scrape(client)
+        labels = 'endpoint="auth.signin",method="GET"'
+        assert _value(text, f'nota_http_requests_total{{{labels},status="200"}}') == 3
+        assert _value(text, f'nota_http_request_duration_seconds_bucket{{{labels},le="0.025"}}') >= 2
+        # 終了した子プロセスのゲージは出さない
+        assert _value(text, "nota_worker_processes") == 1
+        assert f'pid="{pid}"' not in text
+
+    def test_snapshot_file_is_written_atomically(self, metrics_app, client, tmp_path):
+        metrics.configure(str(tmp_path), 0)
+        client.get("/signin")
+        (path,) = tmp_path.iterdir()
+        assert path.name.startswith(f"{os.getpid()}-")
+        snapshot = json.loads(path.read_text())
+        assert snapshot["requests"] == [["auth.signin", "GET", "200", 1]]
+
+    def test_concurrent_flushes_do_not_collide(self, metrics_app, tmp_path):
+        metrics.configure(str(tmp_path), 0)
+        errors = []
+
+        def run():
+            for _ in range(50):
+                try:
+                    metrics.flush()
+                except OSError as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        (path,) = tmp_path.iterdir()
+        json.loads(path.read_text())
+
+    def test_write_failure_does_not_fail_request(self, metrics_app, client, tmp_path, monkeypatch):
+        metrics.configure(str(tmp_path), 0)
+
+        def broken():
+            raise OSError("disk full")
+
+        monkeypatch.setattr(metrics, "flush", broken)
+        assert client.get("/signin").status_code == 200
+
+    def test_clear_snapshots_removes_previous_processes(self, metrics_app, tmp_path):
+        (tmp_path / "123-456.json").write_text("{}")
+        metrics.configure(str(tmp_path), 0)
+        metrics.clear_snapshots()
+        assert list(tmp_path.iterdir()) == []
+
+
+def test_label_values_are_escaped():
+    assert metrics._sample("x", {"a": 'q"\\\n'}, 1) == 'x{a="q\\"\\\\\\n"} 1'
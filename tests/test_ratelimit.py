@@ -0,0 +1,90 @@
+"""トークンバケットによるレート制限のテスト。"""
+import pytest
+
+from app.models.user import User
+from app.ratelimit import MemoryStore, SqliteStore
+from app.routes import auth as auth_routes
+from app.services.auth_service import InvalidCredentialsError
+
+
+class TestStores:
+    def test_bucket_allows_burst_then_refills(self):
+        """capacity 回までは続けて通り、空になったら補充されるまで待ち秒数を返す。"""
+        store = MemoryStore()
+        assert [store.take("k", 2, 1.0, now=100.0) for _ in range(2)] == [0.0, 0.0]
+        assert store.take("k", 2, 1.0, now=100.0) == pytest.approx(1.0)
+        assert store.take("k", 2, 1.0, now=101.0) == 0.0
+
+    def test_memory_store_evicts_least_recently_used(self):
+        """保持するキー数が上限を超えると、最も古いキーが満タンの状態に戻る。"""
+        store = MemoryStore(max_keys=2)
+        store.take("a", 1, 0.1, now=0.0)
+        store.take("b", 1, 0.1, now=0.0)
+        store.take("c", 1, 0.1, now=0.0)
+        assert store.take("b", 1, 0.1, now=0.0) > 0  # まだ残っている
+        assert store.take("a", 1, 0.1, now=0.0) == 0.0  # 捨てられて満タンから再開
+
+    def test_sqlite_store_shared_between_instances(self, tmp_path):
+        """同じファイルを開いたストア（別ワーカーを模す）の間で上限が共有される。"""
+        path = str(tmp_path / "ratelimit.db")
+        first, second = SqliteStore(path), SqliteStore(path)
+        assert first.take("k", 1, 0.5, now=10.0) == 0.0
+        assert second.take("k", 1, 0.5, now=10.0) == pytest.approx(2.0)
+
+
+@pytest.fixture
+def limited_app(app):
+    """レート制限を有効にし、上限を小さくしたアプリ。"""
+    app.config["RATELIMIT_ENABLED"] = True
+    app.config["RATE_LIMITS"] = {
+        "auth": {"ip": (10, 60), "account": (2, 60)},
+        "write": {"ip": (100, 60), "account": (1, 60)},
+    }
+    return app
+
+
+class TestRateLimitRoutes:
+    def test_auth_rejected_before_authentication(self, limited_app, monkeypatch):
+        """同じアカウントへの連続ログインは、上限を超えると認証処理を呼ばずに 429 を返す。"""
+        calls = []
+
+        def authenticate(email, password):
+            calls.append(email)
+            raise InvalidCredentialsError()
+
+        monkeypatch.setattr(auth_routes, "authenticate_user", authenticate)
+        client = limited_app.test_client()
+        form = {"email": "Victim@example.com", "password": "guess"}
+        for _ in range(2):
+            assert client.post("/auth", data=form).status_code == 302
+        resp = client.post("/auth", data={**form, "email": "victim@example.com"})
+        assert resp.status_code == 429
+        assert int(resp.headers["Retry-After"]) >= 1
+        assert len(calls) == 2
+
+    def test_other_account_not_affected(self, limited_app):
+        """アカウント単位の上限は別のメールアドレスには影響しない。"""
+        client = limited_app.test_client()
+        for _ in range(3):
+            client.post("/auth", data={"email": "a@example.com", "password": "x"})
+        resp = client.post("/auth", data={"email": "b@example.com", "password": "x"})
+        assert resp.status_code == 302
+
+    def test_write_limit_returns_json_for_ajax(self, limited_app, registered_user):
+        """書き込み系の上限超過は、AJAX リクエストには JSON の 429 を返す。"""
+        headers = {"Accept": "application/json"}
+        data = {"title": "T", "comment": "C"}
+        assert registered_user.post("/create_diary", data=data, headers=headers).status_code == 200
+        resp = registered_user.post("/create_diary", data=data, headers=headers)
+        assert resp.status_code == 429
+        assert "error" in resp.get_json()
+
+    def test_write_limit_checked_before_login_lookup(self, limited_app, registered_user, monkeypatch):
+        """上限を超えた書き込みは、ログイン確認のユーザー読み込みより先に断る。"""
+        data = {"title": "T", "comment": "C"}
+        registered_user.post("/create_diary", data=data)
+        lookups = []
+        get_identity = User.get_identity
+        monkeypatch.setattr(User, "get_identity", lambda user_id: lookups.append(user_id) or get_identity(user_id))
+        assert registered_user.post("/create_diary", data=data).status_code == 429
+        assert lookups == []
@@ -0,0 +1,162 @@
+"""flask serve の prefork サーバーのテスト。実際に fork したマスター・ワーカーに HTTP で接続する。"""
+import os
+import signal
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from flask import session
+
+from app import cli, server
+from app.db import db
+from app.services import hash_pool
+
+
+def _get(url: str) -> str:
+    with urllib.request.urlopen(url, timeout=10) as resp:
+        return resp.read().decode()
+
+
+def _open_events(url: str):
+    """/events（/diary/events と同じ SSE の応答）を開き、購読が始まるまで読む。"""
+    request = urllib.request.Request(f"{url}/events", headers={"Accept": "text/event-stream"})
+    resp = urllib.request.urlopen(request, timeout=10)
+    assert resp.readline().startswith(b"retry:")
+    assert resp.readline() == b"\n"
+    return resp
+
+
+@pytest.fixture
+def start_server(app):
+    """fork したマスタープロセスでサーバーを起動し、(マスターの pid, URL) を返す関数。"""
+    app.add_url_rule("/pid", "pid", lambda: str(os.getpid()))
+    app.add_url_rule("/slow", "slow", lambda: time.sleep(0.5) or "done")
+    # ワーカーは接続プールを作り直すため、インメモリのテスト DB のユーザーでは
+    # ログインできない。ログインの確認を除いた /diary/events の本体を公開する。
+    diary_events = app.view_functions["diary.diary_events"].__wrapped__
+
+    def events():
+        session["user_id"] = 1
+        return diary_events()
+
+    app.add_url_rule("/events", "events", events)
+    masters = []
+
+    def start(workers: int, streams: int = 2):
+        listener = server.listen("127.0.0.1", 0)
+        port = listener.getsockname()[1]
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                server.serve(app, listener, workers=workers, threads=2, graceful_timeout=5, streams=streams)
+                code = 0
+            finally:
+                os._exit(code)
+        listener.close()
+        masters.append(pid)
+        return pid, f"http://127.0.0.1:{port}"
+
+    yield start
+    for pid in masters:
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass  # テストの中で停止・回収済み
+
+
+def test_requests_are_served_by_workers(start_server):
+    master, url = start_server(workers=2)
+    pids = {int(_get(f"{url}/pid")) for _ in range(10)}
+    assert master not in pids
+    assert os.getpid() not in pids
+
+
+def test_crashed_worker_is_restarted(start_server):
+    _, url = start_server(workers=1)
+    first = int(_get(f"{url}/pid"))
+    os.kill(first, signal.SIGKILL)
+    # 代わりのワーカーが起動するまで、接続は待ち行列で待たされる
+    second = int(_get(f"{url}/pid"))
+    assert second != first
+
+
+def test_sigterm_drains_in_flight_requests(start_server):
+    master, url = start_server(workers=2)
+    results = []
+    request = threading.Thread(target=lambda: results.append(_get(f"{url}/slow")))
+    request.start()
+    time.sleep(0.2)
+
+    os.kill(master, signal.SIGTERM)
+    request.join(timeout=10)
+    _, status = os.waitpid(master, 0)
+
+    assert results == ["done"]
+    assert os.waitstatus_to_exitcode(status) == 0
+    with pytest.raises(OSError):
+        _get(f"{url}/pid")
+
+
+def test_event_streams_do_not_take_request_threads(start_server):
+    """SSE の接続は threads とは別枠。別枠が埋まったら 503 と Retry-After を返す。"""
+    _, url = start_server(workers=1, streams=2)
+    # threads=2 と同じ数の接続を開いても、通常のリクエストは処理される
+    streams = [_open_events(url) for _ in range(2)]
+    try:
+        assert _get(f"{url}/pid")
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            _open_events(url)
+        assert excinfo.value.code == 503
+        assert excinfo.value.headers["Retry-After"] == str(server.STREAM_RETRY_AFTER)
+    finally:
+        for resp in streams:
+            resp.close()
+
+
+def test_sigterm_closes_event_streams(start_server):
+    """開いたままの SSE 接続があっても、graceful_timeout まで待たずに止まる。"""
+    master, url = start_server(workers=1)
+    stream = _open_events(url)
+    started = time.monotonic()
+    os.kill(master, signal.SIGTERM)
+    _, status = os.waitpid(master, 0)
+
+    assert time.monotonic() - started < 3  # graceful_timeout=5
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert stream.read() == b""  # サーバー側から閉じられている
+    stream.close()
+
+
+def test_worker_gets_its_own_connection_pool(app):
+    """fork 後、親から複製された接続を使わないよう接続プールを作り直す。"""
+    pool = db.engine.pool
+    server._reinitialize_after_fork(app)
+    assert db.engine.pool is not pool
+
+
+@pytest.mark.parametrize("env, configured, workers, expected", [
+    (None, 8, 4, 2),     # 既定のコア数をワーカー数で割る
+    (None, 8, 16, 1),    # ワーカーがコア数より多くても最低1
+    (None, 0, 4, 0),     # リクエストスレッド内で計算する設定はそのまま
+    ("8", 8, 4, 8),      # 環境変数で明示した値はそのまま
+])
+def test_serve_shares_hash_pool_between_workers(app, monkeypatch, env, configured, workers, expected):
+    """PASSWORD_HASH_WORKERS を指定しなければ、全ワーカーの合計が CPU コア数を超えない。"""
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    if env is None:
+        monkeypatch.delenv("PASSWORD_HASH_WORKERS", raising=False)
+    else:
+        monkeypatch.setenv("PASSWORD_HASH_WORKERS", env)
+    app.config["PASSWORD_HASH_WORKERS"] = configured
+    hash_pool.configure(configured, app.config["PASSWORD_HASH_QUEUE_LIMIT"])
+    try:
+        cli._share_hash_pool(app, workers)
+        assert app.config["PASSWORD_HASH_WORKERS"] == expected
+        assert hash_pool.stats()["workers"] == expected
+    finally:
+        hash_pool.configure(0, app.config["PASSWORD_HASH_QUEUE_LIMIT"])
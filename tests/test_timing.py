@@ -0,0 +1,64 @@
+import json
+import logging
+
+import pytest
+
+from app import timing
+
+
+class TestServerTiming:
+    def test_header_reports_queries_and_render_time(self, registered_user):
+        registered_user.get("/get_json")  # ログイン中ユーザーの情報をキャッシュに載せる
+        resp = registered_user.get("/get_json")
+        header = resp.headers["Server-Timing"]
+        assert 'desc="2 queries"' in header
+        assert "render;dur=" in header and "app;dur=" in header
+
+        resp = registered_user.get("/dashboard")
+        render = resp.headers["Server-Timing"].split("render;dur=")[1].split(",")[0]
+        assert float(render) > 0
+
+    def test_header_disabled(self, app, registered_user):
+        app.config["SERVER_TIMING_ENABLED"] = False
+        assert "Server-Timing" not in registered_user.get("/get_json").headers
+
+
+def _events(caplog, name):
+    return [json.loads(r.getMessage()) for r in caplog.records
+            if r.name == "app.timing" and json.loads(r.getMessage())["event"] == name]
+
+
+class TestSlowLogs:
+    def test_slow_query_is_logged_without_parameter_values(self, app, caplog):
+        caplog.set_level(logging.WARNING, logger="app.timing")
+        timing.record_query(
+            "SELECT * FROM users\n WHERE email = ?", ("secret@example.com",), False, 0.2, 0.1
+        )
+        (event,) = _events(caplog, "slow_query")
+        assert event["statement"] == "SELECT * FROM users WHERE email = ?"
+        assert event["parameters"] == ["str"]
+        assert "secret@example.com" not in caplog.text
+
+    def test_fast_query_is_not_logged(self, caplog):
+        caplog.set_level(logging.WARNING, logger="app.timing")
+        timing.record_query("SELECT 1", (), False, 0.01, 0.1)
+        assert not _events(caplog, "slow_query")
+
+    def test_slow_request_log(self, app, registered_user, caplog):
+        registered_user.get("/get_json")
+        app.config["SLOW_REQUEST_MS"] = 0
+        caplog.set_level(logging.WARNING, logger="app.timing")
+        registered_user.get("/get_json")
+        (event,) = _events(caplog, "slow_request")
+        assert event["path"] == "/get_json"
+        assert event["status"] == 200
+        assert event["queries"] == 2
+
+
+@pytest.mark.parametrize("parameters, executemany, expected", [
+    ((1, "a", None), False, ["int", "str", "NoneType"]),
+    ({"email": "x@example.com"}, False, {"email": "str"}),
+    ([(1,), (2,), (3,)], True, {"rows": 3}),
+])
+def test_redact_parameters(parameters, executemany, expected):
+    assert timing.redact_parameters(parameters, executemany) == expected
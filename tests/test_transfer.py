@@ -0,0 +1,138 @@
+"""NDJSON による日記のインポート・エクスポートのテスト。"""
+import gzip
+import io
+import json
+
+from app.services.auth_service import register_user
+from app.services.diary_service import create_diary_entry, get_user_diaries
+from app.services import transfer_service
+from app.services.transfer_service import export_user_diaries, import_user_diaries
+
+
+def _ndjson(*records) -> bytes:
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode()
+
+
+class TestTransferService:
+    def test_export_then_import_roundtrip(self, app):
+        """エクスポートした NDJSON を別ユーザーに取り込むと同じ内容になる。"""
+        src = register_user("ian", "ian@example.com", "password123")
+        dst = register_user("jan", "jan@example.com", "password123")
+        create_diary_entry(src.id, "一つ目", "本文1")
+        create_diary_entry(src.id, "二つ目", "本文2")
+
+        exported = "".join(export_user_diaries(src.id)).encode()
+        result = import_user_diaries(dst.id, io.BytesIO(exported))
+
+        assert result == {"imported": 2, "error_count": 0, "errors": []}
+        key = lambda d: (d["title"], d["comment"], d["created_at"])
+        assert sorted(map(key, get_user_diaries(dst.id))) == sorted(map(key, get_user_diaries(src.id)))
+
+    def test_import_gzip(self, app):
+        """gzip 圧縮された NDJSON は自動で展開される。"""
+        user = register_user("kai", "kai@example.com", "password123")
+        body = gzip.compress(_ndjson({"title": "圧縮", "comment": "gzip"}))
+        result = import_user_diaries(user.id, io.BytesIO(body))
+        assert result["imported"] == 1
+        assert get_user_diaries(user.id)[0]["title"] == "圧縮"
+
+    def test_import_reports_invalid_lines_and_continues(self, app):
+        """不正な行はスキップして行番号付きで報告し、他の行は取り込む。"""
+        user = register_user("lou", "lou@example.com", "password123")
+        body = (
+            _ndjson({"title": "OK", "comment": "fine"})
+            + b"{broken json\n"
+            + _ndjson(
+                {"title": "", "comment": "empty title"},
+                {"title": "Bad date", "comment": "x", "created_at": "yesterday"},
+                {"title": "OK2", "comment": "fine", "created_at": "2024-01-02 03:04:05"},
+            )
+        )
+        result = import_user_diaries(user.id, io.BytesIO(body))
+        assert result["imported"] == 2
+        assert result["error_count"] == 3
+        assert [e["line"] for e in result["errors"]] == [2, 3, 4]
+
+    def test_import_truncated_gzip_reports_error(self, app, monkeypatch):
+        """途中で切れた gzip は、読めた行だけ取り込んで途切れた位置を報告する。"""
+        monkeypatch.setattr(transfer_service, "IMPORT_BATCH_SIZE", 2)
+        user = register_user("pia", "pia@example.com", "password123")
+        records = [{"title": f"t{i}", "comment": "本文" * 200 + str(i)} for i in range(50)]
+        body = gzip.compress(_ndjson(*records))
+        result = import_user_diaries(user.id, io.BytesIO(body[: len(body) // 2]))
+
+        assert 0 < result["imported"] < 50
+        assert result["imported"] == len(get_user_diaries(user.id))
+        assert "途中で途切れて" in result["errors"][-1]["error"]
+        assert result["error_count"] == len(result["errors"])
+
+    def test_import_commits_in_batches(self, app, monkeypatch):
+        """バッチサイズを超える件数も全件取り込まれる。"""
+        monkeypatch.setattr(transfer_service, "IMPORT_BATCH_SIZE", 2)
+        user = register_user("max", "max@example.com", "password123")
+        body = _ndjson(*({"title": f"T{i}", "comment": "c"} for i in range(5)))
+        assert import_user_diaries(user.id, io.BytesIO(body))["imported"] == 5
+        assert len(get_user_diaries(user.id)) == 5
+
+
+class TestTransferRoutes:
+    def test_export_ndjson(self, registered_user):
+        """GET /export_ndjson は NDJSON を添付ファイルとして返す。"""
+        registered_user.post("/create_diary", data={"title": "T", "comment": "C"})
+        resp = registered_user.get("/export_ndjson")
+        assert resp.mimetype == "application/x-ndjson"
+        assert "attachment" in resp.headers["Content-Disposition"]
+        assert json.loads(resp.data.decode().splitlines()[0])["title"] == "T"
+
+    def test_export_ndjson_gzip(self, registered_user):
+        """?gzip=1 なら gzip 圧縮された NDJSON を返す。"""
+        registered_user.post("/create_diary", data={"title": "T", "comment": "C"})
+        resp = registered_user.get("/export_ndjson?gzip=1")
+        lines = gzip.decompress(resp.data).decode().splitlines()
+        assert json.loads(lines[0])["comment"] == "C"
+
+    def test_import_ndjson(self, registered_user):
+        """POST /import_ndjson で本文の NDJSON を取り込める。"""
+        resp = registered_user.post(
+            "/import_ndjson",
+            data=_ndjson({"title": "Imported", "comment": "body"}),
+            content_type="application/x-ndjson",
+        )
+        assert json.loads(resp.data)["imported"] == 1
+        diaries = json.loads(registered_user.get("/get_json").data)["diaries"]
+        assert diaries[0]["title"] == "Imported"
+
+    def test_import_corrupt_gzip_is_not_server_error(self, registered_user):
+        body = gzip.compress(_ndjson({"title": "t", "comment": "c"}))
+        corrupt = body[:12] + b"\x00" * 8 + body[20:]
+        resp = registered_user.post("/import_ndjson", data=corrupt,
+                                    content_type="application/x-ndjson")
+        assert resp.status_code == 200
+        assert resp.get_json()["error_count"] == 1
+
+    def test_import_overlong_line_is_reported(self, registered_user):
+        """上限を超える長さの行は、その行のエラーとして報告し、前後の行は取り込む。"""
+        overlong = {"title": "long", "comment": "x" * transfer_service.IMPORT_MAX_LINE_BYTES}
+        body = _ndjson({"title": "a", "comment": "c"}, overlong, {"title": "b", "comment": "c"})
+        resp = registered_user.post("/import_ndjson", data=body, content_type="application/x-ndjson")
+        assert resp.status_code == 200
+        result = resp.get_json()
+        assert result["imported"] == 2
+        assert [e["line"] for e in result["errors"]] == [2]
+        assert "バイト以内" in result["errors"][0]["error"]
+
+
+class TestTransferCommands:
+    def test_export_and_import_commands(self, app, tmp_path):
+        """flask export-diaries / import-diaries でファイル経由の移行ができる。"""
+        src = register_user("ned", "ned@example.com", "password123")
+        register_user("oli", "oli@example.com", "password123")
+        create_diary_entry(src.id, "CLI", "content")
+        path = tmp_path / "backup.ndjson.gz"
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["export-diaries", "ned@example.com", "-o", str(path), "--gzip"])
+        assert result.exit_code == 0
+        result = runner.invoke(args=["import-diaries", "oli@example.com", str(path)])
+        assert result.exit_code == 0
+        assert "Imported 1 entries" in result.output